@@ -0,0 +1,242 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+__author__ = 'Donovan Parks'
+__copyright__ = 'Copyright 2015'
+__credits__ = ['Donovan Parks']
+__license__ = 'GPL3'
+__maintainer__ = 'Donovan Parks'
+__email__ = 'donovan.parks@gmail.com'
+
+import sys
+import logging
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+
+from refinem.kmer_signature import KmerSignature
+from refinem.parallel_fasta import ParallelFasta
+
+
+class Chimeras(object):
+    """Identify putative chimeric scaffolds from windowed tetranucleotide signatures.
+
+    Tetranucleotide signatures are calculated for sliding windows
+    along each scaffold. For each window, the tetranucleotide distance (TD)
+    to the signature of the whole scaffold and to the adjacent, preceding
+    window are reported. Window boundaries where the TD between the
+    preceding and following window exceeds a threshold, and is the
+    largest TD within a window length, are flagged as likely breakpoints.
+    """
+
+    def __init__(self, cpus=1):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of cpus to use.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.cpus = cpus
+
+        self.kmer_signature = KmerSignature(4)
+
+    def window_tds(self, seq, window_size, step_size, td_threshold):
+        """Calculate TD of windows along a sequence.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+        window_size : int
+            Size of windows (a multiple of step_size).
+        step_size : int
+            Number of bases between the start of consecutive windows.
+        td_threshold : float
+            Minimum TD between adjacent windows to flag a breakpoint.
+
+        Returns
+        -------
+        numpy.ndarray
+            TD of each window to the signature of the whole sequence.
+        numpy.ndarray
+            TD of each window to the adjacent, preceding window (NaN for the first windows).
+        numpy.ndarray
+            Flag indicating if a breakpoint is at the start of each window.
+        """
+
+        counts = self.kmer_signature.window_counts(seq, window_size, step_size).astype(np.float64)
+        window_sigs = counts / np.maximum(counts.sum(axis=1), 1)[:, np.newaxis]
+        seq_sig = self.kmer_signature.seq_signature(seq)
+
+        td_seq = np.abs(window_sigs - seq_sig).sum(axis=1)
+
+        # windows starting at the end of a window do not overlap it
+        blocks_per_window = window_size // step_size
+        td_prev = np.empty(len(window_sigs))
+        td_prev.fill(np.nan)
+        breakpoints = np.zeros(len(window_sigs), dtype=bool)
+        if len(window_sigs) > blocks_per_window:
+            adjacent_tds = np.abs(window_sigs[blocks_per_window:] - window_sigs[0:-blocks_per_window]).sum(axis=1)
+            td_prev[blocks_per_window:] = adjacent_tds
+
+            local_max = maximum_filter1d(adjacent_tds, size=2 * blocks_per_window + 1, mode='constant') == adjacent_tds
+            breakpoints[blocks_per_window:] = local_max & (adjacent_tds >= td_threshold)
+
+        return td_seq, td_prev, breakpoints
+
+    def _producer(self, seq_info):
+        """Calculate TD of windows along a scaffold.
+
+        Parameters
+        ----------
+        seq_info : (str, str)
+            Unique id of scaffold and its sequence.
+
+        Returns
+        -------
+        str
+            Unique id of scaffold.
+        tuple
+            Length of scaffold, TD of windows to scaffold, TD of windows to preceding window,
+            and breakpoint flags, or None if the scaffold is below the length threshold.
+        """
+
+        seq_id, seq = seq_info
+
+        if len(seq) < self.min_scaffold_len or len(seq) < self.window_size:
+            return (seq_id, None)
+
+        return (seq_id, (len(seq),) + self.window_tds(seq, self.window_size, self.step_size, self.td_threshold))
+
+    def _consumer(self, produced_data, consumer_data):
+        """Consume results from producer processes.
+
+        Parameters
+        ----------
+        produced_data : (str, tuple)
+            Unique id of scaffold and TD of its windows.
+        consumer_data : d[seq_id] -> TD of windows
+            TD of windows for each processed scaffold.
+
+        Returns
+        -------
+        consumer_data: dict
+            The consumer data structure or None must be returned
+        """
+
+        if consumer_data == None:
+            consumer_data = {}
+
+        seq_id, window_data = produced_data
+        if window_data is not None:
+            consumer_data[seq_id] = window_data
+
+        return consumer_data
+
+    def _progress(self, processed_items, total_items):
+        """Report progress of consumer processes.
+
+        Parameters
+        ----------
+        processed_items : int
+            Number of sequences processed.
+        total_items : int
+            Total number of sequences to process.
+
+        Returns
+        -------
+        str
+            String indicating progress of data processing.
+        """
+
+        if self.logger.is_silent:
+            return None
+        else:
+            return '  Finished processing %d of %d (%.2f%%) sequences.' % (processed_items, total_items, float(processed_items) * 100 / total_items)
+
+    def run(self, scaffold_file, window_size, step_size, min_scaffold_len, td_threshold, window_file, breakpoint_file):
+        """Identify breakpoints in tetranucleotide signatures along scaffolds.
+
+        Parameters
+        ----------
+        scaffold_file : str
+            Fasta file containing scaffolds.
+        window_size : int
+            Size of windows (a multiple of step_size).
+        step_size : int
+            Number of bases between the start of consecutive windows.
+        min_scaffold_len : int
+            Minimum length of scaffolds to process.
+        td_threshold : float
+            Minimum TD between adjacent windows to flag a breakpoint.
+        window_file : str
+            Output file with TD of each window.
+        breakpoint_file : str
+            Output file with flagged breakpoints.
+        """
+
+        if step_size <= 0 or window_size < step_size or window_size % step_size != 0:
+            self.logger.error('Window size must be a multiple of the step size.')
+            sys.exit()
+
+        self.window_size = window_size
+        self.step_size = step_size
+        self.min_scaffold_len = min_scaffold_len
+        self.td_threshold = td_threshold
+
+        self.logger.info('Calculating tetranucleotide signatures of %d bp windows along scaffolds:' % window_size)
+        parallel = ParallelFasta(self.cpus)
+        window_data = parallel.run_seqs_file(self._producer, self._consumer, scaffold_file, self._progress)
+        if window_data is None:
+            window_data = {}
+
+        fout_windows = open(window_file, 'w')
+        fout_windows.write('Scaffold id\tWindow start\tWindow end\tTD to scaffold\tTD to preceding window\tBreakpoint\n')
+
+        fout_breakpoints = open(breakpoint_file, 'w')
+        fout_breakpoints.write('Scaffold id\tScaffold length (bp)\tBreakpoint position\tTD between adjacent windows\n')
+
+        num_breakpoints = 0
+        chimeric_scaffolds = 0
+        for seq_id in sorted(window_data):
+            scaffold_len, td_seq, td_prev, breakpoints = window_data[seq_id]
+            for i in xrange(len(td_seq)):
+                start = i * step_size
+                fout_windows.write('%s\t%d\t%d\t%.4f' % (seq_id, start + 1, start + window_size, td_seq[i]))
+                if np.isnan(td_prev[i]):
+                    fout_windows.write('\tNA')
+                else:
+                    fout_windows.write('\t%.4f' % td_prev[i])
+                fout_windows.write('\t%s\n' % breakpoints[i])
+
+            for i in np.flatnonzero(breakpoints):
+                fout_breakpoints.write('%s\t%d\t%d\t%.4f\n' % (seq_id, scaffold_len, i * step_size, td_prev[i]))
+
+            num_breakpoints += breakpoints.sum()
+            if breakpoints.any():
+                chimeric_scaffolds += 1
+
+        fout_windows.close()
+        fout_breakpoints.close()
+
+        self.logger.info('Identified %d breakpoints in %d of %d processed scaffolds.' % (num_breakpoints,
+                                                                                          chimeric_scaffolds,
+                                                                                          len(window_data)))
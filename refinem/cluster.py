@@ -34,10 +34,13 @@ from numpy import (where as np_where,
 from biolib.common import remove_extension
 from biolib.pca import PCA
 import biolib.seq_io as seq_io
-from biolib.genomic_signature import GenomicSignature
 
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, svds
 from scipy.cluster.vq import whiten, kmeans2, ClusterError
 
+from refinem.kmer_signature import KmerSignature
+
 
 class Cluster():
     """Partition genome into distinct clusters."""
@@ -58,10 +61,13 @@ class Cluster():
 
         Parameters
         ----------
-        data_matrix : list of lists
-          List of tetranucleotide signatures
+        data_matrix : list of lists or scipy.sparse.csr_matrix
+          List of genomic signatures
         """
 
+        if sparse.issparse(data_matrix):
+            return self._sparse_pca(data_matrix)
+
         cols = len(data_matrix[0])
         data_matrix = np_reshape(np_array(data_matrix), (len(data_matrix), cols))
 
@@ -78,6 +84,66 @@ class Cluster():
 
         return pc, variance
 
+    def _sparse_pca(self, data_matrix):
+        """Perform PCA of a sparse data matrix.
+
+        The data matrix is centered implicitly so it is
+        never converted to a dense matrix.
+
+        Parameters
+        ----------
+        data_matrix : scipy.sparse.csr_matrix
+          Genomic signatures
+        """
+
+        data_matrix = data_matrix.astype(float)
+        rows, cols = data_matrix.shape
+        col_mean = np_array(data_matrix.mean(axis=0)).ravel()
+        row_ones = np_ones(rows)
+
+        centered = LinearOperator((rows, cols),
+                                  matvec=lambda v: data_matrix.dot(v.ravel()) - row_ones * col_mean.dot(v.ravel()),
+                                  rmatvec=lambda v: data_matrix.T.dot(v.ravel()) - col_mean * v.sum(),
+                                  dtype=float)
+
+        num_components = min(3, min(rows, cols) - 1)
+        u, d, _vt = svds(centered, k=num_components)
+        order = d.argsort()[::-1]
+        pc = u[:, order] * d[order]
+
+        total_variance = data_matrix.multiply(data_matrix).sum() - rows * (col_mean ** 2).sum()
+        variance = d[order] ** 2 / total_variance
+
+        if pc.shape[1] < 3:
+            pc = np_append(pc, np_zeros((pc.shape[0], 3 - pc.shape[1])), 1)
+            variance = np_append(variance, np_ones(3 - len(variance)))
+
+        return pc, variance
+
+    def _profiled_seqs(self, scaffold_stats, seqs):
+        """Remove sequences without coverage profiles or signatures.
+
+        Parameters
+        ----------
+        scaffold_stats : ScaffoldStats
+            Statistics for individual scaffolds.
+        seqs : d[seq_id] -> seq
+            Sequences being clustered.
+
+        Returns
+        -------
+        d[seq_id] -> seq
+            Sequences with coverage profiles and signatures.
+        """
+
+        unprofiled_ids = [seq_id for seq_id in seqs if not scaffold_stats.has_profiles(seq_id)]
+        if unprofiled_ids:
+            self.logger.warning('Ignoring %d scaffolds without coverage profiles or signatures.' % len(unprofiled_ids))
+            for seq_id in unprofiled_ids:
+                del seqs[seq_id]
+
+        return seqs
+
     def kmeans(self, 
                 scaffold_stats, 
                 num_clusters, 
@@ -87,7 +153,8 @@ class Cluster():
                 no_pca,
                 iterations,
                 genome_file, 
-                output_dir):
+                output_dir,
+                cache_dir=None):
         """Cluster genome with k-means.
 
         Parameters
@@ -110,14 +177,15 @@ class Cluster():
             Sequences being clustered.
         output_dir : str
             Directory to write results.
+        cache_dir : str
+            Directory for caching genomic signatures with K != 4 (None to disable caching).
         """
 
         # get GC and mean coverage for each scaffold in genome
         self.logger.info('Determining mean coverage and genomic signatures.')
-        signatures = GenomicSignature(K)
         genome_stats = []
         signature_matrix = []
-        seqs = seq_io.read(genome_file)
+        seqs = self._profiled_seqs(scaffold_stats, seq_io.read(genome_file))
         for seq_id, seq in seqs.iteritems():
             stats = scaffold_stats.stats[seq_id]
 
@@ -126,16 +194,14 @@ class Cluster():
             else:
                 genome_stats.append(())
 
-            if K == 0:
-                pass
-            elif K == 4:
+            if K == 4:
                 signature_matrix.append(stats.signature)
-            else:
-                sig = signatures.seq_signature(seq)
-                total_kmers = sum(sig)
-                for i in xrange(0, len(sig)):
-                    sig[i] = float(sig[i]) / total_kmers
-                signature_matrix.append(sig)
+
+        if K != 0 and K != 4:
+            kmer_signature = KmerSignature(K)
+            signature_matrix = kmer_signature.cached_signature_matrix(seqs.keys(),
+                                                                      seqs.values(),
+                                                                      cache_dir)
 
         # calculate PCA of signatures
         if K != 0:
@@ -148,6 +214,9 @@ class Cluster():
                     genome_stats[i] = np_append(stats, pc[i][0:num_components])
             else:
                 self.logger.info('Using complete genomic signature.')
+                if sparse.issparse(signature_matrix):
+                    signature_matrix = signature_matrix.toarray()
+
                 for i, stats in enumerate(genome_stats):
                     genome_stats[i] = np_append(stats, signature_matrix[i])
 
@@ -226,14 +295,12 @@ class Cluster():
             Directory to write results.
         """
         
-        seqs = seq_io.read(genome_file)
+        seqs = self._profiled_seqs(scaffold_stats, seq_io.read(genome_file))
         
         # calculate PCA if necessary
         if 'pc' in criteria1 or 'pc' in criteria2:
             self.logger.info('Performing PCA.')
-            signatures = GenomicSignature(K)
             signature_matrix = []
-            seqs = seq_io.read(genome_file)
             for seq_id, seq in seqs.iteritems():
                 stats = scaffold_stats.stats[seq_id]
 
@@ -22,10 +22,151 @@ __license__ = 'GPL3'
 __maintainer__ = 'Donovan Parks'
 __email__ = 'donovan.parks@gmail.com'
 
+import gzip
+
+import numpy as np
+
 from biolib.common import remove_extension
 
 import biolib.seq_io as seq_io
 
+from refinem.parallel_fasta import index_fasta
+
+
+class ScaffoldIdIndex(object):
+    """Read-only mapping from scaffold ids to rows.
+
+    Scaffold ids are located with a binary search of
+    sorted ids, so the index can be memory-mapped from a
+    binary statistics or signature file instead of being
+    rebuilt as a dict.
+    """
+
+    def __init__(self, sorted_ids, sorted_rows):
+        """Initialization.
+
+        Parameters
+        ----------
+        sorted_ids : numpy.ndarray
+            Scaffold ids in sorted order.
+        sorted_rows : numpy.ndarray
+            Row of each sorted scaffold id.
+        """
+
+        self.sorted_ids = sorted_ids
+        self.sorted_rows = sorted_rows
+
+    def _find(self, scaffold_id):
+        if len(scaffold_id) > self.sorted_ids.dtype.itemsize:
+            return None
+
+        index = np.searchsorted(self.sorted_ids, scaffold_id)
+        if index < len(self.sorted_ids) and self.sorted_ids[index] == scaffold_id:
+            return int(self.sorted_rows[index])
+
+        return None
+
+    def __getitem__(self, scaffold_id):
+        row = self._find(scaffold_id)
+        if row is None:
+            raise KeyError(scaffold_id)
+
+        return row
+
+    def __contains__(self, scaffold_id):
+        return self._find(scaffold_id) is not None
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+    def get(self, scaffold_id, default=None):
+        row = self._find(scaffold_id)
+        if row is None:
+            return default
+
+        return row
+
+
+def read_seq_ids(seq_file):
+    """Read identifiers of sequences in a FASTA file.
+
+    Only header lines are parsed, so the sequences
+    themselves are never assembled in memory.
+
+    Parameters
+    ----------
+    seq_file : str
+        Name of fasta/q file to read (may be gzipped).
+
+    Returns
+    -------
+    list
+        Identifiers of sequences in file order.
+    """
+
+    if seq_file.endswith(('.fq', '.fastq', '.fq.gz', '.fastq.gz')):
+        return [seq_id for seq_id, _seq in seq_io.read_seq(seq_file)]
+
+    open_file = open
+    if seq_file.endswith('.gz'):
+        open_file = gzip.open
+
+    seq_ids = []
+    with open_file(seq_file) as f:
+        for line in f:
+            if line[0] == '>':
+                seq_ids.append(line[1:].split(None, 1)[0])
+
+    return seq_ids
+
+
+def select_scaffolds(scaffold_file, genome_files, min_seq_len=0, binned_only=False):
+    """Select scaffolds to process.
+
+    Parameters
+    ----------
+    scaffold_file : str
+        Fasta file containing scaffolds.
+    genome_files : list of str
+        Fasta files with binned scaffolds.
+    min_seq_len : int
+        Ignore scaffolds shorter than the specified length.
+    binned_only : boolean
+        Flag indicating if only binned scaffolds should be selected.
+
+    Returns
+    -------
+    set
+        Identifiers of selected scaffolds, or None if all scaffolds are selected.
+    """
+
+    if min_seq_len <= 0 and not binned_only:
+        return None
+
+    binned_seq_ids = None
+    if binned_only:
+        binned_seq_ids = set()
+        for gf in genome_files:
+            binned_seq_ids.update(read_seq_ids(gf))
+
+    # take sequence lengths from the FASTA index when possible
+    seq_lens = index_fasta(scaffold_file)
+    if seq_lens is None:
+        seq_lens = ((seq_id, len(seq)) for seq_id, seq in seq_io.read_seq(scaffold_file))
+
+    selected_ids = set()
+    for seq_id, seq_len in seq_lens:
+        if seq_len < min_seq_len:
+            continue
+
+        if binned_seq_ids is not None and seq_id not in binned_seq_ids:
+            continue
+
+        selected_ids.add(seq_id)
+
+    return selected_ids
+
+
 def concatenate_gene_files(gene_files, concatenated_gene_file):
     """Combine all gene files into a single file.
 
@@ -24,13 +24,24 @@ import os
 import multiprocessing as mp
 import logging
 import ntpath
+import time
+import hashlib
+import json
 import traceback
+import zlib
+import Queue
 from collections import defaultdict
 
 import pysam
 
-from biolib.common import remove_extension
+import numpy as np
 
+from scipy.stats import trim_mean
+
+from biolib.common import remove_extension, make_sure_path_exists
+import biolib.seq_io as seq_io
+
+from refinem.common import ScaffoldIdIndex
 from refinem.errors import ParsingError
 
 
@@ -69,123 +80,766 @@ class ReadLoader:
             self.coverage += read.alen
 
 
-class CoverageStruct():
-    """Coverage information for scaffolds."""
+# per-scaffold read counters recorded for each BAM file
+NUM_READS, NUM_DUPLICATES, NUM_SECONDARY, NUM_FAILED_QC, \
+    NUM_FAILED_ALIGN_LEN, NUM_FAILED_EDIT_DIST, NUM_FAILED_PROPER_PAIR, \
+    NUM_MAPPED_READS = range(8)
+NUM_COUNTERS = 8
+
+# names of read counters in QC reports
+COUNTER_NAMES = ['total_reads',
+                    'duplicate_reads',
+                    'secondary_reads',
+                    'failed_qc_reads',
+                    'failed_align_len_reads',
+                    'failed_edit_dist_reads',
+                    'not_proper_pair_reads',
+                    'mapped_reads']
+
+# header line marking coverage profiles estimated from BAM index statistics
+APPROXIMATE_HEADER = '# Approximate coverage estimated from BAM index statistics (coverage mode: fast)'
+
+# header line marking coverage profiles estimated from a sample of regions
+SAMPLE_HEADER = '# Approximate coverage estimated from reads in %.4g%% of each scaffold (coverage mode: sample)'
+
+# size of regions along scaffolds from which reads are sampled
+SAMPLE_REGION_SIZE = 2000
+
+# reads which are unmapped, secondary, failing QC, duplicates,
+# or supplementary alignments do not link scaffolds
+LINK_EXCLUDE_FLAGS = 0x4 | 0x100 | 0x200 | 0x400 | 0x800
+
+# z-score of two-sided 95% confidence interval
+CI_Z_SCORE = 1.96
 
-    def __init__(self, seq_len, mapped_reads, coverage):
-        self.seq_len = seq_len
-        self.mapped_reads = mapped_reads
-        self.coverage = coverage
+# proportion of bases cut from each end of the sorted per-base
+# depths when calculating the trimmed mean depth of a scaffold
+DEPTH_TRIM = 0.1
 
 
 class Coverage():
     """Calculate coverage of all sequences."""
 
-    def __init__(self, cpus):
+    def __init__(self, cpus, reference_file=None, io_threads=1):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of worker processes.
+        reference_file : str
+            FASTA file with reference scaffolds, required to decode CRAM files.
+        io_threads : int
+            Number of htslib threads used by each worker to decompress reads.
+        """
+
         self.logger = logging.getLogger('timestamp')
         self.reporter = logging.getLogger('no_timestamp')
 
         self.cpus = cpus
+        self.reference_file = reference_file
+        self.io_threads = io_threads
+
+        self._depth_profiles = {}
+
+    def run(self, bam_files, out_file, all_reads, min_align_per, max_edit_dist_per, streaming=False, cache_dir=None, coverage_mode='exact', sample_fraction=0.05, window_size=None, selected_ids=None):
+        """Calculate coverage of sequences for each BAM file.
+
+        Only selected scaffolds are processed and written to the output
+        file. When regions are sampled, the 95% confidence interval of the
+        coverage of each scaffold is written to <out_file>_ci.tsv.
+        Windowed depth profiles are written to the <bam_id>.depth directory,
+        read filtering reports to <bam_id>.qc.json and <bam_id>.qc.tsv,
+        and the number of read pairs linking scaffolds to links.tsv
+        in the directory of the output file. Scaffold links are not
+        determined when regions are sampled.
+
+        Parameters
+        ----------
+        bam_files : list of str
+            BAM files to process.
+        out_file : str
+            Output file for coverage profiles.
+        all_reads : boolean
+            Flag indicating if all reads or just paired reads should be processed.
+        min_align_per : float
+            Alignment percentage threshold for accepting mapped reads.
+        max_edit_dist_per : float
+            Edit distance threshold for accepting mapped reads.
+        streaming : boolean
+            Flag indicating if each BAM file should be read in a single pass
+            instead of fetching the reads mapped to each scaffold.
+        cache_dir : str
+            Directory for caching coverage of each BAM file between runs.
+        coverage_mode : str
+            Calculate 'exact' coverage from all reads, a 'fast' approximation from
+            BAM index statistics, or a 'sample' estimate from reads in a fraction of each scaffold.
+        sample_fraction : float
+            Fraction of each scaffold to process when coverage is estimated from a sample of regions.
+        window_size : int
+            Size of windows for per-base depth profiles (None to skip depth profiles).
+        selected_ids : set
+            Identifiers of scaffolds to process (None to process all scaffolds).
+        """
+
+        ref_seq_ids, ref_seq_lens, coverage, coverage_ci, depth_profiles, qc_reports, links = self.calculate(bam_files,
+                                                                                                                all_reads,
+                                                                                                                min_align_per,
+                                                                                                                max_edit_dist_per,
+                                                                                                                streaming,
+                                                                                                                cache_dir,
+                                                                                                                coverage_mode,
+                                                                                                                sample_fraction,
+                                                                                                                window_size,
+                                                                                                                selected_ids)
+
+        bam_ids = [remove_extension(bam_file) for bam_file in bam_files]
+        if links is not None:
+            self.write_links(self._links_file(out_file), ref_seq_ids, links)
+
+        if qc_reports:
+            self._write_qc_reports(out_file, ref_seq_ids, ref_seq_lens, bam_ids, qc_reports)
+
+        if depth_profiles:
+            self._write_depth_profiles(out_file, ref_seq_ids, ref_seq_lens, bam_ids, window_size, depth_profiles)
+
+        rows = np.arange(len(ref_seq_ids))
+        if selected_ids is not None:
+            rows = np.array([i for i, seq_id in enumerate(ref_seq_ids) if seq_id in selected_ids], dtype=np.int64)
+        seq_ids = [ref_seq_ids[i] for i in rows]
+        seq_lens = [ref_seq_lens[i] for i in rows]
+
+        comments = self._mode_comments(coverage_mode, sample_fraction)
+        self.write(out_file, seq_ids, seq_lens, bam_ids, coverage[rows], comments)
+
+        if coverage_mode == 'sample':
+            self.write(self._ci_file(out_file), seq_ids, seq_lens, bam_ids, coverage_ci[rows], comments)
+
+    def append(self, coverage_file, bam_files, out_file, all_reads, min_align_per, max_edit_dist_per, streaming=False, cache_dir=None, coverage_mode='exact', sample_fraction=0.05, window_size=None):
+        """Add coverage of additional BAM files to existing coverage profiles.
+
+        Only the coverage of the additional BAM files is calculated. These
+        BAM files must be mapped against all scaffolds in the existing
+        coverage file, with identical lengths, and only these scaffolds
+        are processed. When regions are
+        sampled, the confidence intervals of the additional BAM files are
+        written to <out_file>_ci.tsv. Windowed depth profiles and read
+        filtering reports are written for the additional BAM files, and
+        their scaffold links are added to any links.tsv beside the
+        existing coverage file unless regions are sampled.
+
+        Parameters
+        ----------
+        coverage_file : str
+            File containing existing coverage profiles.
+        bam_files : list of str
+            Additional BAM files to process.
+        out_file : str
+            Output file for merged coverage profiles.
+        all_reads : boolean
+            Flag indicating if all reads or just paired reads should be processed.
+        min_align_per : float
+            Alignment percentage threshold for accepting mapped reads.
+        max_edit_dist_per : float
+            Edit distance threshold for accepting mapped reads.
+        streaming : boolean
+            Flag indicating if each BAM file should be read in a single pass
+            instead of fetching the reads mapped to each scaffold.
+        cache_dir : str
+            Directory for caching coverage of each BAM file between runs.
+        coverage_mode : str
+            Calculate 'exact' coverage from all reads, a 'fast' approximation from
+            BAM index statistics, or a 'sample' estimate from reads in a fraction of each scaffold.
+        sample_fraction : float
+            Fraction of each scaffold to process when coverage is estimated from a sample of regions.
+        window_size : int
+            Size of windows for per-base depth profiles (None to skip depth profiles).
+        """
+
+        seq_ids, seq_lens, bam_ids, coverage = self.read_table(coverage_file)
+        comments = self._header_comments(coverage_file)
+
+        new_bam_files = []
+        for bam_file in bam_files:
+            if remove_extension(bam_file) in bam_ids:
+                self.logger.warning('Coverage file already contains a coverage profile for %s.' % bam_file)
+            else:
+                new_bam_files.append(bam_file)
+
+        if new_bam_files:
+            ref_seq_ids, ref_seq_lens, new_coverage, new_coverage_ci, depth_profiles, qc_reports, links = self.calculate(new_bam_files,
+                                                                                                                            all_reads,
+                                                                                                                            min_align_per,
+                                                                                                                            max_edit_dist_per,
+                                                                                                                            streaming,
+                                                                                                                            cache_dir,
+                                                                                                                            coverage_mode,
+                                                                                                                            sample_fraction,
+                                                                                                                            window_size,
+                                                                                                                            set(seq_ids))
+
+            # make sure scaffolds in existing coverage file match those in BAM files
+            ref_index = dict((seq_id, i) for i, seq_id in enumerate(ref_seq_ids))
+            if any(seq_id not in ref_index for seq_id in seq_ids):
+                self.logger.error('Scaffolds in BAM files do not match those in coverage file: %s\n' % coverage_file)
+                sys.exit()
+
+            row_order = np.array([ref_index[seq_id] for seq_id in seq_ids], dtype=np.int64)
+            if np.any(np.array(ref_seq_lens)[row_order] != seq_lens):
+                self.logger.error('Length of scaffolds in BAM files do not match those in coverage file: %s\n' % coverage_file)
+                sys.exit()
+
+            coverage = np.hstack((coverage, new_coverage[row_order]))
+            new_bam_ids = [remove_extension(bam_file) for bam_file in new_bam_files]
+            bam_ids += new_bam_ids
+
+            if qc_reports:
+                self._write_qc_reports(out_file, ref_seq_ids, ref_seq_lens, new_bam_ids, qc_reports)
+
+            if links is not None:
+                prev_links_file = self._links_file(coverage_file)
+                if os.path.exists(prev_links_file):
+                    for (id1, id2), num_links in self.read_links(prev_links_file).iteritems():
+                        key = (ref_index[id1], ref_index[id2])
+                        if key[0] > key[1]:
+                            key = (key[1], key[0])
+                        links[key] = links.get(key, 0) + num_links
+                self.write_links(self._links_file(out_file), ref_seq_ids, links)
+
+            if depth_profiles:
+                self._write_depth_profiles(out_file, ref_seq_ids, ref_seq_lens, new_bam_ids, window_size, depth_profiles)
+
+            mode_comments = self._mode_comments(coverage_mode, sample_fraction)
+            comments += [c for c in mode_comments if c not in comments]
+
+            if coverage_mode == 'sample':
+                self.write(self._ci_file(out_file), seq_ids, seq_lens, new_bam_ids, new_coverage_ci[row_order], mode_comments)
+
+        self.write(out_file, seq_ids, seq_lens, bam_ids, coverage, comments)
+
+    def import_depth(self, depth_files, depth_format, scaffold_file, out_file, window_size=None, selected_ids=None):
+        """Create coverage profiles from depth tables produced by other tools.
+
+        Supported formats are per-scaffold depth tables produced by
+        jgi_summarize_bam_contig_depths ('jgi'), bedGraph files with
+        a single sample ('bedgraph'), and per-base depth files with one
+        or more samples as produced by samtools depth ('depth'). Per-base
+        depth files are processed one scaffold at a time so memory
+        scales with the longest scaffold rather than the size of the file.
+        This requires the entries of each scaffold to be consecutive.
+
+        Parameters
+        ----------
+        depth_files : list of str
+            Depth tables to import.
+        depth_format : str
+            Format of depth tables ('jgi', 'bedgraph', or 'depth').
+        scaffold_file : str
+            Scaffolds in depth tables.
+        out_file : str
+            Output file for coverage profiles.
+        window_size : int
+            Size of windows for per-base depth profiles (None to skip depth profiles).
+        selected_ids : set
+            Identifiers of scaffolds to import (None to import all scaffolds).
+        """
+
+        seq_ids = []
+        seq_lens = []
+        for seq_id, seq in seq_io.read_seq(scaffold_file):
+            if selected_ids is not None and seq_id not in selected_ids:
+                continue
+            seq_ids.append(seq_id)
+            seq_lens.append(len(seq))
+        seq_index = dict((seq_id, i) for i, seq_id in enumerate(seq_ids))
+
+        if depth_format == 'jgi' and window_size:
+            self.logger.warning('Depth profiles can not be determined from per-scaffold depth tables.')
+            window_size = None
+
+        if window_size:
+            num_windows = (np.array(seq_lens, dtype=np.int64) + window_size - 1) // window_size
+            window_offsets = np.concatenate(([0], np.cumsum(num_windows)))
+
+        sample_ids = []
+        coverage = []
+        for depth_file in depth_files:
+            self.logger.info('Reading depth table: %s' % depth_file)
+            if depth_format == 'jgi':
+                file_sample_ids, file_coverage = self._read_jgi_depth(depth_file, seq_index)
+                sample_ids += file_sample_ids
+                coverage.append(file_coverage)
+                continue
+
+            file_coverage = None
+            for row_index, depth in self._read_per_base_depth(depth_file, depth_format, seq_index, seq_lens):
+                if file_coverage is None:
+                    num_samples = depth.shape[1]
+                    file_coverage = np.zeros((len(seq_ids), num_samples))
+                    if window_size:
+                        window_depth = np.zeros((num_samples, window_offsets[-1]), dtype=np.float32)
+                        depth_stats = np.zeros((num_samples, len(seq_ids), 2))
+
+                file_coverage[row_index] = depth.mean(axis=0)
+                if window_size:
+                    for i in xrange(num_samples):
+                        window_depth[i, window_offsets[row_index]:window_offsets[row_index + 1]], \
+                            depth_stats[i, row_index] = self._depth_summary(depth[:, i], window_size)
+
+            if file_coverage is None:
+                self.logger.warning('Depth table does not contain any scaffolds in %s: %s' % (scaffold_file, depth_file))
+                continue
+
+            file_sample_ids = [remove_extension(depth_file)]
+            if file_coverage.shape[1] > 1:
+                file_sample_ids = ['%s_%d' % (file_sample_ids[0], i + 1) for i in xrange(file_coverage.shape[1])]
+            sample_ids += file_sample_ids
+            coverage.append(file_coverage)
+
+            if window_size:
+                self._write_depth_profiles(out_file,
+                                            seq_ids,
+                                            seq_lens,
+                                            file_sample_ids,
+                                            window_size,
+                                            (window_depth, depth_stats[:, :, 0], depth_stats[:, :, 1]))
+
+        if not coverage:
+            self.logger.error('Depth tables do not contain coverage of any scaffolds.\n')
+            sys.exit()
+
+        self.write(out_file, seq_ids, seq_lens, sample_ids, np.hstack(coverage))
+
+    def _read_jgi_depth(self, depth_file, seq_index):
+        """Read per-scaffold depth table produced by jgi_summarize_bam_contig_depths.
+
+        Parameters
+        ----------
+        depth_file : str
+            Depth table to read.
+        seq_index : dict : d[seq_id] -> row index
+            Row index of each scaffold in coverage matrix.
 
-    def run(self, bam_files, out_file, all_reads, min_align_per, max_edit_dist_per):
-        """Calculate coverage of sequences for each BAM file."""
+        Returns
+        -------
+        list
+            Identifier of each sample.
+        numpy.ndarray
+            Coverage matrix with a row for each scaffold and a column for each sample.
+        """
+
+        try:
+            with open(depth_file) as f:
+                header = f.readline().rstrip('\n').split('\t')
+                if header[0:3] != ['contigName', 'contigLen', 'totalAvgDepth']:
+                    raise ParsingError("[Error] Depth table is not in jgi_summarize_bam_contig_depths format: " + depth_file)
+
+                # each sample has a column with its depth followed by the variance of this depth
+                sample_ids = [remove_extension(x) for x in header[3::2]]
+                coverage = np.zeros((len(seq_index), len(sample_ids)))
+
+                num_unknown = 0
+                for line in f:
+                    line_split = line.rstrip('\n').split('\t')
+                    row_index = seq_index.get(line_split[0])
+                    if row_index is None:
+                        num_unknown += 1
+                        continue
+
+                    coverage[row_index] = [float(x) for x in line_split[3::2]]
+        except IOError:
+            self.logger.error('Failed to open depth table: %s' % depth_file)
+            sys.exit()
+
+        if num_unknown:
+            self.logger.warning('Skipped %d scaffolds which are not in the scaffold file or not selected: %s' % (num_unknown, depth_file))
+
+        return sample_ids, coverage
+
+    def _read_per_base_depth(self, depth_file, depth_format, seq_index, seq_lens):
+        """Generator over per-base depth of scaffolds in a bedGraph or depth file.
+
+        Parameters
+        ----------
+        depth_file : str
+            File with depth of bases or intervals.
+        depth_format : str
+            Format of depth file ('bedgraph' or 'depth').
+        seq_index : dict : d[seq_id] -> row index
+            Row index of each scaffold in coverage matrix.
+        seq_lens : list
+            Length of each scaffold.
+
+        Yields
+        ------
+        int
+            Row index of scaffold.
+        numpy.ndarray
+            Depth of each base in scaffold with a column for each sample.
+        """
+
+        def scaffold_depth(row_index, entries):
+            seq_len = seq_lens[row_index]
+            if depth_format == 'bedgraph':
+                # depth over intervals is recovered with a weighted difference array
+                starts, ends, values = np.array(entries, dtype=np.float64).T
+                depth_diff = np.bincount(starts.astype(np.int64), weights=values, minlength=seq_len + 1)
+                depth_diff -= np.bincount(ends.astype(np.int64), weights=values, minlength=seq_len + 1)
+                return np.cumsum(depth_diff[0:seq_len])[:, np.newaxis]
+
+            entries = np.array(entries, dtype=np.float64)
+            depth = np.zeros((seq_len, entries.shape[1] - 1))
+            depth[entries[:, 0].astype(np.int64) - 1] = entries[:, 1:]
+            return depth
+
+        try:
+            processed = set()
+            num_unknown = 0
+            cur_seq_id = None
+            entries = []
+            with open(depth_file) as f:
+                for line in f:
+                    if line.startswith('#') or line.startswith('track') or line.startswith('browser'):
+                        continue
+
+                    line_split = line.split()
+                    seq_id = line_split[0]
+                    if seq_id != cur_seq_id:
+                        if cur_seq_id in seq_index:
+                            yield seq_index[cur_seq_id], scaffold_depth(seq_index[cur_seq_id], entries)
+                        elif cur_seq_id is not None:
+                            num_unknown += 1
+
+                        if seq_id in processed:
+                            raise ParsingError("[Error] Entries of scaffold %s are not consecutive in depth file: %s" % (seq_id, depth_file))
+                        processed.add(seq_id)
+
+                        cur_seq_id = seq_id
+                        entries = []
+
+                    if depth_format == 'bedgraph':
+                        entries.append((int(line_split[1]), int(line_split[2]), float(line_split[3])))
+                    else:
+                        entries.append([int(line_split[1])] + [float(x) for x in line_split[2:]])
+
+            if cur_seq_id in seq_index:
+                yield seq_index[cur_seq_id], scaffold_depth(seq_index[cur_seq_id], entries)
+            elif cur_seq_id is not None:
+                num_unknown += 1
+        except IOError:
+            self.logger.error('Failed to open depth file: %s' % depth_file)
+            sys.exit()
+
+        if num_unknown:
+            self.logger.warning('Skipped %d scaffolds which are not in the scaffold file or not selected: %s' % (num_unknown, depth_file))
+
+    def calculate(self, bam_files, all_reads, min_align_per, max_edit_dist_per, streaming=False, cache_dir=None, coverage_mode='exact', sample_fraction=0.05, window_size=None, selected_ids=None):
+        """Calculate coverage of sequences for each BAM file.
+
+        Scaffolds which are not selected are skipped and have a coverage of zero.
 
+        Parameters
+        ----------
+        bam_files : list of str
+            BAM files to process.
+        all_reads : boolean
+            Flag indicating if all reads or just paired reads should be processed.
+        min_align_per : float
+            Alignment percentage threshold for accepting mapped reads.
+        max_edit_dist_per : float
+            Edit distance threshold for accepting mapped reads.
+        streaming : boolean
+            Flag indicating if each BAM file should be read in a single pass
+            instead of fetching the reads mapped to each scaffold.
+        cache_dir : str
+            Directory for caching coverage of each BAM file between runs.
+        coverage_mode : str
+            Calculate 'exact' coverage from all reads, a 'fast' approximation from
+            BAM index statistics, or a 'sample' estimate from reads in a fraction of each scaffold.
+        sample_fraction : float
+            Fraction of each scaffold to process when coverage is estimated from a sample of regions.
+        window_size : int
+            Size of windows for per-base depth profiles (None to skip depth profiles).
+        selected_ids : set
+            Identifiers of scaffolds to process (None to process all scaffolds).
+
+        Returns
+        -------
+        list
+            Identifiers of reference scaffolds.
+        list
+            Length of each reference scaffold.
+        numpy.ndarray
+            Coverage matrix with a row for each scaffold and a column for each BAM file.
+        numpy.ndarray
+            Half-width of 95% confidence interval of each coverage value,
+            which is zero unless coverage is estimated from a sample of regions.
+        tuple : (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            Mean depth in windows along each scaffold for each BAM file, along with the
+            trimmed mean and variance of the per-base depth of each scaffold for each
+            BAM file, or None if depth profiles were not requested.
+        list of dict
+            Read filtering report for each BAM file, or None if coverage
+            was approximated from BAM index statistics.
+        dict : d[(ref_index1, ref_index2)] -> number of links
+            Number of read pairs linking scaffolds across all BAM files, or None
+            if coverage was approximated from BAM index statistics or a sample of regions.
+        """
         # make sure all BAM files are indexed
         for bam_file in bam_files:
-            if not os.path.exists(bam_file + '.bai'):
-                self.logger.error('BAM index file is missing: ' + bam_file + '.bai\n')
+            if not self._index_file(bam_file):
+                self.logger.error('Index file (.bai, .csi, or .crai) is missing for: ' + bam_file + '\n')
+                sys.exit()
+
+            if bam_file.endswith('.cram') and not self.reference_file:
+                self.logger.error('Reference scaffolds are required to read CRAM file: ' + bam_file + '\n')
+                sys.exit()
+
+        ref_seq_ids, ref_seq_lens = self._reference_seqs(bam_files)
+        num_refs = len(ref_seq_ids)
+
+        ref_mask = None
+        if selected_ids is not None:
+            ref_mask = np.array([seq_id in selected_ids for seq_id in ref_seq_ids], dtype=bool)
+            self.logger.info('Processing %d of %d scaffolds in BAM files.' % (ref_mask.sum(), num_refs))
+
+        if coverage_mode == 'fast':
+            self.logger.warning('Coverage profiles are approximated from BAM index statistics.')
+            if window_size:
+                self.logger.warning('Depth profiles can not be determined from BAM index statistics.')
+            coverage = self._index_coverage(bam_files, ref_seq_lens, all_reads, min_align_per, max_edit_dist_per)
+            if ref_mask is not None:
+                coverage[~ref_mask] = 0
+            return ref_seq_ids, ref_seq_lens, coverage, np.zeros(coverage.shape), None, None, None
+
+        if coverage_mode == 'sample':
+            if not 0 < sample_fraction <= 1:
+                self.logger.error('Fraction of scaffolds to sample must be in the range (0, 1]: %s\n' % str(sample_fraction))
                 sys.exit()
+            self.logger.info('Estimating coverage profiles from reads in %.4g%% of each scaffold.' % (sample_fraction * 100))
+            if window_size:
+                self.logger.warning('Depth profiles can not be determined from a sample of regions.')
+                window_size = None
+            self.logger.warning('Scaffold links can not be determined from a sample of regions.')
+        else:
+            sample_fraction = 1.0
+
+        coverage = np.zeros((num_refs, len(bam_files)))
+        coverage_ci = np.zeros((num_refs, len(bam_files)))
+        read_counts = np.zeros((len(bam_files), num_refs, NUM_COUNTERS), dtype=np.uint32)
+        bam_links = [None] * len(bam_files)
+
+        # reuse coverage of BAM files processed with the same parameters,
+        # unless depth profiles are required as these are not cached
+        cache_keys = {}
+        cached_bams = set()
+        if cache_dir:
+            make_sure_path_exists(cache_dir)
+            for i, bam_file in enumerate(bam_files):
+                cache_keys[i] = self._cache_key(bam_file, all_reads, min_align_per, max_edit_dist_per, sample_fraction, ref_mask)
+                if window_size:
+                    continue
+
+                cached = self._read_cache(cache_dir, cache_keys[i], num_refs)
+                if cached:
+                    coverage[:, i], coverage_ci[:, i], read_counts[i], bam_links[i] = cached
+                    cached_bams.add(i)
+
+            self.logger.info('Using cached coverage profiles for %d of %d BAM files.' % (len(cached_bams), len(bam_files)))
+
+        # calculate coverage of remaining BAM files
+        depth_profiles = None
+        worker_time = np.zeros((self.cpus, len(bam_files)))
+        wall_time = 0.0
+        bam_indices = [i for i in xrange(len(bam_files)) if i not in cached_bams]
+        if bam_indices:
+            self.logger.info('Calculating coverage profiles for %d BAM files:' % len(bam_indices))
+            start_time = time.time()
+            new_coverage, new_coverage_ci, new_read_counts, depth_profiles, new_worker_time, new_links = self._process_bams([bam_files[i] for i in bam_indices],
+                                                                                                ref_seq_lens,
+                                                                                                all_reads,
+                                                                                                min_align_per,
+                                                                                                max_edit_dist_per,
+                                                                                                streaming,
+                                                                                                sample_fraction,
+                                                                                                window_size,
+                                                                                                ref_mask)
+            wall_time = time.time() - start_time
+            coverage[:, bam_indices] = new_coverage
+            coverage_ci[:, bam_indices] = new_coverage_ci
+            read_counts[bam_indices] = new_read_counts
+            worker_time[:, bam_indices] = new_worker_time
+            for new_index, i in enumerate(bam_indices):
+                bam_links[i] = new_links[new_index]
+
+            if cache_dir:
+                for i in bam_indices:
+                    self._write_cache(cache_dir, cache_keys[i], coverage[:, i], coverage_ci[:, i], read_counts[i], bam_links[i])
 
-        # calculate coverage of each BAM file
-        coverage_info = {}
         for i, bam_file in enumerate(bam_files):
-            self.logger.info('Calculating coverage profile for %s (%d of %d):' % (ntpath.basename(bam_file), i + 1, len(bam_files)))
+            self.reporter.info('')
+            self.reporter.info('  Read statistics for %s (%d of %d)%s%s:' % (ntpath.basename(bam_file),
+                                                                            i + 1,
+                                                                            len(bam_files),
+                                                                            ' [cached]' if i in cached_bams else '',
+                                                                            ' [%.4g%% of each scaffold sampled]' % (sample_fraction * 100) if sample_fraction < 1 else ''))
+            self._report_totals(read_counts[i].sum(axis=0))
+
+        qc_reports = []
+        for i, bam_file in enumerate(bam_files):
+            totals = read_counts[i].sum(axis=0)
+            processing_time = worker_time[:, i].sum()
+            qc_reports.append({'bam_file': bam_file,
+                                'cached': i in cached_bams,
+                                'coverage_mode': coverage_mode,
+                                'sample_fraction': sample_fraction,
+                                'all_reads': all_reads,
+                                'min_align_per': min_align_per,
+                                'max_edit_dist_per': max_edit_dist_per,
+                                'read_counts': dict((name, int(totals[c])) for c, name in enumerate(COUNTER_NAMES)),
+                                'read_fractions': dict((name, float(totals[c]) / max(totals[NUM_READS], 1)) for c, name in enumerate(COUNTER_NAMES)),
+                                'processing_time': processing_time,
+                                'reads_per_second': totals[NUM_READS] / processing_time if processing_time > 0 else None,
+                                'worker_time': worker_time[:, i].tolist(),
+                                'wall_time': wall_time,
+                                'scaffold_read_counts': read_counts[i]})
+
+        # links between sampled regions are a biased subset of all links
+        if coverage_mode == 'sample':
+            return ref_seq_ids, ref_seq_lens, coverage, coverage_ci, depth_profiles, qc_reports, None
+
+        links = defaultdict(int)
+        for cur_links in bam_links:
+            for key, num_links in cur_links.iteritems():
+                links[key] += num_links
+
+        return ref_seq_ids, ref_seq_lens, coverage, coverage_ci, depth_profiles, qc_reports, dict(links)
+
+    def write(self, out_file, seq_ids, seq_lens, bam_ids, coverage, comments=None):
+        """Write coverage profiles to file.
 
-            coverage_info[bam_file] = mp.Manager().dict()
-            coverage_info[bam_file] = self._process_bam(bam_file, all_reads, min_align_per, max_edit_dist_per, coverage_info[bam_file])
+        Parameters
+        ----------
+        out_file : str
+            Output file for coverage profiles.
+        seq_ids : list
+            Identifiers of scaffolds.
+        seq_lens : list
+            Length of each scaffold.
+        bam_ids : list
+            Identifier of each BAM file.
+        coverage : numpy.ndarray
+            Coverage matrix with a row for each scaffold and a column for each BAM file.
+        comments : list of str
+            Comment lines, starting with '#', written before the header.
+        """
 
         fout = open(out_file, 'w')
+        if comments:
+            for comment in comments:
+                fout.write(comment + '\n')
+
         header = 'Scaffold Id\tLength (bp)'
-        for bam_file in bam_files:
-            bam_id = remove_extension(bam_file)
+        for bam_id in bam_ids:
             header += '\t' + bam_id
         fout.write(header + '\n')
 
-        for seq_id in coverage_info[coverage_info.keys()[0]].keys():
-            row_str = seq_id + '\t' + str(coverage_info[coverage_info.keys()[0]][seq_id].seq_len)
-            for bam_file in bam_files:
-                bam_id = remove_extension(bam_file)
-                if seq_id in coverage_info[bam_file]:
-                    row_str += '\t' + str(coverage_info[bam_file][seq_id].coverage)
-                else:
-                    row_str += '\t' + '0.0'
+        for row_index, seq_id in enumerate(seq_ids):
+            row_str = seq_id + '\t' + str(seq_lens[row_index])
+            for cov in coverage[row_index]:
+                row_str += '\t' + str(float(cov))
             fout.write(row_str + '\n')
 
         fout.close()
 
-    def _process_bam(self, bam_file, all_reads, min_align_per, max_edit_dist_per, coverage_info):
-        """Calculate coverage of scaffolds in BAM file."""
+    def _index_file(self, bam_file):
+        """Determine index file of a BAM or CRAM file.
 
-        # determine coverage for each reference scaffolds
-        worker_queue = mp.Queue()
-        writer_queue = mp.Queue()
+        Parameters
+        ----------
+        bam_file : str
+            BAM or CRAM file.
 
-        bamfile = pysam.Samfile(bam_file, 'rb')
-        ref_seq_ids = bamfile.references
-        ref_seq_lens = bamfile.lengths
+        Returns
+        -------
+        str
+            Index file (.bai, .csi, or .crai), or None if the file is not indexed.
+        """
 
-        # populate each thread with reference scaffolds to process
-        # Note: reference scaffolds are sorted by number of mapped reads
-        # so it is important to distribute reads in a sensible way to each
-        # of the threads
-        ref_seq_lists = [[] for _ in range(self.cpus)]
-        ref_len_lists = [[] for _ in range(self.cpus)]
-
-        cpu_index = 0
-        incDir = 1
-        for ref_seq_id, ref_len in zip(ref_seq_ids, ref_seq_lens):
-            ref_seq_lists[cpu_index].append(ref_seq_id)
-            ref_len_lists[cpu_index].append(ref_len)
-
-            cpu_index += incDir
-            if cpu_index == self.cpus:
-                cpu_index = self.cpus - 1
-                incDir = -1
-            elif cpu_index == -1:
-                cpu_index = 0
-                incDir = 1
-
-        for i in range(self.cpus):
-            worker_queue.put((ref_seq_lists[i], ref_len_lists[i]))
+        if bam_file.endswith('.cram'):
+            index_exts = ['.crai']
+        else:
+            index_exts = ['.bai', '.csi']
 
-        for _ in range(self.cpus):
-            worker_queue.put((None, None))
+        for index_ext in index_exts:
+            for index_file in [bam_file + index_ext, os.path.splitext(bam_file)[0] + index_ext]:
+                if os.path.exists(index_file):
+                    return index_file
 
-        try:
-            worker_proc = [mp.Process(target=self._worker, args=(bam_file, all_reads, min_align_per, max_edit_dist_per, worker_queue, writer_queue)) for _ in range(self.cpus)]
-            write_proc = mp.Process(target=self._writer, args=(coverage_info, len(ref_seq_ids), writer_queue))
+        return None
 
-            write_proc.start()
+    def _open(self, bam_file, io_threads=1):
+        """Open BAM or CRAM file.
 
-            for p in worker_proc:
-                p.start()
+        Parameters
+        ----------
+        bam_file : str
+            BAM or CRAM file.
+        io_threads : int
+            Number of htslib threads used to decompress reads.
 
-            for p in worker_proc:
-                p.join()
+        Returns
+        -------
+        pysam.AlignmentFile
+            Opened BAM or CRAM file.
+        """
 
-            writer_queue.put((None, None, None, None, None, None, None, None, None, None, None))
-            write_proc.join()
-        except:
-            print traceback.format_exc()
-            for p in worker_proc:
-                p.terminate()
+        if bam_file.endswith('.cram'):
+            return pysam.AlignmentFile(bam_file, 'rc',
+                                        index_filename=self._index_file(bam_file),
+                                        reference_filename=self.reference_file,
+                                        threads=io_threads)
 
-            write_proc.terminate()
+        return pysam.AlignmentFile(bam_file, 'rb',
+                                    index_filename=self._index_file(bam_file),
+                                    threads=io_threads)
 
-        return coverage_info
+    def _reference_seqs(self, bam_files):
+        """Get reference scaffolds common to all BAM files.
 
-    def _worker(self, bam_file, all_reads, min_align_per, max_edit_dist_per, queue_in, queue_out):
-        """Process scaffold in parallel.
+        Parameters
+        ----------
+        bam_files : list of str
+            BAM files to process.
+
+        Returns
+        -------
+        list
+            Identifiers of reference scaffolds in BAM header order.
+        list
+            Length of each reference scaffold.
+        """
+
+        bamfile = self._open(bam_files[0])
+        ref_seq_ids = bamfile.references
+        ref_seq_lens = bamfile.lengths
+        bamfile.close()
+
+        for bam_file in bam_files[1:]:
+            bamfile = self._open(bam_file)
+            if bamfile.references != ref_seq_ids or bamfile.lengths != ref_seq_lens:
+                self.logger.error('BAM files must be mapped against the same reference scaffolds: %s\n' % bam_file)
+                sys.exit()
+            bamfile.close()
+
+        return ref_seq_ids, ref_seq_lens
+
+    def _cache_key(self, bam_file, all_reads, min_align_per, max_edit_dist_per, sample_fraction=1.0, ref_mask=None):
+        """Determine key identifying coverage of a BAM file.
+
+        The key combines a fingerprint of the BAM file (size,
+        modification time, and header) with the read filtering
+        parameters used to calculate coverage.
 
         Parameters
         ----------
@@ -197,160 +851,1377 @@ class Coverage():
             Alignment percentage threshold for accepting mapped reads.
         max_edit_dist_per : float
             Edit distance threshold for accepting mapped reads.
-        queue_in : queue
-            Queue containing reference sequences and their lengths.
-        queue_out : queue
-            Queue to hold coverage results.
-        """
-        while True:
-            seq_ids, seq_lens = queue_in.get(block=True, timeout=None)
-            if seq_ids == None:
-                break
-
-            bamfile = pysam.Samfile(bam_file, 'rb')
-
-            for seq_id, seq_len in zip(seq_ids, seq_lens):
-                num_reads = 0
-                num_mapped_reads = 0
-                num_duplicates = 0
-                num_secondary = 0
-                num_failed_qc = 0
-                num_failed_align_len = 0
-                num_failed_edit_dist = 0
-                num_failed_proper_pair = 0
-                coverage = 0
-
-                for read in bamfile.fetch(seq_id, 0, seq_len):
-                    num_reads += 1
-
-                    if read.is_unmapped:
-                        pass
-                    elif read.is_duplicate:
-                        num_duplicates += 1
-                    elif read.is_secondary or read.is_supplementary:
-                        num_secondary += 1
-                    elif read.is_qcfail:
-                        num_failed_qc += 1
-                    elif read.query_alignment_length < min_align_per * read.query_length:
-                        num_failed_align_len += 1
-                    elif read.get_tag('NM') > max_edit_dist_per * read.query_length:
-                        num_failed_edit_dist += 1
-                    elif not all_reads and not read.is_proper_pair:
-                        num_failed_proper_pair += 1
-                    else:
-                        num_mapped_reads += 1
-
-                        # Note: the alignment length (query_alignment_length) is used instead of the
-                        # read length (query_length) as this bring the calculated coverage
-                        # in line with 'samtools depth' (at least when the min
-                        # alignment length and edit distance thresholds are zero)
-                        coverage += read.query_alignment_length
+        sample_fraction : float
+            Fraction of each scaffold sampled to estimate coverage.
+        ref_mask : numpy.ndarray
+            Flag indicating if each reference scaffold is processed (None if all scaffolds are processed).
 
-                coverage = float(coverage) / seq_len
-
-                queue_out.put((seq_id, seq_len, coverage, num_reads,
-                                num_duplicates, num_secondary, num_failed_qc,
-                                num_failed_align_len, num_failed_edit_dist,
-                                num_failed_proper_pair, num_mapped_reads))
-
-            bamfile.close()
+        Returns
+        -------
+        str
+            Key identifying coverage of BAM file.
+        """
 
-    def _writer(self, coverage_info, num_reference_seqs, writer_queue):
-        """Record coverage information for each scaffold.
+        bamfile = self._open(bam_file)
+        header_hash = hashlib.md5()
+        header_hash.update(bamfile.text)
+        for seq_id, seq_len in zip(bamfile.references, bamfile.lengths):
+            header_hash.update('%s\t%d\n' % (seq_id, seq_len))
+        bamfile.close()
+
+        stat = os.stat(bam_file)
+        key = '%d\t%d\t%s\t%s\t%r\t%r' % (stat.st_size,
+                                            int(stat.st_mtime),
+                                            header_hash.hexdigest(),
+                                            all_reads,
+                                            min_align_per,
+                                            max_edit_dist_per)
+        if sample_fraction < 1:
+            key += '\tregions:%d\t%r' % (SAMPLE_REGION_SIZE, sample_fraction)
+        if ref_mask is not None and not ref_mask.all():
+            key += '\t' + hashlib.md5(np.packbits(ref_mask).tostring()).hexdigest()
+
+        return hashlib.sha1(key).hexdigest()
+
+    def _read_cache(self, cache_dir, cache_key, num_refs):
+        """Read cached coverage of a BAM file.
 
         Parameters
         ----------
-        coverage_info : managed dictionary
-            Dictionary for recording CoverageStruct statistics for each scaffold.
-        num_reference_seqs : int
-            Number of reference scaffolds to process.
-        writer_queue : queue
-            Queue contain results of worker threads.
+        cache_dir : str
+            Directory containing cached coverage profiles.
+        cache_key : str
+            Key identifying coverage of BAM file.
+        num_refs : int
+            Number of reference scaffolds in BAM file.
+
+        Returns
+        -------
+        tuple : (numpy.ndarray, numpy.ndarray, numpy.ndarray, dict)
+            Coverage, confidence interval of coverage, and read counters of
+            each reference scaffold along with the number of read pairs
+            linking scaffolds, or None if the coverage is not cached.
         """
-        total_reads = 0
-        total_duplicates = 0
-        total_secondary = 0
-        total_failed_qc = 0
-        total_failed_align_len = 0
-        total_failed_edit_dist = 0
-        total_failed_proper_pair = 0
-        total_mapped_reads = 0
 
-        processed_ref_seqs = 0
-        while True:
-            seq_id, seq_len, coverage, num_reads, num_duplicates, num_secondary, num_failed_qc, num_failed_align_len, num_failed_edit_dist, num_failed_proper_pair, num_mapped_reads = writer_queue.get(block=True, timeout=None)
-            if seq_id == None:
-                break
+        cache_file = os.path.join(cache_dir, cache_key + '.npz')
+        if not os.path.exists(cache_file):
+            return None
 
-            if not self.logger.is_silent:
-                processed_ref_seqs += 1
-                statusStr = '  Finished processing %d of %d (%.2f%%) reference sequences.' % (processed_ref_seqs, num_reference_seqs, float(processed_ref_seqs) * 100 / num_reference_seqs)
-                sys.stderr.write('%s\r' % statusStr)
-                sys.stderr.flush()
+        try:
+            cached = np.load(cache_file)
+            coverage = cached['coverage']
+            read_counts = cached['read_counts']
+            if 'coverage_ci' in cached.files:
+                coverage_ci = cached['coverage_ci']
+            else:
+                coverage_ci = np.zeros(coverage.shape)
+
+            links = {}
+            if 'links' in cached.files:
+                for ref_index1, ref_index2, num_links in cached['links']:
+                    links[(int(ref_index1), int(ref_index2))] = int(num_links)
+        except:
+            self.logger.warning('Ignoring unreadable coverage cache file: %s' % cache_file)
+            return None
 
-            total_reads += num_reads
-            total_duplicates += num_duplicates
-            total_secondary += num_secondary
-            total_failed_qc += num_failed_qc
-            total_failed_align_len += num_failed_align_len
-            total_failed_edit_dist += num_failed_edit_dist
-            total_failed_proper_pair += num_failed_proper_pair
-            total_mapped_reads += num_mapped_reads
+        if len(coverage) != num_refs or len(coverage_ci) != num_refs or read_counts.shape != (num_refs, NUM_COUNTERS):
+            return None
 
-            coverage_info[seq_id] = CoverageStruct(seq_len=seq_len, mapped_reads=num_mapped_reads, coverage=coverage)
+        return coverage, coverage_ci, read_counts, links
 
-        if not self.logger.is_silent:
-            sys.stderr.write('\n')
+    def _write_cache(self, cache_dir, cache_key, coverage, coverage_ci, read_counts, links):
+        """Write coverage of a BAM file to cache.
 
-        self.reporter.info('')
-        self.reporter.info('  # total reads: %d' % total_reads)
-        self.reporter.info('    # properly mapped reads: %d (%.1f%%)' % (total_mapped_reads, float(total_mapped_reads) * 100 / total_reads))
-        self.reporter.info('    # duplicate reads: %d (%.1f%%)' % (total_duplicates, float(total_duplicates) * 100 / total_reads))
-        self.reporter.info('    # secondary reads: %d (%.1f%%)' % (total_secondary, float(total_secondary) * 100 / total_reads))
-        self.reporter.info('    # reads failing QC: %d (%.1f%%)' % (total_failed_qc, float(total_failed_qc) * 100 / total_reads))
-        self.reporter.info('    # reads failing alignment length: %d (%.1f%%)' % (total_failed_align_len, float(total_failed_align_len) * 100 / total_reads))
-        self.reporter.info('    # reads failing edit distance: %d (%.1f%%)' % (total_failed_edit_dist, float(total_failed_edit_dist) * 100 / total_reads))
-        self.reporter.info('    # reads not properly paired: %d (%.1f%%)' % (total_failed_proper_pair, float(total_failed_proper_pair) * 100 / total_reads))
+        Parameters
+        ----------
+        cache_dir : str
+            Directory containing cached coverage profiles.
+        cache_key : str
+            Key identifying coverage of BAM file.
+        coverage : numpy.ndarray
+            Coverage of each reference scaffold.
+        coverage_ci : numpy.ndarray
+            Half-width of 95% confidence interval of coverage of each reference scaffold.
+        read_counts : numpy.ndarray
+            Read counters of each reference scaffold.
+        links : dict : d[(ref_index1, ref_index2)] -> number of links
+            Number of read pairs linking scaffolds.
+        """
 
-    def read(self, coverage_file):
-        """Read coverage information from file.
+        links = np.array([(k[0], k[1], v) for k, v in links.iteritems()], dtype=np.int64).reshape(-1, 3)
+
+        # write to a temporary file first so an interrupted
+        # run never leaves a partial cache entry behind
+        cache_file = os.path.join(cache_dir, cache_key + '.npz')
+        tmp_file = os.path.join(cache_dir, cache_key + '.tmp.npz')
+        np.savez(tmp_file, coverage=coverage, coverage_ci=coverage_ci, read_counts=read_counts, links=links)
+        os.rename(tmp_file, cache_file)
+
+    def _process_bams(self, bam_files, ref_seq_lens, all_reads, min_align_per, max_edit_dist_per, streaming, sample_fraction=1.0, window_size=None, ref_mask=None):
+        """Calculate coverage of scaffolds across all BAM files.
+
+        Work units for all BAM files are placed in a single queue
+        processed by a common pool of workers. Work units are built
+        to contain similar numbers of reads, as determined from the
+        BAM index, and are queued from most to least reads so idle
+        workers pick up the remaining small units. Results are recorded
+        in arrays shared by all processes.
+
+        If only a fraction of each scaffold is sampled, reads are fetched
+        through the BAM index from a systematic sample of regions along
+        each scaffold (see _sample_regions), so reads outside these regions
+        are never passed to Python. The coverage of each scaffold is
+        estimated from the aligned bases of reads starting in the sampled
+        regions and the variance of this ratio estimate is determined
+        from the variation in aligned bases between regions.
+
+        Per-base depth profiles are determined in the same pass over the
+        reads from difference arrays over the start and end positions of
+        the alignments to each scaffold. Read pairs with mates mapped to
+        different scaffolds are also counted to link scaffolds.
 
         Parameters
         ----------
-        coverage_file : str
-            File containing coverage profiles.
+        bam_files : list of str
+            BAM files to process.
+        ref_seq_lens : list
+            Length of each reference scaffold.
+        all_reads : boolean
+            Flag indicating if all reads or just paired reads should be processed.
+        min_align_per : float
+            Alignment percentage threshold for accepting mapped reads.
+        max_edit_dist_per : float
+            Edit distance threshold for accepting mapped reads.
+        streaming : boolean
+            Flag indicating if reference scaffolds should be streamed in contiguous ranges.
+        sample_fraction : float
+            Fraction of each scaffold to process.
+        window_size : int
+            Size of windows for per-base depth profiles (None to skip depth profiles).
+        ref_mask : numpy.ndarray
+            Flag indicating if each reference scaffold should be processed (None to process all scaffolds).
 
         Returns
         -------
-        dict : d[scaffold_id][bam_id] -> coverage
-            Coverage profile for each scaffold.
-        dict : d[scaffold_id] -> length
-            Length of each scaffold.
+        numpy.ndarray
+            Coverage matrix with a row for each scaffold and a column for each BAM file.
+        numpy.ndarray
+            Half-width of 95% confidence interval of each coverage value.
+        numpy.ndarray
+            Read counters for each BAM file and scaffold.
+        tuple : (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            Mean depth in windows along each scaffold for each BAM file, along with the
+            trimmed mean and variance of the per-base depth of each scaffold for each
+            BAM file, or None if depth profiles were not requested.
+        numpy.ndarray
+            Time spent by each worker processing each BAM file.
+        list of dict : d[(ref_index1, ref_index2)] -> number of links
+            Number of read pairs linking scaffolds in each BAM file.
         """
 
+        num_bams = len(bam_files)
+        num_refs = len(ref_seq_lens)
+        if ref_mask is None:
+            ref_mask = np.ones(num_refs, dtype=bool)
+
+        shared_aligned_bases = mp.RawArray('d', num_refs * num_bams)
+        shared_aligned_bases_var = mp.RawArray('d', num_refs * num_bams)
+        shared_read_counts = mp.RawArray('I', num_bams * num_refs * NUM_COUNTERS)
+
+        # windows of all scaffolds are stored consecutively
+        window_offsets = None
+        shared_window_depth = None
+        shared_depth_stats = None
+        if window_size:
+            num_windows = (np.array(ref_seq_lens, dtype=np.int64) + window_size - 1) // window_size
+            window_offsets = np.concatenate(([0], np.cumsum(num_windows)))
+            shared_window_depth = mp.RawArray('f', int(num_bams * window_offsets[-1]))
+            shared_depth_stats = mp.RawArray('d', num_bams * num_refs * 2)
+
+        worker_queue = mp.Queue()
+        writer_queue = mp.Queue()
+        links_queue = mp.Queue()
+
+        work_units = []
+        for bam_index, bam_file in enumerate(bam_files):
+            ref_read_counts = self._index_read_counts(bam_file, ref_seq_lens)
+            if streaming:
+                bam_work_units = self._stream_work_units(ref_read_counts, ref_mask)
+            else:
+                bam_work_units = self._scaffold_work_units(ref_read_counts, ref_mask)
+
+            for work_unit, num_reads in bam_work_units:
+                work_units.append((num_reads, bam_index, work_unit))
+
+        work_units.sort(key=lambda x: x[0], reverse=True)
+        for _num_reads, bam_index, work_unit in work_units:
+            worker_queue.put((bam_index, work_unit))
+
+        for _ in range(self.cpus):
+            worker_queue.put((None, None))
+
+        shared_worker_time = mp.RawArray('d', self.cpus * num_bams)
+
+        if sample_fraction >= 1:
+            sample_fraction = None
+
         try:
-            coverage = defaultdict(lambda: defaultdict(float))
-            length = {}
-            with open(coverage_file) as f:
-                header = f.readline().split('\t')
-                bam_ids = [x.strip() for x in header[2:]]
+            worker_proc = [mp.Process(target=self._worker, args=(bam_files, streaming, all_reads, min_align_per, max_edit_dist_per, sample_fraction, window_size, window_offsets, shared_aligned_bases, shared_aligned_bases_var, shared_read_counts, shared_window_depth, shared_depth_stats, shared_worker_time, worker_index, worker_queue, writer_queue, links_queue)) for worker_index in range(self.cpus)]
+            write_proc = mp.Process(target=self._writer, args=(num_bams * int(ref_mask.sum()), writer_queue))
 
-                for line in f:
-                    line_split = line.split('\t')
-                    scaffold_id = line_split[0]
-                    scaffold_len = int(line_split[1])
+            write_proc.start()
 
-                    length[scaffold_id] = scaffold_len
+            for p in worker_proc:
+                p.start()
 
-                    for i, cov in enumerate(line_split[2:]):
-                        coverage[scaffold_id][bam_ids[i]] = float(cov)
-        except IOError:
-            self.logger.error('Failed to open signature file: %s' % coverage_file)
-            sys.exit()
+            # links must be taken from the queue before workers can exit
+            worker_links = []
+            while len(worker_links) < self.cpus:
+                try:
+                    worker_links.append(links_queue.get(timeout=1))
+                except Queue.Empty:
+                    if not any(p.is_alive() for p in worker_proc):
+                        break
+
+            for p in worker_proc:
+                p.join()
+
+            writer_queue.put(None)
+            write_proc.join()
         except:
             print traceback.format_exc()
-            print ''
-            raise ParsingError("[Error] Failed to process coverage file: " + coverage_file)
-            sys.exit()
+            for p in worker_proc:
+                p.terminate()
 
-        return coverage, length
+            write_proc.terminate()
+
+        worker_time = np.frombuffer(shared_worker_time, dtype=np.float64).reshape(self.cpus, num_bams)
+        total_worker_time = worker_time.sum(axis=1)
+        self.logger.info('Worker runtime: min = %.2f s, mean = %.2f s, max = %.2f s (%d work units).' % (total_worker_time.min(),
+                                                                                                            total_worker_time.mean(),
+                                                                                                            total_worker_time.max(),
+                                                                                                            len(work_units)))
+
+        ref_seq_lens = np.array(ref_seq_lens, dtype=np.float64)[:, np.newaxis]
+
+        coverage = np.frombuffer(shared_aligned_bases, dtype=np.float64).reshape(num_refs, num_bams)
+        coverage /= ref_seq_lens
+
+        aligned_bases_var = np.frombuffer(shared_aligned_bases_var, dtype=np.float64).reshape(num_refs, num_bams)
+        coverage_ci = CI_Z_SCORE * np.sqrt(aligned_bases_var) / ref_seq_lens
+
+        read_counts = np.frombuffer(shared_read_counts, dtype=np.uint32).reshape(num_bams, num_refs, NUM_COUNTERS)
+
+        depth_profiles = None
+        if window_size:
+            window_depth = np.frombuffer(shared_window_depth, dtype=np.float32).reshape(num_bams, -1)
+            depth_stats = np.frombuffer(shared_depth_stats, dtype=np.float64).reshape(num_bams, num_refs, 2)
+            depth_profiles = (window_depth, depth_stats[:, :, 0], depth_stats[:, :, 1])
+
+        links = [defaultdict(int) for _ in xrange(num_bams)]
+        for cur_links in worker_links:
+            for (bam_index, ref_index1, ref_index2), num_links in cur_links.iteritems():
+                links[bam_index][(ref_index1, ref_index2)] += num_links
+
+        return coverage, coverage_ci, read_counts, depth_profiles, worker_time, [dict(d) for d in links]
+
+    def _index_read_counts(self, bam_file, ref_seq_lens):
+        """Determine number of reads mapped to each reference scaffold.
+
+        Read counts are taken from the BAM index. If the index does not
+        provide these statistics, the length of each scaffold is used as
+        a proxy for the number of reads.
+
+        Parameters
+        ----------
+        bam_file : str
+            BAM file to process.
+        ref_seq_lens : list
+            Length of each reference scaffold.
+
+        Returns
+        -------
+        numpy.ndarray
+            Number of reads mapped to each reference scaffold.
+        """
+
+        # CRAM indices do not record the number of reads per scaffold
+        bamfile = self._open(bam_file)
+        try:
+            index_stats = bamfile.get_index_statistics()
+            read_counts = np.array([stats.total for stats in index_stats], dtype=np.float64)
+            if bamfile.is_cram:
+                read_counts = None
+        except (AttributeError, ValueError):
+            read_counts = None
+        bamfile.close()
+
+        if read_counts is None or len(read_counts) != len(ref_seq_lens):
+            self.logger.warning('BAM index does not provide read counts, balancing work by scaffold length: %s' % bam_file)
+            read_counts = np.array(ref_seq_lens, dtype=np.float64)
+
+        return read_counts
+
+    def _scaffold_work_units(self, ref_read_counts, ref_mask, max_unit_size=1000):
+        """Partition reference scaffolds into work units with similar numbers of reads.
+
+        Scaffolds are considered from most to least reads and greedily
+        packed into work units containing approximately an equal share
+        of the reads. Scaffolds with many reads form their own work unit.
+
+        Parameters
+        ----------
+        ref_read_counts : numpy.ndarray
+            Number of reads mapped to each reference scaffold.
+        ref_mask : numpy.ndarray
+            Flag indicating if each reference scaffold should be processed.
+        max_unit_size : int
+            Maximum number of reference scaffolds in a work unit.
+
+        Returns
+        -------
+        list of tuples
+            Indices of reference scaffolds in each work unit
+            along with the number of reads in the unit.
+        """
+
+        # each fetch has a fixed overhead so scaffolds
+        # without any reads still carry some cost
+        cost = ref_read_counts + 1.0
+        target_cost = cost[ref_mask].sum() / (self.cpus * 8)
+
+        work_units = []
+        ref_indices = []
+        unit_cost = 0
+        for ref_index in np.argsort(-cost, kind='mergesort'):
+            if not ref_mask[ref_index]:
+                continue
+
+            ref_indices.append(int(ref_index))
+            unit_cost += cost[ref_index]
+
+            if unit_cost >= target_cost or len(ref_indices) == max_unit_size:
+                work_units.append((ref_indices, unit_cost))
+                ref_indices = []
+                unit_cost = 0
+
+        if ref_indices:
+            work_units.append((ref_indices, unit_cost))
+
+        return work_units
+
+    def _stream_work_units(self, ref_read_counts, ref_mask):
+        """Partition reference scaffolds into contiguous ranges with similar numbers of reads.
+
+        Several ranges are created per CPU so workers finishing
+        early can pick up remaining ranges. Ranges are split around
+        reference scaffolds which should not be processed.
+
+        Parameters
+        ----------
+        ref_read_counts : numpy.ndarray
+            Number of reads mapped to each reference scaffold.
+        ref_mask : numpy.ndarray
+            Flag indicating if each reference scaffold should be processed.
+
+        Returns
+        -------
+        list of tuples
+            Start and end index of each range of reference scaffolds
+            along with the number of reads in the range.
+        """
+
+        num_refs = len(ref_read_counts)
+        num_ranges = min(ref_mask.sum(), self.cpus * 8)
+        if num_ranges == 0:
+            return []
+
+        cum_cost = np.cumsum((ref_read_counts + 1.0) * ref_mask)
+        boundaries = np.searchsorted(cum_cost, np.linspace(0, cum_cost[-1], num_ranges + 1)[1:-1])
+        boundaries = np.unique(np.concatenate(([0], boundaries, [num_refs])))
+
+        work_units = []
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            selected = np.flatnonzero(ref_mask[start:end]) + start
+            if len(selected) == 0:
+                continue
+
+            for run in np.split(selected, np.flatnonzero(np.diff(selected) > 1) + 1):
+                run_start = int(run[0])
+                run_end = int(run[-1]) + 1
+                unit_cost = cum_cost[run_end - 1] - (cum_cost[run_start - 1] if run_start > 0 else 0)
+                work_units.append(((run_start, run_end), unit_cost))
+
+        return work_units
+
+    def _stream_reads(self, bamfile, ref_start, ref_end):
+        """Generator over reads mapped to a contiguous range of reference scaffolds.
+
+        Parameters
+        ----------
+        bamfile : pysam.AlignmentFile
+            Coordinate sorted and indexed BAM file.
+        ref_start : int
+            Index of first reference scaffold in range.
+        ref_end : int
+            Index one past the last reference scaffold in range.
+
+        Yields
+        ------
+        pysam.AlignedSegment
+            Reads in the order they appear in the BAM file.
+        """
+
+        # CRAM records are decoded in containers so reading can not
+        # continue from the file position reached by an indexed fetch
+        if bamfile.is_cram:
+            for read in self._fetch_reads(bamfile, xrange(ref_start, ref_end)):
+                yield read
+            return
+
+        # use the index to seek to the first read in the range
+        first_read = None
+        for ref_index in xrange(ref_start, ref_end):
+            for first_read in bamfile.fetch(bamfile.references[ref_index]):
+                break
+
+            if first_read is not None:
+                break
+
+        if first_read is None:
+            return
+
+        yield first_read
+
+        # continue reading sequentially from the current file position
+        for read in bamfile.fetch(until_eof=True):
+            if read.reference_id >= ref_end or read.reference_id == -1:
+                break
+
+            yield read
+
+    def _fetch_reads(self, bamfile, ref_indices):
+        """Generator over reads mapped to a set of reference scaffolds.
+
+        Parameters
+        ----------
+        bamfile : pysam.AlignmentFile
+            Indexed BAM file.
+        ref_indices : list
+            Indices of reference scaffolds.
+
+        Yields
+        ------
+        pysam.AlignedSegment
+            Reads mapped to each reference scaffold in turn.
+        """
+
+        for ref_index in ref_indices:
+            for read in bamfile.fetch(bamfile.references[ref_index], 0, bamfile.lengths[ref_index]):
+                yield read
+
+    def _sample_regions(self, seq_id, seq_len, sample_fraction):
+        """Select regions of a scaffold from which reads are sampled.
+
+        A scaffold is divided into regions of SAMPLE_REGION_SIZE bases
+        and a systematic sample of these regions, with a start offset
+        determined by a hash of the scaffold id, is selected. At least
+        one region is selected for each scaffold.
+
+        Parameters
+        ----------
+        seq_id : str
+            Unique id of scaffold.
+        seq_len : int
+            Length of scaffold.
+        sample_fraction : float
+            Fraction of regions to select.
+
+        Returns
+        -------
+        list of (int, int)
+            Start and end of each selected region (0-based, end exclusive).
+        """
+
+        num_regions = (seq_len + SAMPLE_REGION_SIZE - 1) // SAMPLE_REGION_SIZE
+        num_sampled = min(num_regions, max(1, int(round(sample_fraction * num_regions))))
+        offset = (zlib.crc32(seq_id) & 0xffffffff) / float(2 ** 32)
+
+        regions = []
+        for i in xrange(num_sampled):
+            region_index = int((i + offset) * num_regions / num_sampled)
+            regions.append((region_index * SAMPLE_REGION_SIZE, min((region_index + 1) * SAMPLE_REGION_SIZE, seq_len)))
+
+        return regions
+
+    def _sample_reads(self, bamfile, ref_indices, sample_fraction):
+        """Generator over reads starting in sampled regions of reference scaffolds.
+
+        Parameters
+        ----------
+        bamfile : pysam.AlignmentFile
+            Indexed BAM file.
+        ref_indices : list
+            Indices of reference scaffolds.
+        sample_fraction : float
+            Fraction of regions to sample along each scaffold.
+
+        Yields
+        ------
+        pysam.AlignedSegment
+            Reads starting in each sampled region of each reference scaffold in turn.
+        """
+
+        for ref_index in ref_indices:
+            seq_id = bamfile.references[ref_index]
+            for start, end in self._sample_regions(seq_id, bamfile.lengths[ref_index], sample_fraction):
+                for read in bamfile.fetch(seq_id, start, end):
+                    # reads overlapping the start of the region are assigned to the preceding region
+                    if read.reference_start >= start:
+                        yield read
+
+    def _sample_estimate(self, regions, region_bases, sq_aligned_bases, seq_len):
+        """Estimate aligned bases of a scaffold from sampled regions.
+
+        The aligned bases of the scaffold are estimated as the ratio of
+        aligned bases to length of the sampled regions, scaled by the length
+        of the scaffold. The variance of this ratio estimator is calculated
+        from the residuals of each region, treating the systematic sample as
+        a simple random sample of regions. If a single region is sampled, the
+        variance is instead calculated as for a Poisson sample of read pairs.
+
+        Parameters
+        ----------
+        regions : list of (int, int)
+            Start and end of each sampled region.
+        region_bases : d[region index] -> aligned bases
+            Aligned bases of reads starting in each sampled region.
+        sq_aligned_bases : float
+            Sum of squared aligned bases of reads in the sampled regions.
+        seq_len : int
+            Length of scaffold.
+
+        Returns
+        -------
+        float
+            Estimated aligned bases of scaffold.
+        float
+            Variance of estimated aligned bases.
+        """
+
+        region_lens = np.array([end - start for start, end in regions], dtype=np.float64)
+        bases = np.array([region_bases.get(start // SAMPLE_REGION_SIZE, 0) for start, _end in regions], dtype=np.float64)
+
+        num_regions = (seq_len + SAMPLE_REGION_SIZE - 1) // SAMPLE_REGION_SIZE
+        num_sampled = len(regions)
+        sampled_len = region_lens.sum()
+        ratio = bases.sum() / sampled_len
+
+        if num_sampled == num_regions:
+            var = 0.0
+        elif num_sampled > 1:
+            residual_var = ((bases - ratio * region_lens) ** 2).sum() / (num_sampled - 1)
+            mean_region_len = sampled_len / num_sampled
+            ratio_var = (1.0 - float(num_sampled) / num_regions) * residual_var / (num_sampled * mean_region_len ** 2)
+            var = ratio_var * seq_len ** 2
+        else:
+            fraction = sampled_len / seq_len
+            var = (1.0 - fraction) / fraction ** 2 * sq_aligned_bases
+
+        return ratio * seq_len, var
+
+    def _worker(self, bam_files, streaming, all_reads, min_align_per, max_edit_dist_per, sample_fraction, window_size, window_offsets, shared_aligned_bases, shared_aligned_bases_var, shared_read_counts, shared_window_depth, shared_depth_stats, shared_worker_time, worker_index, queue_in, queue_out, queue_links):
+        """Process scaffold in parallel.
+
+        Read counters and the number of aligned bases for each scaffold
+        are written directly into arrays shared by all workers. Only the
+        number of scaffolds processed is reported for each work unit.
+        If requested, the start and end of each accepted alignment are
+        also collected to determine the per-base depth of each scaffold.
+        Read pairs linking scaffolds are counted using the first read of
+        each pair and reported once all work units have been processed.
+
+        Parameters
+        ----------
+        bam_files : list of str
+            BAM files to process.
+        streaming : boolean
+            Flag indicating if work units are contiguous ranges of reference scaffolds.
+        all_reads : boolean
+            Flag indicating if all reads or just paired reads should be processed.
+        min_align_per : float
+            Alignment percentage threshold for accepting mapped reads.
+        max_edit_dist_per : float
+            Edit distance threshold for accepting mapped reads.
+        sample_fraction : float
+            Fraction of regions along each scaffold to process (None to process all reads).
+        window_size : int
+            Size of windows for per-base depth profiles (None to skip depth profiles).
+        window_offsets : numpy.ndarray
+            Index of first window of each scaffold in shared depth profile array.
+        shared_aligned_bases : multiprocessing.RawArray
+            Shared array holding aligned bases for each scaffold and BAM file.
+        shared_aligned_bases_var : multiprocessing.RawArray
+            Shared array holding variance of estimated aligned bases for each scaffold and BAM file.
+        shared_read_counts : multiprocessing.RawArray
+            Shared array holding read counters for each BAM file and scaffold.
+        shared_window_depth : multiprocessing.RawArray
+            Shared array holding mean depth of each window for each BAM file.
+        shared_depth_stats : multiprocessing.RawArray
+            Shared array holding trimmed mean and variance of per-base depth for each BAM file and scaffold.
+        shared_worker_time : multiprocessing.RawArray
+            Shared array holding time spent by each worker processing work units of each BAM file.
+        worker_index : int
+            Index of worker.
+        queue_in : queue
+            Queue containing work units to process.
+        queue_out : queue
+            Queue indicating number of reference scaffolds processed.
+        queue_links : queue
+            Queue for number of read pairs linking scaffolds in each BAM file.
+        """
+
+        num_bams = len(bam_files)
+        links = defaultdict(int)
+        aligned_bases = np.frombuffer(shared_aligned_bases, dtype=np.float64).reshape(-1, num_bams)
+        aligned_bases_var = np.frombuffer(shared_aligned_bases_var, dtype=np.float64).reshape(-1, num_bams)
+        read_counts = np.frombuffer(shared_read_counts, dtype=np.uint32).reshape(num_bams, -1, NUM_COUNTERS)
+        if window_size:
+            window_depth = np.frombuffer(shared_window_depth, dtype=np.float32).reshape(num_bams, -1)
+            depth_stats = np.frombuffer(shared_depth_stats, dtype=np.float64).reshape(num_bams, -1, 2)
+
+        while True:
+            bam_index, work_unit = queue_in.get(block=True, timeout=None)
+            if bam_index == None:
+                queue_links.put(dict(links))
+                break
+
+            start_time = time.time()
+            bamfile = self._open(bam_files[bam_index], self.io_threads)
+            ref_seq_lens = bamfile.lengths
+
+            if streaming:
+                ref_start, ref_end = work_unit
+                ref_indices = xrange(ref_start, ref_end)
+                reads = self._stream_reads(bamfile, ref_start, ref_end)
+            else:
+                ref_indices = work_unit
+                reads = self._fetch_reads(bamfile, work_unit)
+            num_ref_seqs = len(ref_indices)
+
+            # sampled regions are fetched individually through the index
+            if sample_fraction is not None:
+                reads = self._sample_reads(bamfile, ref_indices, sample_fraction)
+
+            cur_ref = None
+            for read in reads:
+                if read.reference_id != cur_ref:
+                    if cur_ref is not None:
+                        read_counts[bam_index, cur_ref] = counts
+                        if sample_fraction is not None:
+                            aligned_bases[cur_ref, bam_index], aligned_bases_var[cur_ref, bam_index] = self._sample_estimate(
+                                self._sample_regions(bamfile.references[cur_ref], ref_seq_lens[cur_ref], sample_fraction),
+                                region_bases,
+                                sq_coverage,
+                                ref_seq_lens[cur_ref])
+                        else:
+                            aligned_bases[cur_ref, bam_index] = coverage
+                        if window_size:
+                            window_depth[bam_index, window_offsets[cur_ref]:window_offsets[cur_ref + 1]], \
+                                depth_stats[bam_index, cur_ref] = self._depth_profile(align_starts,
+                                                                                        align_ends,
+                                                                                        ref_seq_lens[cur_ref],
+                                                                                        window_size)
+                    cur_ref = read.reference_id
+                    counts = [0] * NUM_COUNTERS
+                    coverage = 0
+                    sq_coverage = 0
+                    region_bases = defaultdict(int)
+                    align_starts = []
+                    align_ends = []
+
+                counts[NUM_READS] += 1
+
+                if (sample_fraction is None
+                        and read.is_paired and read.is_read1
+                        and not read.flag & LINK_EXCLUDE_FLAGS
+                        and not read.mate_is_unmapped
+                        and read.next_reference_id != read.reference_id):
+                    if read.reference_id < read.next_reference_id:
+                        links[(bam_index, read.reference_id, read.next_reference_id)] += 1
+                    else:
+                        links[(bam_index, read.next_reference_id, read.reference_id)] += 1
+
+                if read.is_unmapped:
+                    pass
+                elif read.is_duplicate:
+                    counts[NUM_DUPLICATES] += 1
+                elif read.is_secondary or read.is_supplementary:
+                    counts[NUM_SECONDARY] += 1
+                elif read.is_qcfail:
+                    counts[NUM_FAILED_QC] += 1
+                elif read.query_alignment_length < min_align_per * read.query_length:
+                    counts[NUM_FAILED_ALIGN_LEN] += 1
+                elif read.get_tag('NM') > max_edit_dist_per * read.query_length:
+                    counts[NUM_FAILED_EDIT_DIST] += 1
+                elif not all_reads and not read.is_proper_pair:
+                    counts[NUM_FAILED_PROPER_PAIR] += 1
+                else:
+                    counts[NUM_MAPPED_READS] += 1
+
+                    # Note: the alignment length (query_alignment_length) is used instead of the
+                    # read length (query_length) as this bring the calculated coverage
+                    # in line with 'samtools depth' (at least when the min
+                    # alignment length and edit distance thresholds are zero)
+                    coverage += read.query_alignment_length
+
+                    if sample_fraction is not None:
+                        region_bases[read.reference_start // SAMPLE_REGION_SIZE] += read.query_alignment_length
+
+                        # nearby mates are sampled together so the variance is calculated
+                        # over read pairs, assuming mates have similar alignment lengths
+                        if read.is_paired and read.next_reference_id == read.reference_id:
+                            sq_coverage += 2 * read.query_alignment_length ** 2
+                        else:
+                            sq_coverage += read.query_alignment_length ** 2
+
+                    if window_size:
+                        align_starts.append(read.reference_start)
+                        align_ends.append(read.reference_end)
+
+            if cur_ref is not None:
+                read_counts[bam_index, cur_ref] = counts
+                if sample_fraction is not None:
+                    aligned_bases[cur_ref, bam_index], aligned_bases_var[cur_ref, bam_index] = self._sample_estimate(
+                        self._sample_regions(bamfile.references[cur_ref], ref_seq_lens[cur_ref], sample_fraction),
+                        region_bases,
+                        sq_coverage,
+                        ref_seq_lens[cur_ref])
+                else:
+                    aligned_bases[cur_ref, bam_index] = coverage
+                if window_size:
+                    window_depth[bam_index, window_offsets[cur_ref]:window_offsets[cur_ref + 1]], \
+                        depth_stats[bam_index, cur_ref] = self._depth_profile(align_starts,
+                                                                                align_ends,
+                                                                                ref_seq_lens[cur_ref],
+                                                                                window_size)
+
+            bamfile.close()
+
+            shared_worker_time[worker_index * num_bams + bam_index] += time.time() - start_time
+            queue_out.put(num_ref_seqs)
+
+    def _depth_profile(self, align_starts, align_ends, seq_len, window_size):
+        """Determine per-base depth profile of a scaffold.
+
+        The depth of each base is the cumulative sum of a difference
+        array which is incremented at the start and decremented at the
+        end of each alignment.
+
+        Parameters
+        ----------
+        align_starts : list of int
+            Start position of each alignment (0-based, inclusive).
+        align_ends : list of int
+            End position of each alignment (0-based, exclusive).
+        seq_len : int
+            Length of scaffold.
+        window_size : int
+            Size of windows.
+
+        Returns
+        -------
+        numpy.ndarray
+            Mean depth of each window along scaffold.
+        tuple : (float, float)
+            Trimmed mean and variance of per-base depth of scaffold.
+        """
+
+        depth_diff = np.bincount(align_starts, minlength=seq_len + 1)
+        depth_diff -= np.bincount(align_ends, minlength=seq_len + 1)
+        depth = np.cumsum(depth_diff[0:seq_len])
+
+        return self._depth_summary(depth, window_size)
+
+    def _depth_summary(self, depth, window_size):
+        """Summarize per-base depth of a scaffold.
+
+        Parameters
+        ----------
+        depth : numpy.ndarray
+            Depth of each base in scaffold.
+        window_size : int
+            Size of windows.
+
+        Returns
+        -------
+        numpy.ndarray
+            Mean depth of each window along scaffold.
+        tuple : (float, float)
+            Trimmed mean and variance of per-base depth of scaffold.
+        """
+
+        seq_len = len(depth)
+        window_starts = np.arange(0, seq_len, window_size)
+        window_lens = np.diff(np.append(window_starts, seq_len))
+        window_depth = np.add.reduceat(depth, window_starts) / window_lens.astype(np.float64)
+
+        return window_depth, (trim_mean(depth, DEPTH_TRIM), depth.var())
+
+    def _links_file(self, coverage_file):
+        """Get file for scaffold links beside a coverage file."""
+
+        return os.path.join(os.path.dirname(coverage_file), 'links.tsv')
+
+    def write_links(self, links_file, seq_ids, links):
+        """Write number of read pairs linking scaffolds.
+
+        Links are written as an edge list with the identifiers of the
+        two scaffolds followed by the number of read pairs linking
+        them, ordered from most to least links. This file can be used
+        directly as the links file of the outliers command.
+
+        Parameters
+        ----------
+        links_file : str
+            Output file for scaffold links.
+        seq_ids : list
+            Identifiers of scaffolds.
+        links : dict : d[(ref_index1, ref_index2)] -> number of links
+            Number of read pairs linking scaffolds.
+        """
+
+        fout = open(links_file, 'w')
+        fout.write('# Scaffold Id 1\tScaffold Id 2\tNumber of links\n')
+        for (ref_index1, ref_index2), num_links in sorted(links.iteritems(), key=lambda x: (-x[1], x[0])):
+            fout.write('%s\t%s\t%d\n' % (seq_ids[ref_index1], seq_ids[ref_index2], num_links))
+        fout.close()
+
+        self.logger.info('Scaffold links written to: %s' % links_file)
+
+    def read_links(self, links_file):
+        """Read number of read pairs linking scaffolds.
+
+        Parameters
+        ----------
+        links_file : str
+            File with scaffold links.
+
+        Returns
+        -------
+        dict : d[(scaffold_id1, scaffold_id2)] -> number of links
+            Number of read pairs linking scaffolds.
+        """
+
+        links = {}
+        try:
+            with open(links_file) as f:
+                for line in f:
+                    if line.startswith('#') or not line.strip():
+                        continue
+
+                    line_split = line.rstrip('\n').split('\t')
+                    links[(line_split[0], line_split[1])] = int(line_split[2])
+        except IOError:
+            self.logger.error('Failed to open links file: %s' % links_file)
+            sys.exit()
+        except:
+            print traceback.format_exc()
+            print ''
+            raise ParsingError("[Error] Failed to process links file: " + links_file)
+
+        return links
+
+    def _write_qc_reports(self, coverage_file, seq_ids, seq_lens, bam_ids, qc_reports):
+        """Write read filtering report of each BAM file.
+
+        Totals, filter rates, and processing times are written to
+        <bam_id>.qc.json and read counters of each scaffold to
+        <bam_id>.qc.tsv in the directory of the coverage file.
+
+        Parameters
+        ----------
+        coverage_file : str
+            File containing coverage profiles.
+        seq_ids : list
+            Identifiers of scaffolds.
+        seq_lens : list
+            Length of each scaffold.
+        bam_ids : list
+            Identifier of each BAM file.
+        qc_reports : list of dict
+            Read filtering report for each BAM file.
+        """
+
+        output_dir = os.path.dirname(coverage_file)
+        for bam_id, qc_report in zip(bam_ids, qc_reports):
+            scaffold_read_counts = qc_report['scaffold_read_counts']
+
+            fout = open(os.path.join(output_dir, bam_id + '.qc.tsv'), 'w')
+            fout.write('Scaffold Id\tLength (bp)\t' + '\t'.join(COUNTER_NAMES) + '\n')
+            for row_index, seq_id in enumerate(seq_ids):
+                fout.write('%s\t%d\t%s\n' % (seq_id,
+                                                seq_lens[row_index],
+                                                '\t'.join([str(x) for x in scaffold_read_counts[row_index]])))
+            fout.close()
+
+            report = dict((k, v) for k, v in qc_report.iteritems() if k != 'scaffold_read_counts')
+            fout = open(os.path.join(output_dir, bam_id + '.qc.json'), 'w')
+            json.dump(report, fout, indent=2, sort_keys=True)
+            fout.write('\n')
+            fout.close()
+
+        self.logger.info('Read filtering reports written to: %s' % os.path.join(output_dir, '<bam_id>.qc.[json|tsv]'))
+
+    def _write_depth_profiles(self, coverage_file, seq_ids, seq_lens, bam_ids, window_size, depth_profiles):
+        """Write depth profiles of each BAM file to binary files.
+
+        Depth profiles of each BAM file are written as uncompressed
+        .npy arrays to the <bam_id>.depth directory in the directory
+        of the coverage file, so they can be memory-mapped. Scaffold ids
+        are stored in sorted order along with the row of each id.
+
+        Parameters
+        ----------
+        coverage_file : str
+            File containing coverage profiles.
+        seq_ids : list
+            Identifiers of scaffolds.
+        seq_lens : list
+            Length of each scaffold.
+        bam_ids : list
+            Identifier of each BAM file.
+        window_size : int
+            Size of windows.
+        depth_profiles : tuple : (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            Mean depth in windows along each scaffold for each BAM file, along with the
+            trimmed mean and variance of the per-base depth of each scaffold for each
+            BAM file.
+        """
+
+        window_depth, trimmed_mean, variance = depth_profiles
+
+        seq_lens = np.array(seq_lens, dtype=np.int64)
+        num_windows = (seq_lens + window_size - 1) // window_size
+        window_offsets = np.concatenate(([0], np.cumsum(num_windows)))
+
+        seq_ids = np.array(seq_ids, dtype='S%d' % max([len(seq_id) for seq_id in seq_ids] + [1]))
+        sorted_rows = np.argsort(seq_ids, kind='mergesort')
+
+        output_dir = os.path.dirname(coverage_file)
+        for i, bam_id in enumerate(bam_ids):
+            depth_dir = os.path.join(output_dir, bam_id + '.depth')
+            make_sure_path_exists(depth_dir)
+
+            arrays = {'ids': seq_ids[sorted_rows],
+                        'rows': sorted_rows,
+                        'seq_lens': seq_lens,
+                        'window_size': np.array(window_size, dtype=np.int64),
+                        'window_offsets': window_offsets,
+                        'window_depth': window_depth[i],
+                        'trimmed_mean': trimmed_mean[i],
+                        'variance': variance[i]}
+            for name, array in arrays.iteritems():
+                np.save(os.path.join(depth_dir, name + '.npy'), array)
+
+            self._depth_profiles.pop(depth_dir, None)
+
+        self.logger.info('Depth profiles written to: %s' % os.path.join(output_dir, '<bam_id>.depth'))
+
+    def _writer(self, num_reference_seqs, writer_queue):
+        """Report progress of worker processes.
+
+        Parameters
+        ----------
+        num_reference_seqs : int
+            Number of reference scaffolds to process across all BAM files.
+        writer_queue : queue
+            Queue indicating number of reference scaffolds processed by workers.
+        """
+
+        processed_ref_seqs = 0
+        while True:
+            num_processed = writer_queue.get(block=True, timeout=None)
+            if num_processed == None:
+                break
+
+            if not self.logger.is_silent:
+                processed_ref_seqs += num_processed
+                statusStr = '  Finished processing %d of %d (%.2f%%) reference sequences.' % (processed_ref_seqs, num_reference_seqs, float(processed_ref_seqs) * 100 / num_reference_seqs)
+                sys.stderr.write('%s\r' % statusStr)
+                sys.stderr.flush()
+
+        if not self.logger.is_silent:
+            sys.stderr.write('\n')
+
+    def _index_coverage(self, bam_files, ref_seq_lens, all_reads, min_align_per, max_edit_dist_per):
+        """Approximate coverage from BAM index statistics.
+
+        The number of mapped reads for each scaffold is taken from the
+        BAM index and multiplied by the mean number of aligned bases per
+        mapped read. This mean is estimated from a sample of reads spread
+        across the scaffolds of each BAM file using the same read filters
+        as the exact coverage calculation.
+
+        Parameters
+        ----------
+        bam_files : list of str
+            BAM files to process.
+        ref_seq_lens : list
+            Length of each reference scaffold.
+        all_reads : boolean
+            Flag indicating if all reads or just paired reads should be processed.
+        min_align_per : float
+            Alignment percentage threshold for accepting mapped reads.
+        max_edit_dist_per : float
+            Edit distance threshold for accepting mapped reads.
+
+        Returns
+        -------
+        numpy.ndarray
+            Coverage matrix with a row for each scaffold and a column for each BAM file.
+        """
+
+        ref_seq_lens = np.array(ref_seq_lens, dtype=np.float64)
+        coverage = np.zeros((len(ref_seq_lens), len(bam_files)))
+        for i, bam_file in enumerate(bam_files):
+            bamfile = self._open(bam_file)
+            try:
+                mapped_reads = np.array([stats.mapped for stats in bamfile.get_index_statistics()], dtype=np.float64)
+                if bamfile.is_cram:
+                    mapped_reads = None
+            except (AttributeError, ValueError):
+                mapped_reads = None
+            bamfile.close()
+
+            if mapped_reads is None or len(mapped_reads) != len(ref_seq_lens):
+                self.logger.error('BAM index does not provide read counts required for fast coverage mode: %s\n' % bam_file)
+                sys.exit()
+
+            num_sampled, aligned_bases_per_read = self._sample_aligned_bases(bam_file,
+                                                                                mapped_reads,
+                                                                                all_reads,
+                                                                                min_align_per,
+                                                                                max_edit_dist_per)
+            coverage[:, i] = mapped_reads * aligned_bases_per_read / np.maximum(ref_seq_lens, 1)
+
+            self.reporter.info('')
+            self.reporter.info('  Index statistics for %s (%d of %d):' % (ntpath.basename(bam_file), i + 1, len(bam_files)))
+            self.reporter.info('  # mapped reads: %d' % mapped_reads.sum())
+            self.reporter.info('  # sampled reads: %d' % num_sampled)
+            self.reporter.info('  # aligned bases per mapped read: %.1f' % aligned_bases_per_read)
+
+        return coverage
+
+    def _sample_aligned_bases(self, bam_file, mapped_reads, all_reads, min_align_per, max_edit_dist_per, num_reads=10000, min_reads_per_seq=10):
+        """Estimate mean number of aligned bases per mapped read.
+
+        Reads are fetched through the BAM index from evenly spaced
+        scaffolds so the sample is not restricted to the scaffolds
+        at the start of a sorted BAM file. The mean of each sampled
+        scaffold is weighted by its number of mapped reads. Reads
+        failing the coverage filters contribute no aligned bases so
+        the estimate also accounts for filtered reads.
+
+        Parameters
+        ----------
+        bam_file : str
+            BAM file to sample.
+        mapped_reads : numpy.ndarray
+            Number of mapped reads to each scaffold.
+        all_reads : boolean
+            Flag indicating if all reads or just paired reads should be processed.
+        min_align_per : float
+            Alignment percentage threshold for accepting mapped reads.
+        max_edit_dist_per : float
+            Edit distance threshold for accepting mapped reads.
+        num_reads : int
+            Number of mapped reads to sample.
+        min_reads_per_seq : int
+            Minimum number of mapped reads to sample from each sampled scaffold.
+
+        Returns
+        -------
+        int
+            Number of mapped reads sampled.
+        float
+            Mean number of aligned bases per mapped read.
+        """
+
+        seq_indices = np.flatnonzero(mapped_reads > 0)
+        max_seqs = max(num_reads // min_reads_per_seq, 1)
+        if len(seq_indices) > max_seqs:
+            seq_indices = seq_indices[np.linspace(0, len(seq_indices) - 1, max_seqs).astype(np.int64)]
+        reads_per_seq = max(num_reads // max(len(seq_indices), 1), min_reads_per_seq)
+
+        num_sampled = 0
+        weighted_bases = 0.0
+        total_weight = 0.0
+        bamfile = self._open(bam_file, self.io_threads)
+        for seq_index in seq_indices:
+            seq_sampled = 0
+            aligned_bases = 0
+            for read in bamfile.fetch(bamfile.references[seq_index]):
+                if read.is_unmapped:
+                    continue
+
+                seq_sampled += 1
+                if (not read.is_duplicate
+                        and not read.is_secondary
+                        and not read.is_supplementary
+                        and not read.is_qcfail
+                        and read.query_alignment_length >= min_align_per * read.query_length
+                        and read.get_tag('NM') <= max_edit_dist_per * read.query_length
+                        and (all_reads or read.is_proper_pair)):
+                    aligned_bases += read.query_alignment_length
+
+                if seq_sampled >= reads_per_seq:
+                    break
+
+            if seq_sampled:
+                num_sampled += seq_sampled
+                weighted_bases += mapped_reads[seq_index] * float(aligned_bases) / seq_sampled
+                total_weight += mapped_reads[seq_index]
+        bamfile.close()
+
+        return num_sampled, weighted_bases / max(total_weight, 1)
+
+    def _mode_comments(self, coverage_mode, sample_fraction):
+        """Get comment lines marking approximate coverage profiles.
+
+        Parameters
+        ----------
+        coverage_mode : str
+            Mode used to calculate coverage profiles.
+        sample_fraction : float
+            Fraction of reads sampled to estimate coverage.
+
+        Returns
+        -------
+        list of str
+            Comment lines to write before the header of the coverage file.
+        """
+
+        if coverage_mode == 'fast':
+            return [APPROXIMATE_HEADER]
+        elif coverage_mode == 'sample':
+            return [SAMPLE_HEADER % (sample_fraction * 100)]
+
+        return []
+
+    def _header_comments(self, coverage_file):
+        """Get comment lines preceding the header of a coverage file.
+
+        Parameters
+        ----------
+        coverage_file : str
+            File containing coverage profiles.
+
+        Returns
+        -------
+        list of str
+            Comment lines of coverage file.
+        """
+
+        comments = []
+        with open(coverage_file) as f:
+            for line in f:
+                if not line.startswith('#'):
+                    break
+                comments.append(line.rstrip('\n'))
+
+        return comments
+
+    def _ci_file(self, coverage_file):
+        """Get file for confidence intervals of coverage profiles.
+
+        Parameters
+        ----------
+        coverage_file : str
+            File containing coverage profiles.
+
+        Returns
+        -------
+        str
+            File for half-width of 95% confidence interval of coverage profiles.
+        """
+
+        return os.path.splitext(coverage_file)[0] + '_ci.tsv'
+
+    def _report_totals(self, totals):
+        """Report number of reads passing and failing each filter.
+
+        Parameters
+        ----------
+        totals : list
+            Total number of reads for each read counter.
+        """
+
+        total_reads = max(totals[NUM_READS], 1)
+        self.reporter.info('  # total reads: %d' % totals[NUM_READS])
+        self.reporter.info('    # properly mapped reads: %d (%.1f%%)' % (totals[NUM_MAPPED_READS], float(totals[NUM_MAPPED_READS]) * 100 / total_reads))
+        self.reporter.info('    # duplicate reads: %d (%.1f%%)' % (totals[NUM_DUPLICATES], float(totals[NUM_DUPLICATES]) * 100 / total_reads))
+        self.reporter.info('    # secondary reads: %d (%.1f%%)' % (totals[NUM_SECONDARY], float(totals[NUM_SECONDARY]) * 100 / total_reads))
+        self.reporter.info('    # reads failing QC: %d (%.1f%%)' % (totals[NUM_FAILED_QC], float(totals[NUM_FAILED_QC]) * 100 / total_reads))
+        self.reporter.info('    # reads failing alignment length: %d (%.1f%%)' % (totals[NUM_FAILED_ALIGN_LEN], float(totals[NUM_FAILED_ALIGN_LEN]) * 100 / total_reads))
+        self.reporter.info('    # reads failing edit distance: %d (%.1f%%)' % (totals[NUM_FAILED_EDIT_DIST], float(totals[NUM_FAILED_EDIT_DIST]) * 100 / total_reads))
+        self.reporter.info('    # reads not properly paired: %d (%.1f%%)' % (totals[NUM_FAILED_PROPER_PAIR], float(totals[NUM_FAILED_PROPER_PAIR]) * 100 / total_reads))
+
+    def read_table(self, coverage_file):
+        """Read coverage profiles from file as a matrix.
+
+        Parameters
+        ----------
+        coverage_file : str
+            File containing coverage profiles.
+
+        Returns
+        -------
+        list
+            Identifiers of scaffolds in file order.
+        numpy.ndarray
+            Length of each scaffold.
+        list
+            Identifier of each BAM file.
+        numpy.ndarray
+            Coverage matrix with a row for each scaffold and a column for each BAM file.
+        """
+
+        try:
+            seq_ids = []
+            seq_lens = []
+            coverage = []
+            with open(coverage_file) as f:
+                header = f.readline()
+                while header.startswith('#'):
+                    header = f.readline()
+                header = header.split('\t')
+                bam_ids = [x.strip() for x in header[2:]]
+
+                for line in f:
+                    line_split = line.split('\t')
+                    seq_ids.append(line_split[0])
+                    seq_lens.append(int(line_split[1]))
+                    coverage.append([float(cov) for cov in line_split[2:]])
+        except IOError:
+            self.logger.error('Failed to open coverage file: %s' % coverage_file)
+            sys.exit()
+        except:
+            print traceback.format_exc()
+            print ''
+            raise ParsingError("[Error] Failed to process coverage file: " + coverage_file)
+            sys.exit()
+
+        coverage = np.array(coverage, dtype=np.float64).reshape(len(seq_ids), len(bam_ids))
+
+        return seq_ids, np.array(seq_lens, dtype=np.int64), bam_ids, coverage
+
+    def read(self, coverage_file):
+        """Read coverage information from file.
+
+        Parameters
+        ----------
+        coverage_file : str
+            File containing coverage profiles.
+
+        Returns
+        -------
+        dict : d[scaffold_id][bam_id] -> coverage
+            Coverage profile for each scaffold.
+        dict : d[scaffold_id] -> length
+            Length of each scaffold.
+        """
+
+        try:
+            coverage = defaultdict(lambda: defaultdict(float))
+            length = {}
+            with open(coverage_file) as f:
+                header = f.readline()
+                while header.startswith('#'):
+                    header = f.readline()
+                header = header.split('\t')
+                bam_ids = [x.strip() for x in header[2:]]
+
+                for line in f:
+                    line_split = line.split('\t')
+                    scaffold_id = line_split[0]
+                    scaffold_len = int(line_split[1])
+
+                    length[scaffold_id] = scaffold_len
+
+                    for i, cov in enumerate(line_split[2:]):
+                        coverage[scaffold_id][bam_ids[i]] = float(cov)
+        except IOError:
+            self.logger.error('Failed to open signature file: %s' % coverage_file)
+            sys.exit()
+        except:
+            print traceback.format_exc()
+            print ''
+            raise ParsingError("[Error] Failed to process coverage file: " + coverage_file)
+            sys.exit()
+
+        return coverage, length
+
+    def _open_depth_profiles(self, depth_dir):
+        """Memory-map depth profiles of a BAM file.
+
+        Parameters
+        ----------
+        depth_dir : str
+            Directory containing depth profiles of a BAM file.
+
+        Returns
+        -------
+        ScaffoldIdIndex
+            Row of each scaffold.
+        dict : d[name] -> numpy.ndarray
+            Memory-mapped arrays of depth profiles.
+        """
+
+        if depth_dir not in self._depth_profiles:
+            arrays = {}
+            for name in ['ids', 'rows', 'window_offsets', 'window_depth', 'trimmed_mean', 'variance']:
+                arrays[name] = np.load(os.path.join(depth_dir, name + '.npy'), mmap_mode='r')
+
+            index = ScaffoldIdIndex(arrays.pop('ids'), arrays.pop('rows'))
+            self._depth_profiles[depth_dir] = (index, arrays)
+
+        return self._depth_profiles[depth_dir]
+
+    def read_depth_profile(self, depth_file, seq_id):
+        """Read depth profile of a scaffold.
+
+        Only the profile of the requested scaffold is read from
+        the memory-mapped arrays.
+
+        Parameters
+        ----------
+        depth_file : str
+            Directory containing depth profiles of a BAM file.
+        seq_id : str
+            Identifier of scaffold.
+
+        Returns
+        -------
+        numpy.ndarray
+            Mean depth of each window along scaffold.
+        float
+            Trimmed mean of per-base depth of scaffold.
+        float
+            Variance of per-base depth of scaffold.
+        """
+
+        try:
+            index, depth_profiles = self._open_depth_profiles(depth_file)
+        except IOError:
+            self.logger.error('Failed to open depth profile file: %s' % depth_file)
+            sys.exit()
+
+        seq_index = index.get(seq_id)
+        if seq_index is None:
+            raise ParsingError("[Error] Scaffold %s is not in depth profile file: %s" % (seq_id, depth_file))
+
+        window_offsets = depth_profiles['window_offsets']
+        window_depth = np.array(depth_profiles['window_depth'][window_offsets[seq_index]:window_offsets[seq_index + 1]])
+
+        return window_depth, depth_profiles['trimmed_mean'][seq_index], depth_profiles['variance'][seq_index]
@@ -20,13 +20,14 @@
 ###############################################################################
 
 import logging
-from collections import namedtuple, defaultdict
+from collections import namedtuple
 
-from numpy import (array as np_array, mean as np_mean, median as np_median)
+from numpy import (mean as np_mean, median as np_median,
+                   abs as np_abs, float64 as np_float64,
+                   nan as np_nan, full as np_full)
 import weightedstats as ws
 
 from biolib.common import alphanumeric_sort
-from biolib.genomic_signature import GenomicSignature
 
 
 class GenomeStats():
@@ -41,6 +42,10 @@ class GenomeStats():
      - mean and median coverage
      - mean and median tetranucleotide signature
      - mean and median tetranucleotide distance (TD) from mean/median of genome
+
+    Coverage and tetranucleotide statistics are calculated over scaffolds
+    with coverage profiles and signatures. They are NaN for genomes where
+    all scaffolds were skipped when calculating profiles.
     """
 
     def __init__(self):
@@ -75,53 +80,45 @@ class GenomeStats():
         self.coverage_headers = scaffold_stats.coverage_headers
         self.signature_headers = scaffold_stats.signature_headers
 
-        genome_size = defaultdict(int)
-        scaffold_length = defaultdict(list)
-        gc = defaultdict(list)
-        coverage = defaultdict(list)
-        signature = defaultdict(list)
-        for _scaffold_id, stats in scaffold_stats.stats.iteritems():
-            if stats.genome_id == scaffold_stats.unbinned:
-                continue
-                
-            genome_size[stats.genome_id] += stats.length
-            scaffold_length[stats.genome_id].append(stats.length)
-            gc[stats.genome_id].append(stats.gc)
-            coverage[stats.genome_id].append(stats.coverage)
-            signature[stats.genome_id].append(stats.signature)
-
-        # record statistics for each genome
-        genomic_signature = GenomicSignature(0)
-
         self.genome_stats = {}
-        for genome_id in genome_size:
+        for genome_id, rows in scaffold_stats.scaffolds_in_genome.iteritems():
             # calculate weighted mean and median statistics
-            weights = np_array(scaffold_length[genome_id])
-            
-            len_array = np_array(scaffold_length[genome_id])
+            weights = scaffold_stats.length_array[rows]
+            genome_size = weights.sum()
+
+            len_array = scaffold_stats.length_array[rows]
             mean_len = ws.numpy_weighted_mean(len_array, weights)
             median_len = ws.numpy_weighted_median(len_array, weights)
-            
-            gc_array = np_array(gc[genome_id])
+
+            gc_array = scaffold_stats.gc_array[rows]
             mean_gc = ws.numpy_weighted_mean(gc_array, weights)
             median_gc = ws.numpy_weighted_median(gc_array, weights)
-            
-            cov_array = np_array(coverage[genome_id]).T
-            mean_cov = ws.numpy_weighted_mean(cov_array, weights)
-            median_cov = []
-            for i in xrange(cov_array.shape[0]):
-                median_cov.append(ws.numpy_weighted_median(cov_array[i,:], weights))
-            
-            signature_array = np_array(signature[genome_id]).T
-            mean_signature = ws.numpy_weighted_mean(signature_array, weights)
-
-            # calculate mean and median tetranucleotide distance
-            td = []
-            for scaffold_id in scaffold_stats.scaffolds_in_genome[genome_id]:
-                stats = scaffold_stats.stats[scaffold_id]
-                td.append(genomic_signature.manhattan(stats.signature, mean_signature))
-  
-            self.genome_stats[genome_id] = self.GenomeStats(genome_size[genome_id],
+
+            # scaffolds skipped when calculating coverage profiles
+            # and signatures have NaN values
+            profiled_rows = scaffold_stats.profiled_rows(rows)
+            if len(profiled_rows) == 0:
+                self.logger.warning('Genome %s has no scaffolds with coverage profiles and signatures.' % genome_id)
+                mean_cov = np_full(scaffold_stats.coverage_profile_length(), np_nan)
+                median_cov = list(mean_cov)
+                mean_signature = np_full(scaffold_stats.signature_length(), np_nan)
+                td = np_full(1, np_nan)
+            else:
+                profile_weights = scaffold_stats.length_array[profiled_rows]
+
+                cov_array = scaffold_stats.coverage_matrix[profiled_rows].astype(np_float64).T
+                mean_cov = ws.numpy_weighted_mean(cov_array, profile_weights)
+                median_cov = []
+                for i in xrange(cov_array.shape[0]):
+                    median_cov.append(ws.numpy_weighted_median(cov_array[i,:], profile_weights))
+
+                signature_array = scaffold_stats.signature_matrix[profiled_rows].astype(np_float64)
+                mean_signature = ws.numpy_weighted_mean(signature_array.T, profile_weights)
+
+                # calculate mean and median tetranucleotide distance
+                td = np_abs(signature_array - mean_signature).sum(axis=1)
+
+            self.genome_stats[genome_id] = self.GenomeStats(genome_size,
                                                             mean_len, median_len,
                                                             mean_gc, median_gc,
                                                             mean_cov, median_cov,
@@ -0,0 +1,451 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+__author__ = 'Donovan Parks'
+__copyright__ = 'Copyright 2015'
+__credits__ = ['Donovan Parks']
+__license__ = 'GPL3'
+__maintainer__ = 'Donovan Parks'
+__email__ = 'donovan.parks@gmail.com'
+
+import os
+import sys
+import hashlib
+import logging
+
+import numpy as np
+from scipy import sparse
+
+MIN_K = 2
+MAX_K = 8
+MAX_DENSE_K = 6
+
+# bytes counted when calculating GC content, with uracil treated as thymine
+GC_BYTES = np.array([ord(nt) for nt in 'CcGg'])
+ACGT_BYTES = np.array([ord(nt) for nt in 'AaCcGgTtUu'])
+
+
+class KmerSignature(object):
+    """Vectorized calculation of canonical k-mer signatures.
+
+    Each sequence is 2-bit encoded, rolling k-mer codes are built with
+    bit shifts, and k-mers are folded onto their lexicographically lowest
+    form (k-mer or reverse complement) with a lookup table before being
+    counted with np.bincount. K-mers containing an ambiguous base are
+    ignored. The canonical order is identical to biolib's GenomicSignature.
+
+    Signatures of multiple sequences are returned as a dense float32
+    matrix for k <= 6 and as a CSR sparse matrix for larger k.
+    """
+
+    def __init__(self, k):
+        """Initialization.
+
+        Parameters
+        ----------
+        k : int
+            Length of k-mers.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        if k < MIN_K or k > MAX_K:
+            self.logger.error('K-mer length must be between %d and %d.' % (MIN_K, MAX_K))
+            sys.exit()
+
+        self.k = k
+        self.sparse = k > MAX_DENSE_K
+
+        # 2-bit code of each nucleotide, with ambiguous bases set to 4
+        self.nt_code = np.empty(256, dtype=np.uint8)
+        self.nt_code.fill(4)
+        for code, nts in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+            for nt in nts:
+                self.nt_code[ord(nt)] = code
+
+        # fold each k-mer code onto the code of its canonical k-mer; codes
+        # sort in the same order as k-mers since A < C < G < T
+        codes = np.arange(4 ** k, dtype=np.uint32)
+        compl = ~codes
+        rev_compl = np.zeros(4 ** k, dtype=np.uint32)
+        for _ in xrange(k):
+            rev_compl <<= 2
+            rev_compl |= compl & 3
+            compl >>= 2
+
+        canonical_codes, self.canonical_index = np.unique(np.minimum(codes, rev_compl),
+                                                          return_inverse=True)
+        self.num_kmers = len(canonical_codes)
+        self.kmer_cols = [self._decode(code) for code in canonical_codes]
+
+    def _decode(self, code):
+        """Convert k-mer code to k-mer."""
+        return ''.join(['ACGT'[(code >> (2 * (self.k - i - 1))) & 3] for i in xrange(self.k)])
+
+    def canonical_order(self):
+        """Canonical order of k-mers."""
+        return self.kmer_cols
+
+    def kmer_indices(self, seq):
+        """Determine canonical index of each unambiguous k-mer in a sequence.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+
+        Returns
+        -------
+        numpy.ndarray
+            Index in the canonical order of each k-mer.
+        """
+
+        _positions, kmer_ids = self.kmer_positions(seq)
+        return kmer_ids
+
+    def kmer_positions(self, seq):
+        """Determine position and canonical index of each unambiguous k-mer in a sequence.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+
+        Returns
+        -------
+        numpy.ndarray
+            Start position of each k-mer.
+        numpy.ndarray
+            Index in the canonical order of each k-mer.
+        """
+
+        if len(seq) < self.k:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        nt_codes = self.nt_code[np.frombuffer(seq, dtype=np.uint8)]
+        ambiguous = nt_codes > 3
+        nt_codes &= 3
+
+        num_windows = len(seq) - self.k + 1
+        kmer_codes = np.zeros(num_windows, dtype=np.uint32)
+        valid = np.ones(num_windows, dtype=bool)
+        for i in xrange(self.k):
+            kmer_codes <<= 2
+            kmer_codes |= nt_codes[i:i + num_windows]
+            valid &= ~ambiguous[i:i + num_windows]
+
+        return np.flatnonzero(valid), self.canonical_index[kmer_codes[valid]]
+
+    def counts(self, seq):
+        """Count canonical k-mers in a sequence.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+
+        Returns
+        -------
+        numpy.ndarray
+            Count of each k-mer in the canonical order.
+        """
+
+        return np.bincount(self.kmer_indices(seq), minlength=self.num_kmers)
+
+    def window_counts(self, seq, window_size, step_size):
+        """Count canonical k-mers in sliding windows along a sequence.
+
+        K-mers are counted once in blocks of step_size bases and
+        the counts of each window are the difference of cumulative
+        block counts, so each window costs O(1) regardless of its size.
+        A k-mer is assigned to the window containing its start position.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+        window_size : int
+            Size of windows (a multiple of step_size).
+        step_size : int
+            Number of bases between the start of consecutive windows.
+
+        Returns
+        -------
+        numpy.ndarray
+            Count of each k-mer (columns) in each window (rows).
+        """
+
+        blocks_per_window = window_size // step_size
+        num_windows = max((len(seq) - window_size) // step_size + 1, 0)
+        if num_windows == 0:
+            return np.zeros((0, self.num_kmers), dtype=np.int64)
+
+        num_blocks = num_windows + blocks_per_window - 1
+        positions, kmer_ids = self.kmer_positions(seq[0:num_blocks * step_size + self.k - 1])
+        block_counts = np.bincount((positions // step_size) * self.num_kmers + kmer_ids,
+                                   minlength=num_blocks * self.num_kmers).reshape(num_blocks, self.num_kmers)
+
+        cumulative_counts = np.zeros((num_blocks + 1, self.num_kmers), dtype=np.int64)
+        np.cumsum(block_counts, axis=0, out=cumulative_counts[1:])
+
+        return cumulative_counts[blocks_per_window:] - cumulative_counts[0:num_windows]
+
+    def seq_signature(self, seq):
+        """Calculate normalized k-mer signature of a sequence.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+
+        Returns
+        -------
+        numpy.ndarray
+            Frequency of each k-mer in the canonical order.
+        """
+
+        counts = self.counts(seq)
+        return counts / float(max(counts.sum(), 1))
+
+    def gc(self, seq):
+        """Calculate GC content of a sequence.
+
+        GC is calculated as (G+C)/(A+C+G+T), ignoring ambiguous
+        bases, to match biolib's seq_tk.gc().
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+
+        Returns
+        -------
+        float
+            GC content of sequence.
+        """
+
+        byte_counts = np.bincount(np.frombuffer(seq, dtype=np.uint8), minlength=256)
+        return float(byte_counts[GC_BYTES].sum()) / int(byte_counts[ACGT_BYTES].sum())
+
+    def signature_matrix(self, seqs):
+        """Calculate normalized k-mer signatures of sequences.
+
+        Parameters
+        ----------
+        seqs : iterable
+            Sequences in nucleotide space.
+
+        Returns
+        -------
+        numpy.ndarray or scipy.sparse.csr_matrix
+            Frequency of each k-mer (columns) in each sequence (rows).
+        """
+
+        if not self.sparse:
+            rows = [self.seq_signature(seq) for seq in seqs]
+            if not rows:
+                return np.zeros((0, self.num_kmers), dtype=np.float32)
+            return np.array(rows, dtype=np.float32)
+
+        data = []
+        indices = []
+        indptr = [0]
+        for seq in seqs:
+            kmer_ids, counts = np.unique(self.kmer_indices(seq), return_counts=True)
+            data.append(counts / float(max(counts.sum(), 1)))
+            indices.append(kmer_ids)
+            indptr.append(indptr[-1] + len(kmer_ids))
+
+        if not data:
+            return sparse.csr_matrix((0, self.num_kmers), dtype=np.float32)
+
+        return sparse.csr_matrix((np.concatenate(data).astype(np.float32),
+                                  np.concatenate(indices),
+                                  np.array(indptr)),
+                                 shape=(len(indptr) - 1, self.num_kmers))
+
+    def manhattan(self, sig1, sig2):
+        """Calculate Manhattan distance between k-mer signatures.
+
+        Parameters
+        ----------
+        sig1 : list of k-mer frequencies in canonical order
+            First k-mer signature.
+        sig2 : list of k-mer frequencies in canonical order
+            Second k-mer signature.
+
+        Returns
+        -------
+        float
+            Manhattan distance between signatures.
+        """
+
+        return np.sum(np.abs(np.asarray(sig1) - np.asarray(sig2)))
+
+    def cache_file(self, cache_dir):
+        """Name of file caching signatures for this k-mer length."""
+        return os.path.join(cache_dir, 'kmer%d.npz' % self.k)
+
+    def cached_signature_matrix(self, seq_ids, seqs, cache_dir):
+        """Calculate k-mer signatures, reusing signatures cached on disk.
+
+        Cached signatures are identified by the MD5 hash of each
+        uppercase sequence, as in the tetranucleotide signature cache.
+        The cache also records the hash of the current sequence of each
+        sequence id. Newly calculated signatures are added to the cache,
+        and signatures no longer referenced by any sequence id are
+        removed when it is written.
+
+        Parameters
+        ----------
+        seq_ids : list
+            Unique ids of sequences.
+        seqs : list
+            Sequences in nucleotide space, in the same order as seq_ids.
+        cache_dir : str
+            Directory containing signature cache (None to disable caching).
+
+        Returns
+        -------
+        numpy.ndarray or scipy.sparse.csr_matrix
+            Frequency of each k-mer (columns) in each sequence (rows).
+        """
+
+        if cache_dir is None:
+            return self.signature_matrix(seqs)
+
+        seq_keys = [hashlib.md5(seq.upper()).hexdigest() for seq in seqs]
+
+        cache_file = self.cache_file(cache_dir)
+        cached_keys, id_keys, cached_matrix = self.read_cache(cache_file)
+        cached_row = dict([(key, row) for row, key in enumerate(cached_keys)])
+
+        # identical sequences share a single row
+        new_keys = []
+        new_seqs = []
+        for key, seq in zip(seq_keys, seqs):
+            if key not in cached_row:
+                cached_row[key] = len(cached_keys) + len(new_keys)
+                new_keys.append(key)
+                new_seqs.append(seq)
+
+        self.logger.info('Using cached %d-mer signatures for %d of %d sequences.' % (self.k,
+                                                                                     sum([1 for key in seq_keys if cached_row[key] < len(cached_keys)]),
+                                                                                     len(seq_ids)))
+
+        matrix = cached_matrix
+        if new_seqs:
+            new_matrix = self.signature_matrix(new_seqs)
+            if self.sparse:
+                matrix = sparse.vstack([cached_matrix, new_matrix], format='csr')
+            else:
+                matrix = np.vstack([cached_matrix, new_matrix])
+
+        keys = cached_keys + new_keys
+        seq_matrix = matrix[[cached_row[key] for key in seq_keys]]
+
+        # point sequence ids at their current sequences and
+        # remove signatures of sequences which have changed
+        modified_ids = [seq_id for seq_id, key in zip(seq_ids, seq_keys) if id_keys.get(seq_id) != key]
+        if new_keys or modified_ids:
+            id_keys.update(zip(seq_ids, seq_keys))
+            referenced_keys = set(id_keys.itervalues())
+            referenced_rows = [row for row, key in enumerate(keys) if key in referenced_keys]
+
+            self.write_cache(cache_file,
+                             [keys[row] for row in referenced_rows],
+                             id_keys,
+                             matrix[referenced_rows])
+
+        return seq_matrix
+
+    def read_cache(self, cache_file):
+        """Read cached k-mer signatures.
+
+        Parameters
+        ----------
+        cache_file : str
+            Name of cache file.
+
+        Returns
+        -------
+        list
+            MD5 hash of each cached sequence.
+        dict : d[seq_id] -> MD5 hash
+            Hash of the current sequence of each sequence id.
+        numpy.ndarray or scipy.sparse.csr_matrix
+            Cached k-mer signatures.
+        """
+
+        if self.sparse:
+            empty_matrix = sparse.csr_matrix((0, self.num_kmers), dtype=np.float32)
+        else:
+            empty_matrix = np.zeros((0, self.num_kmers), dtype=np.float32)
+
+        if not os.path.exists(cache_file):
+            return [], {}, empty_matrix
+
+        try:
+            cache = np.load(cache_file)
+            keys = cache['keys'].tolist()
+            id_keys = dict(zip(cache['seq_ids'].tolist(), cache['seq_keys'].tolist()))
+            if self.sparse:
+                matrix = sparse.csr_matrix((cache['data'], cache['indices'], cache['indptr']),
+                                           shape=(len(keys), self.num_kmers))
+            else:
+                matrix = cache['data']
+
+            if matrix.shape != (len(keys), self.num_kmers):
+                raise ValueError
+        except (IOError, KeyError, ValueError):
+            self.logger.warning('Ignoring invalid k-mer signature cache: %s' % cache_file)
+            return [], {}, empty_matrix
+
+        return keys, id_keys, matrix
+
+    def write_cache(self, cache_file, keys, id_keys, matrix):
+        """Write cached k-mer signatures.
+
+        Parameters
+        ----------
+        cache_file : str
+            Name of cache file.
+        keys : list
+            MD5 hash of each cached sequence.
+        id_keys : d[seq_id] -> MD5 hash
+            Hash of the current sequence of each sequence id.
+        matrix : numpy.ndarray or scipy.sparse.csr_matrix
+            K-mer signatures.
+        """
+
+        arrays = {'keys': np.array(keys, dtype='S32'),
+                  'seq_ids': np.array(id_keys.keys(), dtype=str),
+                  'seq_keys': np.array(id_keys.values(), dtype='S32')}
+        if self.sparse:
+            arrays['data'] = matrix.data
+            arrays['indices'] = matrix.indices
+            arrays['indptr'] = matrix.indptr
+        else:
+            arrays['data'] = matrix
+
+        try:
+            # write to temporary file so an interrupted run never leaves a partial cache
+            tmp_file = cache_file + '.tmp.npz'
+            np.savez(tmp_file, **arrays)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError):
+            self.logger.warning('Failed to write k-mer signature cache: %s' % cache_file)
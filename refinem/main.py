@@ -31,6 +31,7 @@ from refinem.coverage import Coverage
 from refinem.tetranucleotide import Tetranucleotide
 from refinem.outliers import Outliers
 from refinem.cluster import Cluster
+from refinem.chimeras import Chimeras
 from refinem.plots.gc_plots import GcPlots
 from refinem.plots.td_plots import TdPlots
 from refinem.plots.cov_perc_plots import CovPercPlots
@@ -39,6 +40,7 @@ from refinem.plots.distribution_plots import DistributionPlots
 from refinem.plots.gc_cov_plot import GcCovPlot
 from refinem.plots.tetra_pca_plot import TetraPcaPlot
 from refinem.plots.combined_plots import CombinedPlots
+from refinem.common import select_scaffolds
 
 import biolib.seq_io as seq_io
 import biolib.genome_tk as genome_tk
@@ -87,6 +89,41 @@ class OptionsParser():
 
         return genome_files
 
+    def _read_genome_scaffold_stats(self, scaffold_stats_file, genome_ids, cpus=1):
+        """Read statistics of scaffolds in genomes of interest.
+
+        Parameters
+        ----------
+        scaffold_stats_file : str
+            File with statistics for individual scaffolds.
+        genome_ids : list
+            Genomes of interest (None for all genomes).
+        cpus : int
+            Number of cpus to use.
+
+        Returns
+        -------
+        ScaffoldStats
+            Statistics for scaffolds in genomes of interest.
+        """
+
+        scaffold_stats = ScaffoldStats(cpus)
+        scaffold_stats.read(scaffold_stats_file, genome_ids=genome_ids)
+
+        if genome_ids:
+            missing_ids = set(genome_ids) - set(scaffold_stats.scaffolds_in_genome)
+            if missing_ids:
+                self.logger.warning('Genomes not found in scaffold statistics file: %s' % ', '.join(sorted(missing_ids)))
+
+            if not scaffold_stats.num_genomes():
+                self.logger.error('None of the specified genomes were found in: %s' % scaffold_stats_file)
+                sys.exit()
+
+            self.logger.info('Read statistics for %d scaffolds in %d genomes.' % (scaffold_stats.num_scaffolds(),
+                                                                                    scaffold_stats.num_genomes()))
+
+        return scaffold_stats
+
     def _check_nuclotide_seqs(self, seq_files):
         """Check if files contain sequences in nucleotide space.
 
@@ -159,34 +196,122 @@ class OptionsParser():
 
         make_sure_path_exists(options.output_dir)
 
+        if options.tetra_benchmark:
+            # signature engines are compared without the signature cache
+            self.logger.info('Benchmarking tetranucleotide signature engines.')
+            Tetranucleotide().benchmark(options.scaffold_file)
+
+        # determine scaffolds to process
+        selected_ids = select_scaffolds(options.scaffold_file,
+                                        genome_files,
+                                        options.min_scaffold_len,
+                                        options.binned_only)
+        if selected_ids is not None:
+            self.logger.info('Selected %d scaffolds for calculating coverage profiles and tetranucleotide signatures.' % len(selected_ids))
+
         # get coverage information
-        if not options.coverage_file:
+        if options.depth_files:
+            if options.coverage_file or options.bam_files:
+                self.logger.warning('Depth tables can not be combined with BAM files or a coverage file.')
+                sys.exit()
+
+            coverage = Coverage(options.cpus)
+            coverage_file = os.path.join(options.output_dir, 'coverage.tsv')
+            coverage.import_depth(options.depth_files,
+                                    options.depth_format,
+                                    options.scaffold_file,
+                                    coverage_file,
+                                    options.cov_window_size,
+                                    selected_ids)
+            self.logger.info('Coverage profiles written to: %s' % coverage_file)
+        elif not options.coverage_file:
             if not options.bam_files:
                 self.logger.warning('One or more BAM files must be specified in order to calculate coverage profiles.')
                 coverage_file = None
             else:
-                coverage = Coverage(options.cpus)
+                coverage = Coverage(options.cpus, options.scaffold_file, options.cov_io_threads)
                 coverage_file = os.path.join(options.output_dir, 'coverage.tsv')
-                coverage.run(options.bam_files, coverage_file, options.cov_all_reads, options.cov_min_align, options.cov_max_edit_dist)
+                coverage.run(options.bam_files,
+                                coverage_file,
+                                options.cov_all_reads,
+                                options.cov_min_align,
+                                options.cov_max_edit_dist,
+                                options.cov_streaming,
+                                options.cov_cache_dir,
+                                options.coverage_mode,
+                                options.cov_sample_fraction,
+                                options.cov_window_size,
+                                selected_ids)
                 self.logger.info('Coverage profiles written to: %s' % coverage_file)
+        elif options.bam_files:
+            # add coverage of new BAM files to existing coverage profiles
+            check_file_exists(options.coverage_file)
+            coverage = Coverage(options.cpus, options.scaffold_file, options.cov_io_threads)
+            coverage_file = os.path.join(options.output_dir, 'coverage.tsv')
+            coverage.append(options.coverage_file,
+                                options.bam_files,
+                                coverage_file,
+                                options.cov_all_reads,
+                                options.cov_min_align,
+                                options.cov_max_edit_dist,
+                                options.cov_streaming,
+                                options.cov_cache_dir,
+                                options.coverage_mode,
+                                options.cov_sample_fraction,
+                                options.cov_window_size)
+            self.logger.info('Coverage profiles written to: %s' % coverage_file)
         else:
             check_file_exists(options.coverage_file)
             coverage_file = options.coverage_file
 
-        # get tetranucleotide signatures
+        stats_output = os.path.join(options.output_dir, 'scaffold_stats.tsv')
+        if options.refresh_coverage:
+            # only update coverage profiles of existing scaffold statistics
+            check_file_exists(stats_output)
+            if not coverage_file:
+                self.logger.warning('Coverage profiles are required to refresh scaffold statistics.')
+                sys.exit()
+
+            stats = ScaffoldStats(options.cpus)
+            stats.refresh_coverage(stats_output, coverage_file, stats_output)
+            self.logger.info('Scaffold statistic written to: %s' % stats_output)
+            return
+
+        # get tetranucleotide signatures and write out scaffold statistics
+        stats = ScaffoldStats(options.cpus)
         if not options.tetra_file:
-            tetra = Tetranucleotide(options.cpus)
-            tetra_file = os.path.join(options.output_dir, 'tetra.tsv')
-            signatures = tetra.run(options.scaffold_file)
-            tetra.write(signatures, tetra_file)
+            tetra = Tetranucleotide(options.cpus, cache_dir=options.tetra_cache_dir)
+            tetra_file = os.path.join(options.output_dir, 'tetra.npy')
+            tetra_tsv_file = None
+            if options.tetra_tsv:
+                tetra_tsv_file = os.path.join(options.output_dir, 'tetra.tsv')
+
+            if options.tetra_streaming:
+                tetra.run_streaming(options.scaffold_file,
+                                        tetra_file,
+                                        selected_ids,
+                                        options.tetra_block_size,
+                                        tetra_tsv_file)
+                stats.run(options.scaffold_file, genome_files, tetra_file, coverage_file, stats_output)
+            else:
+                # signatures, GC, length, and bin assignments are
+                # determined in a single pass over the scaffold file
+                signatures = stats.run_single_pass(options.scaffold_file,
+                                                    genome_files,
+                                                    coverage_file,
+                                                    stats_output,
+                                                    tetra,
+                                                    tetra_file,
+                                                    selected_ids)
+                if tetra_tsv_file:
+                    tetra.write(signatures, tetra_tsv_file)
             self.logger.info('Tetranucleotide signatures written to: %s' % tetra_file)
-        else:
-            tetra_file = options.tetra_file
 
-        # write out scaffold statistics
-        stats_output = os.path.join(options.output_dir, 'scaffold_stats.tsv')
-        stats = ScaffoldStats(options.cpus)
-        stats.run(options.scaffold_file, genome_files, tetra_file, coverage_file, stats_output)
+            if tetra_tsv_file:
+                self.logger.info('Tetranucleotide signatures exported to: %s' % tetra_tsv_file)
+        else:
+            check_file_exists(options.tetra_file)
+            stats.run(options.scaffold_file, genome_files, options.tetra_file, coverage_file, stats_output)
 
         self.logger.info('Scaffold statistic written to: %s' % stats_output)
 
@@ -196,8 +321,9 @@ class OptionsParser():
         check_file_exists(options.scaffold_stats_file)
 
         self.logger.info('Reading scaffold statistics.')
-        scaffold_stats = ScaffoldStats(options.cpus)
-        scaffold_stats.read(options.scaffold_stats_file)
+        scaffold_stats = self._read_genome_scaffold_stats(options.scaffold_stats_file,
+                                                            options.genome_ids,
+                                                            options.cpus)
 
         genome_stats = GenomeStats()
         genome_stats.run(scaffold_stats)
@@ -265,8 +391,8 @@ class OptionsParser():
         make_sure_path_exists(options.output_dir)
 
         self.logger.info('Reading scaffold statistics.')
-        scaffold_stats = ScaffoldStats()
-        scaffold_stats.read(options.scaffold_stats_file)
+        scaffold_stats = self._read_genome_scaffold_stats(options.scaffold_stats_file,
+                                                            options.genome_ids)
 
         genome_stats = GenomeStats()
         genome_stats = genome_stats.run(scaffold_stats)
@@ -297,6 +423,26 @@ class OptionsParser():
             
             self.logger.info('Outlier plots written to: ' + plot_dir)
             
+    def chimeras(self, options):
+        """Chimeras command"""
+
+        check_file_exists(options.scaffold_file)
+        make_sure_path_exists(options.output_dir)
+
+        chimeras = Chimeras(options.cpus)
+        window_file = os.path.join(options.output_dir, 'windows.tsv')
+        breakpoint_file = os.path.join(options.output_dir, 'breakpoints.tsv')
+        chimeras.run(options.scaffold_file,
+                        options.window_size,
+                        options.step_size,
+                        options.min_scaffold_len,
+                        options.td_threshold,
+                        window_file,
+                        breakpoint_file)
+
+        self.logger.info('Tetranucleotide distance of windows written to: ' + window_file)
+        self.logger.info('Putative breakpoints written to: ' + breakpoint_file)
+
     def ssu_erroneous(self, options):
         """Erroneous SSU command"""
         
@@ -356,7 +502,8 @@ class OptionsParser():
                         options.no_pca,
                         options.iterations,
                         options.genome_file,
-                        options.output_dir)
+                        options.output_dir,
+                        os.path.dirname(os.path.abspath(options.scaffold_stats_file)))
 
         self.logger.info('Partitioned sequences written to: ' + options.output_dir)
         
@@ -687,6 +834,8 @@ class OptionsParser():
             self.outliers(options)
         elif(options.subparser_name == 'ssu_erroneous'):
             self.ssu_erroneous(options)
+        elif(options.subparser_name == 'chimeras'):
+            self.chimeras(options)
         elif(options.subparser_name == 'kmeans'):
             self.kmeans(options)
         elif(options.subparser_name == 'dbscan'):
@@ -23,11 +23,10 @@ import logging
 from collections import defaultdict, namedtuple
 
 from scipy.stats import pearsonr
-from numpy import (mean as np_mean)
+from numpy import (mean as np_mean, isnan as np_isnan)
 
 import biolib.seq_io as seq_io
 from biolib.common import find_nearest, alphanumeric_sort, remove_extension
-from biolib.genomic_signature import GenomicSignature
 
 from refinem.plots.gc_plots import GcPlots
 from refinem.plots.td_plots import TdPlots
@@ -37,6 +36,7 @@ from refinem.plots.distribution_plots import DistributionPlots
 from refinem.plots.gc_cov_plot import GcCovPlot
 from refinem.plots.tetra_pca_plot import TetraPcaPlot
 from refinem.plots.combined_plots import CombinedPlots
+from refinem.kmer_signature import KmerSignature
 
 
 class Outliers():
@@ -321,7 +321,7 @@ class Outliers():
                         cov_corr,
                         cov_perc):
 
-        genomic_signature = GenomicSignature(0)
+        genomic_signature = KmerSignature(4)
         
         # make sure distributions have been loaded
         self.read_distributions()
@@ -463,9 +463,12 @@ class Outliers():
         fout.write('\tScaffold coverage\tMedian genome coverage\tCoverage correlation\tCoverage error\n')
 
         processed_genomes = 0
-        for genome_id, scaffold_ids in scaffold_stats.scaffolds_in_genome.iteritems():
+        for genome_id, rows in scaffold_stats.scaffolds_in_genome.iteritems():
             processed_genomes += 1
 
+            # scaffolds without coverage profiles or signatures can not be evaluated
+            scaffold_ids = [scaffold_stats.scaffold_ids[row] for row in scaffold_stats.profiled_rows(rows)]
+
             if not self.logger.is_silent:
                 sys.stdout.write('  Finding outliers in %d of %d (%.1f%%) genomes.\r' % (processed_genomes,
                                                                                          scaffold_stats.num_genomes(),
@@ -544,7 +547,7 @@ class Outliers():
         fout.write('\tScaffold coverage\tMedian genome coverage\tCoverage correlation\tCoverage error')
         fout.write('\t# genes\t% genes with homology\n')
 
-        genomic_signature = GenomicSignature(0)
+        genomic_signature = KmerSignature(4)
 
         self.logger.info('Identifying scaffolds compatible with bins.')
         processed_scaffolds = 0
@@ -556,10 +559,14 @@ class Outliers():
                                                                              processed_scaffolds * 100.0 / len(scaffold_stats.stats)))
                 sys.stdout.flush()
 
-            if scaffold_id not in scaffolds_of_interest:
+            if scaffold_id not in scaffolds_of_interest or not scaffold_stats.has_profiles(scaffold_id):
                 continue
 
             for genome_id, gs in genome_stats.iteritems():
+                if np_isnan(gs.median_td):
+                    # genome has no scaffolds with coverage profiles and signatures
+                    continue
+
                 # find keys into GC and TD distributions
                 # gc -> [mean GC][scaffold length][percentile]
                 # td -> [scaffold length][percentile]
@@ -642,11 +649,12 @@ class Outliers():
         link_scaffold_ids = []
         if links_file:
             for line in open(links_file):
-                if not line.strip():
+                if not line.strip() or line.startswith('#'):
                     continue
 
                 line_split = line.strip().split('\t')
-                if len(line_split) == 2:
+                if len(line_split) in [2, 3]:
+                    # pairs of scaffolds, optionally followed by the number of links between them
                     link_scaffold_ids.append([line_split[0], [1.0, 0.0, 0.0], line_split[1], [1.0, 0.0, 0.0]])
                 else:
                     link_scaffold_ids.append([line_split[0],
@@ -685,8 +693,12 @@ class Outliers():
                 sys.stdout.flush()
 
             genome_scaffold_stats = {}
-            for scaffold_id in scaffold_stats.scaffolds_in_genome[genome_id]:
-                genome_scaffold_stats[scaffold_id] = scaffold_stats.stats[scaffold_id]
+            for row in scaffold_stats.profiled_rows(scaffold_stats.scaffolds_in_genome[genome_id]):
+                genome_scaffold_stats[scaffold_stats.scaffold_ids[row]] = scaffold_stats.row_stats(row)
+
+            if not genome_scaffold_stats:
+                # genome has no scaffolds with coverage profiles and signatures
+                continue
 
             if individual_plots:
                 # GC plot
@@ -0,0 +1,265 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+__author__ = 'Donovan Parks'
+__copyright__ = 'Copyright 2015'
+__credits__ = ['Donovan Parks']
+__license__ = 'GPL3'
+__maintainer__ = 'Donovan Parks'
+__email__ = 'donovan.parks@gmail.com'
+
+import os
+import sys
+import logging
+import traceback
+import Queue
+import multiprocessing as mp
+
+import pysam
+
+from biolib.parallel import Parallel
+
+
+def index_fasta(seq_file):
+    """Build or read the .fai index of a FASTA file.
+
+    The index is written beside the FASTA file and rebuilt
+    when it is older than the FASTA file.
+
+    Parameters
+    ----------
+    seq_file : str
+        Name of FASTA file (uncompressed or bgzip compressed).
+
+    Returns
+    -------
+    list of (str, int)
+        Id and length of each sequence in file order, or None if the
+        file can not be indexed (e.g., FASTQ, gzip, or irregular line lengths).
+    """
+
+    if seq_file.endswith(('.fq', '.fastq', '.fq.gz', '.fastq.gz')):
+        return None
+
+    fai_file = seq_file + '.fai'
+    try:
+        if not os.path.exists(fai_file) or os.path.getmtime(fai_file) < os.path.getmtime(seq_file):
+            pysam.faidx(seq_file)
+
+        seqs = []
+        with open(fai_file) as f:
+            for line in f:
+                line_split = line.split('\t')
+                seqs.append((line_split[0], int(line_split[1])))
+    except (IOError, OSError, ValueError, pysam.SamtoolsError):
+        return None
+
+    return seqs
+
+
+class ParallelFasta(object):
+    """Process sequences of an indexed FASTA file in parallel.
+
+    This class mirrors the interface of biolib's Parallel.run_seqs_file(),
+    but sequences are not read by the main process and passed to workers.
+    Instead, each worker is given ranges of sequences in the .fai index of
+    the FASTA file and reads these sequences itself, so only the results
+    of the producer function cross process boundaries. Files which can not
+    be indexed are processed with biolib's Parallel.
+    """
+
+    def __init__(self, cpus=1, max_range_size=1000):
+        """Initialization.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of processes to create.
+        max_range_size : int
+            Maximum number of sequences in the range given to a worker.
+        """
+
+        self.logger = logging.getLogger('timestamp')
+
+        self.cpus = cpus
+        self.max_range_size = max_range_size
+
+    def _seq_ranges(self, seq_lens):
+        """Partition indexed sequences into ranges of similar total length.
+
+        Parameters
+        ----------
+        seq_lens : list of int
+            Length of each sequence in file order.
+
+        Returns
+        -------
+        list of (int, int)
+            Start and end index of each range of sequences.
+        """
+
+        # aim for several ranges per worker so long
+        # sequences do not leave workers idle
+        max_bases = max(sum(seq_lens) / (8 * self.cpus), 1)
+
+        ranges = []
+        start = 0
+        bases = 0
+        for i, seq_len in enumerate(seq_lens):
+            bases += seq_len
+            if bases >= max_bases or i + 1 - start == self.max_range_size:
+                ranges.append((start, i + 1))
+                start = i + 1
+                bases = 0
+
+        if start < len(seq_lens):
+            ranges.append((start, len(seq_lens)))
+
+        return ranges
+
+    def _worker(self, producer, seq_file, seq_ids, queue_in, queue_out):
+        """Read and process ranges of sequences.
+
+        Parameters
+        ----------
+        producer : function
+            Function to process sequences.
+        seq_file : str
+            Name of indexed FASTA file.
+        seq_ids : list
+            Id of each sequence in file order.
+        queue_in : queue
+            Index, start, and end of ranges of sequences to process.
+        queue_out : queue
+            Index of each range and results of producer function for the range.
+        """
+
+        fasta = pysam.FastaFile(seq_file)
+        while True:
+            seq_range = queue_in.get(block=True, timeout=None)
+            if seq_range == None:
+                break
+
+            range_index, start, end = seq_range
+            produced_data = []
+            for seq_id in seq_ids[start:end]:
+                produced_data.append(producer((seq_id, fasta.fetch(reference=seq_id))))
+
+            queue_out.put((range_index, produced_data))
+
+        fasta.close()
+
+    def run_seqs_file(self, producer, consumer, seq_file, progress=None, ordered=False):
+        """Process sequences in parallel.
+
+        The producer function must be specified and must
+        not return None. Consumer and progress can be set to None.
+        If ordered is set, results of an indexed FASTA file are
+        passed to the consumer in file order. Files processed with
+        biolib's Parallel are consumed in the order they complete.
+
+        Parameters
+        ----------
+        producer : function
+            Function to process a (seq_id, seq) tuple.
+        consumer : function
+            Function to consume processed data items.
+        seq_file : str
+            Name of FASTA file to read.
+        progress : function
+            Function to report progress string.
+        ordered : boolean
+            Flag indicating if results should be consumed in file order.
+
+        Returns
+        -------
+        <user specified>
+            Set by caller in the consumer function.
+        """
+
+        seqs = index_fasta(seq_file)
+        if seqs is None:
+            self.logger.info('Unable to index %s, reading sequences in main process.' % seq_file)
+            parallel = Parallel(self.cpus)
+            return parallel.run_seqs_file(producer, consumer, seq_file, progress)
+
+        seq_ids = [seq_id for seq_id, _seq_len in seqs]
+        seq_ranges = self._seq_ranges([seq_len for _seq_id, seq_len in seqs])
+
+        queue_in = mp.Queue()
+        for range_index, (start, end) in enumerate(seq_ranges):
+            queue_in.put((range_index, start, end))
+
+        for _ in range(self.cpus):
+            queue_in.put(None)
+
+        queue_out = mp.Queue()
+
+        try:
+            worker_proc = [mp.Process(target=self._worker, args=(producer, seq_file, seq_ids, queue_in, queue_out)) for _ in range(self.cpus)]
+            for p in worker_proc:
+                p.start()
+
+            items_processed = 0
+            consumer_data = None
+            pending_ranges = {}
+            next_range = 0
+            for _ in xrange(len(seq_ranges)):
+                if progress:
+                    status = progress(items_processed, len(seq_ids))
+                    if status:
+                        sys.stdout.write('%s\r' % status)
+                        sys.stdout.flush()
+
+                while True:
+                    try:
+                        range_index, range_data = queue_out.get(block=True, timeout=1)
+                        break
+                    except Queue.Empty:
+                        if not any(p.is_alive() for p in worker_proc):
+                            raise RuntimeError('Worker processes exited before all sequences were processed.')
+
+                # hold results until all preceding ranges have been consumed
+                ready_ranges = [range_data]
+                if ordered:
+                    pending_ranges[range_index] = range_data
+                    ready_ranges = []
+                    while next_range in pending_ranges:
+                        ready_ranges.append(pending_ranges.pop(next_range))
+                        next_range += 1
+
+                for range_data in ready_ranges:
+                    for produced_data in range_data:
+                        if consumer:
+                            consumer_data = consumer(produced_data, consumer_data)
+
+                        items_processed += 1
+
+            if progress:
+                status = progress(items_processed, len(seq_ids))
+                if status:
+                    sys.stdout.write('%s\n' % status)
+
+            for p in worker_proc:
+                p.join()
+        except:
+            print traceback.format_exc()
+            for p in worker_proc:
+                p.terminate()
+            sys.exit()
+
+        return consumer_data
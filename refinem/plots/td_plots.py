@@ -20,10 +20,10 @@ import numpy as np
 import mpld3
 
 from biolib.common import find_nearest
-from biolib.genomic_signature import GenomicSignature
 
 from refinem.plots.base_plot import BasePlot
 from refinem.plots.mpld3_plugins import Tooltip
+from refinem.kmer_signature import KmerSignature
 
 
 class TdPlots(BasePlot):
@@ -46,7 +46,7 @@ class TdPlots(BasePlot):
         dict : d[scaffold_id] -> (x, y)
         """
         
-        genomic_signature = GenomicSignature(0)
+        genomic_signature = KmerSignature(4)
 
         pts = {}
         for scaffold_id, stats in genome_scaffold_stats.iteritems():
@@ -124,7 +124,7 @@ class TdPlots(BasePlot):
         """
 
         # histogram plot
-        genomic_signature = GenomicSignature(0)
+        genomic_signature = KmerSignature(4)
 
         delta_tds = []
         for stats in genome_scaffold_stats.values():
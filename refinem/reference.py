@@ -101,10 +101,18 @@ class Reference(object):
             Percent query coverage of valid hits [0, 100].
         """
 
-        # read statistics file
+        # get number of genes on each scaffold
+        num_genes_on_scaffold = defaultdict(int)
+        for seq_id, _seq in seq_io.read_seq(scaffold_gene_file):
+            scaffold_id = seq_id[0:seq_id.rfind('_')]
+            num_genes_on_scaffold[scaffold_id] += 1
+
+        # read statistics of scaffolds with called genes
         self.logger.info('Reading scaffold statistics.')
         scaffold_stats = ScaffoldStats()
-        scaffold_stats.read(stat_file)
+        scaffold_stats.read(stat_file,
+                            columns=['gc', 'length', 'coverage'],
+                            scaffold_ids=num_genes_on_scaffold.keys())
 
         # perform homology searches
         self.logger.info('Creating diamond database for reference genomes.')
@@ -128,12 +136,6 @@ class Reference(object):
         # get list of genes with a top hit to the reference genomes of interest
         hits_to_ref = self._top_hits_to_reference(hits_ref_genomes, hits_comp_ref_genomes)
 
-        # get number of genes on each scaffold
-        num_genes_on_scaffold = defaultdict(int)
-        for seq_id, _seq in seq_io.read_seq(scaffold_gene_file):
-            scaffold_id = seq_id[0:seq_id.rfind('_')]
-            num_genes_on_scaffold[scaffold_id] += 1
-
         # get hits to each scaffold
         hits_to_scaffold = defaultdict(list)
         for query_id, hit in hits_to_ref.iteritems():
@@ -183,12 +185,12 @@ class Reference(object):
                 subject_scaffold_id_str.append(subject_id + ':' + str(num_hits))
             subject_scaffold_id_str = ','.join(subject_scaffold_id_str)
 
-            fout.write('%s\t%s\t%s\t%s\t%.2f\t%d\t%d\t%.2f\t%d\t%.2f\t%.2g\t%.2f\n' % (
+            fout.write('%s\t%s\t%s\t%s\t%s\t%d\t%d\t%.2f\t%d\t%.2f\t%.2g\t%.2f\n' % (
                                                                         scaffold_id,
                                                                         subject_bin_id_str,
                                                                         subject_scaffold_id_str,
                                                                         scaffold_stats.print_stats(scaffold_id),
-                                                                        mean(scaffold_stats.coverage(scaffold_id)),
+                                                                        scaffold_stats.print_mean_coverage(scaffold_id),
                                                                         num_genes_on_scaffold[scaffold_id],
                                                                         len(hits),
                                                                         len(hits) * 100.0 / num_genes_on_scaffold[scaffold_id],
@@ -22,12 +22,18 @@ __license__ = 'GPL3'
 __maintainer__ = 'Donovan Parks'
 __email__ = 'donovan.parks@gmail.com'
 
+import os
 import sys
+import json
+import struct
 import logging
-from collections import namedtuple, defaultdict
+from collections import namedtuple
+
+import numpy as np
 
 from refinem.coverage import Coverage
 from refinem.tetranucleotide import Tetranucleotide
+from refinem.common import read_seq_ids, ScaffoldIdIndex
 from refinem.errors import ParsingError
 
 from biolib.common import remove_extension
@@ -35,12 +41,52 @@ import biolib.seq_io as seq_io
 import biolib.seq_tk as seq_tk
 
 
-"""
-To Do:
- 1. Should split run() method so it produces a dictionary of named tuples
-        with scaffold statistics. A seperate function should be used to
-        write this to file. This would mirror the interface of GenomeStats().
-"""
+class ScaffoldStatsView(object):
+    """Read-only mapping from scaffold ids to statistics of scaffolds.
+
+    Statistics of a scaffold are created on request, with the
+    coverage profile and tetranucleotide signature being views
+    of rows in the matrices of a ScaffoldStats instance.
+    """
+
+    def __init__(self, scaffold_stats):
+        """Initialization.
+
+        Parameters
+        ----------
+        scaffold_stats : ScaffoldStats
+            Statistics for scaffolds.
+        """
+
+        self.scaffold_stats = scaffold_stats
+
+    def __getitem__(self, scaffold_id):
+        return self.scaffold_stats.get(scaffold_id)
+
+    def __contains__(self, scaffold_id):
+        return scaffold_id in self.scaffold_stats.row_index
+
+    def __len__(self):
+        return len(self.scaffold_stats.scaffold_ids)
+
+    def __iter__(self):
+        return iter(self.scaffold_stats.scaffold_ids)
+
+    def get(self, scaffold_id, default=None):
+        if scaffold_id not in self.scaffold_stats.row_index:
+            return default
+
+        return self.scaffold_stats.get(scaffold_id)
+
+    def keys(self):
+        return list(self.scaffold_stats.scaffold_ids)
+
+    def values(self):
+        return [self.scaffold_stats.row_stats(row) for row in xrange(len(self))]
+
+    def iteritems(self):
+        for row, scaffold_id in enumerate(self.scaffold_stats.scaffold_ids):
+            yield scaffold_id, self.scaffold_stats.row_stats(row)
 
 
 class ScaffoldStats(object):
@@ -52,8 +98,37 @@ class ScaffoldStats(object):
      - len
      - coverage
      - tetranucleotide signature
+
+    Scaffolds skipped when calculating coverage profiles or
+    tetranucleotide signatures have these statistics marked as
+    'NA' in the statistics file. They are read with their GC and
+    length, but with NaN coverage profiles and signatures, and
+    are listed in skipped_scaffolds. Use profiled_rows() or
+    has_profiles() to exclude them from calculations requiring
+    coverage profiles or signatures.
+
+    Statistics read from file are stored by column. Each scaffold
+    is assigned a row, given by row_index, in arrays of GC, length,
+    and genome index, and in float32 matrices of coverage profiles
+    and tetranucleotide signatures. The scaffolds in each genome
+    are given as arrays of row indices in scaffolds_in_genome.
+
+    A binary companion of the statistics file (.bin) holds
+    these columns along with indices of scaffold and genome ids.
+    It consists of a magic string, the length of a JSON header
+    describing the dtype, shape, and offset of each column, and
+    the columns themselves. When present and up-to-date, it is
+    memory-mapped by read() instead of parsing the statistics file.
     """
 
+    STATS_COLUMNS = ('gc', 'length', 'coverage', 'signature')
+
+    # shortest format which recovers any float32 value
+    SIGNATURE_FORMAT = '%.9g'
+
+    BINARY_MAGIC = 'REFINEM_STATS\x00\x02\x00'
+    BINARY_ALIGNMENT = 64
+
     def __init__(self, cpus=1):
         """Initialization.
 
@@ -67,6 +142,7 @@ class ScaffoldStats(object):
         self.cpus = cpus
 
         self.unbinned = 'unbinned'
+        self.missing = 'NA'
 
         self.ScaffoldStats = namedtuple('ScaffoldStats', """genome_id
                                                             gc
@@ -74,7 +150,7 @@ class ScaffoldStats(object):
                                                             coverage
                                                             signature""")
 
-    def run(self, scaffold_file, genome_files, tetra_file, coverage_file, output_file):
+    def run(self, scaffold_file, genome_files, tetra_file, coverage_file, output_file, signatures=None):
         """Calculate statistics for scaffolds.
 
         Parameters
@@ -89,65 +165,315 @@ class ScaffoldStats(object):
             Coverage profiles for scaffolds
         output_file : str
             Output file for scaffolds statistics.
+        signatures : d[seq_id] -> tetranucleotide signature
+            Precalculated signatures (None to read signatures from tetra_file).
         """
 
         tetra = Tetranucleotide(self.cpus)
-        signatures = tetra.read(tetra_file)
+        if signatures is None:
+            signatures = tetra.read(tetra_file)
 
-        cov_profiles = None
-        if coverage_file:
-            coverage = Coverage(self.cpus)
-            cov_profiles, _ = coverage.read(coverage_file)
+        cov_profiles, bam_ids = self._read_coverage(coverage_file)
 
         # determine bin assignment for each scaffold
         self.logger.info('Determining scaffold statistics.')
+        scaffold_id_genome_id = self._genome_assignments(genome_files)
+
+        # write out scaffold statistics
+        self._remove_binary(output_file)
+        fout = open(output_file, 'w')
+        self._write_header(fout, bam_ids, tetra.canonical_order())
+
+        for scaffold_id, seq in seq_io.read_seq(scaffold_file):
+            self._write_row(fout,
+                            scaffold_id,
+                            scaffold_id_genome_id.get(scaffold_id, self.unbinned),
+                            seq_tk.gc(seq),
+                            len(seq),
+                            cov_profiles.get(scaffold_id),
+                            bam_ids,
+                            signatures[scaffold_id] if scaffold_id in signatures else None,
+                            len(tetra.canonical_order()))
+
+        fout.close()
+
+        self.read(output_file)
+        self.write_binary(output_file)
+
+    def run_single_pass(self, scaffold_file, genome_files, coverage_file, output_file, tetra, tetra_file, selected_ids=None):
+        """Calculate statistics for scaffolds in a single pass over the scaffolds.
+
+        The GC, length, and tetranucleotide signature of each
+        scaffold are calculated in parallel as the scaffold file
+        is read once. Bin assignments are taken from the headers
+        of the genome files and coverage profiles are joined in
+        memory, with rows written to the output file as scaffolds
+        are processed (in file order if the scaffold file can be
+        indexed).
+
+        Parameters
+        ----------
+        scaffold_file : str
+            Fasta file containing scaffolds.
+        genome_files : list of str
+            Fasta files with binned scaffolds.
+        coverage_file : str
+            Coverage profiles for scaffolds (None if not available).
+        output_file : str
+            Output file for scaffolds statistics.
+        tetra : Tetranucleotide
+            Calculator of tetranucleotide signatures.
+        tetra_file : str
+            Output file for tetranucleotide signatures in binary format (.npy).
+        selected_ids : set
+            Scaffolds to calculate signatures for (None to process all scaffolds).
+
+        Returns
+        -------
+        dict : d[seq_id] -> tetranucleotide signature in canonical order
+            Signatures of selected scaffolds.
+        """
+
+        cov_profiles, bam_ids = self._read_coverage(coverage_file)
+        scaffold_id_genome_id = self._genome_assignments(genome_files)
+
+        self._remove_binary(output_file)
+        fout = open(output_file, 'w')
+        self._write_header(fout, bam_ids, tetra.canonical_order())
+
+        signature_len = len(tetra.canonical_order())
+
+        def write_row(scaffold_id, gc, seq_len, signature):
+            self._write_row(fout,
+                            scaffold_id,
+                            scaffold_id_genome_id.get(scaffold_id, self.unbinned),
+                            gc,
+                            seq_len,
+                            cov_profiles.get(scaffold_id),
+                            bam_ids,
+                            signature,
+                            signature_len)
+
+        signatures = tetra.run(scaffold_file, selected_ids, write_row)
+        fout.close()
+
+        tetra.write_binary(signatures, tetra_file)
+
+        self.read(output_file)
+        self.write_binary(output_file)
+
+        return signatures
+
+    def _read_coverage(self, coverage_file):
+        """Read coverage profiles of scaffolds.
+
+        Parameters
+        ----------
+        coverage_file : str
+            Coverage profiles for scaffolds (None if not available).
+
+        Returns
+        -------
+        d[scaffold_id][bam_id] -> coverage
+            Coverage profile of each scaffold.
+        list
+            Sorted ids of BAM files (None if no coverage profiles are available).
+        """
+
+        if not coverage_file:
+            return {}, None
+
+        coverage = Coverage(self.cpus)
+        cov_profiles, _ = coverage.read(coverage_file)
+        if not cov_profiles:
+            return {}, None
+
+        bam_ids = sorted(cov_profiles[cov_profiles.keys()[0]].keys())
+
+        return cov_profiles, bam_ids
+
+    def _genome_assignments(self, genome_files):
+        """Determine genome assignment of binned scaffolds.
+
+        Parameters
+        ----------
+        genome_files : list of str
+            Fasta files with binned scaffolds.
+
+        Returns
+        -------
+        d[scaffold_id] -> genome_id
+            Genome assignment of each binned scaffold.
+        """
 
         scaffold_id_genome_id = {}
         for gf in genome_files:
             genome_id = remove_extension(gf)
-            for scaffold_id, _seq in seq_io.read_seq(gf):
+            for scaffold_id in read_seq_ids(gf):
                 scaffold_id_genome_id[scaffold_id] = genome_id
 
-        # write out scaffold statistics
-        fout = open(output_file, 'w')
+        return scaffold_id_genome_id
+
+    def _write_header(self, fout, bam_ids, kmers):
+        """Write header line of scaffold statistics file."""
+
         fout.write('Scaffold id\tGenome Id\tGC\tLength (bp)')
 
-        if cov_profiles:
-            bam_ids = sorted(cov_profiles[cov_profiles.keys()[0]].keys())
+        if bam_ids:
             for bam_id in bam_ids:
                 fout.write('\t' + bam_id)
 
-        for kmer in tetra.canonical_order():
+        for kmer in kmers:
             fout.write('\t' + kmer)
         fout.write('\n')
 
-        for scaffold_id, seq in seq_io.read_seq(scaffold_file):
-            fout.write(scaffold_id)
-            fout.write('\t' + scaffold_id_genome_id.get(scaffold_id, self.unbinned))
-            fout.write('\t%.2f' % (seq_tk.gc(seq) * 100.0))
-            fout.write('\t%d' % len(seq))
+    def _write_row(self, fout, scaffold_id, genome_id, gc, seq_len, cov_profile, bam_ids, signature, signature_len):
+        """Write statistics of a scaffold.
 
-            if cov_profiles:
+        Parameters
+        ----------
+        fout : file
+            Scaffold statistics file.
+        scaffold_id : str
+            Unique id of scaffold.
+        genome_id : str
+            Genome assignment of scaffold.
+        gc : float
+            GC content of scaffold [0, 1].
+        seq_len : int
+            Length of scaffold.
+        cov_profile : d[bam_id] -> coverage
+            Coverage profile of scaffold (None if missing).
+        bam_ids : list
+            Ids of BAM files (None if no coverage profiles are available).
+        signature : list
+            Tetranucleotide signature of scaffold (None if missing).
+        signature_len : int
+            Length of tetranucleotide signatures.
+        """
+
+        fout.write(scaffold_id)
+        fout.write('\t' + genome_id)
+        fout.write('\t%.2f' % (gc * 100.0))
+        fout.write('\t%d' % seq_len)
+
+        if bam_ids:
+            if cov_profile is not None:
                 for bam_id in bam_ids:
-                    fout.write('\t%.2f' % cov_profiles[scaffold_id][bam_id])
+                    fout.write('\t%.2f' % cov_profile[bam_id])
+            else:
+                fout.write('\t' + '\t'.join([self.missing] * len(bam_ids)))
+
+        if signature is not None:
+            # signatures are written at the float32 precision at which they are held,
+            # so the output is identical however the signatures were obtained
+            signature = np.asarray(signature, dtype=np.float32).tolist()
+            fout.write('\t' + '\t'.join([self.SIGNATURE_FORMAT % x for x in signature]))
+        else:
+            fout.write('\t' + '\t'.join([self.missing] * signature_len))
+        fout.write('\n')
 
-            fout.write('\t' + '\t'.join(map(str, signatures[scaffold_id])))
-            fout.write('\n')
+    def refresh_coverage(self, stats_file, coverage_file, output_file):
+        """Replace coverage profiles in scaffold statistics file.
+
+        All other statistics, including the tetranucleotide
+        signatures, are copied from the existing file.
+
+        Parameters
+        ----------
+        stats_file : str
+            File with statistics for individual scaffolds.
+        coverage_file : str
+            Coverage profiles for scaffolds.
+        output_file : str
+            Output file for scaffolds statistics.
+        """
+
+        coverage = Coverage(self.cpus)
+        cov_profiles, _ = coverage.read(coverage_file)
+        bam_ids = sorted(cov_profiles[cov_profiles.keys()[0]].keys())
+
+        self.logger.info('Refreshing coverage profiles of scaffold statistics.')
+
+        # write to a temporary file as the output file
+        # may be the statistics file being refreshed
+        tmp_output_file = output_file + '.tmp'
+        fout = open(tmp_output_file, 'w')
+        with open(stats_file) as f:
+            header = f.readline().rstrip('\n').split('\t')
+
+            if 'AAAA' not in header:
+                raise ParsingError("[Error] Statistics file is missing tetranucleotide signature data: %s" % stats_file)
+
+            tetra_index = header.index('AAAA')
+            fout.write('\t'.join(header[0:4] + bam_ids + header[tetra_index:]) + '\n')
+
+            for line in f:
+                line_split = line.rstrip('\n').split('\t')
+                scaffold_id = line_split[0]
+
+                if scaffold_id in cov_profiles:
+                    cov_strs = ['%.2f' % cov_profiles[scaffold_id][bam_id] for bam_id in bam_ids]
+                else:
+                    cov_strs = [self.missing] * len(bam_ids)
+                fout.write('\t'.join(line_split[0:4] + cov_strs + line_split[tetra_index:]) + '\n')
 
         fout.close()
+        self._remove_binary(output_file)
+        os.rename(tmp_output_file, output_file)
+
+        self.read(output_file)
+        self.write_binary(output_file)
 
-    def read(self, stats_file):
+    def read(self, stats_file, signature_file=None, columns=None, genome_ids=None, scaffold_ids=None):
         """Read statistics for scaffolds.
 
+        Statistics are memory-mapped from the binary companion
+        of the statistics file when it is up-to-date. Otherwise,
+        tetranucleotide signatures are taken from a binary
+        signature file when available, which avoids parsing
+        the signature columns of the statistics file.
+
+        Only the requested columns are loaded, with the arrays of
+        other columns set to None. Scaffolds can be restricted to
+        those in a set of genomes and/or with a set of scaffold ids.
+
         Parameters
         ----------
         stats_file : str
             File with statistics for individual scaffolds.
+        signature_file : str
+            Binary tetranucleotide signatures (.npy). By default, tetra.npy
+            beside the statistics file is used if it exists.
+        columns : iterable
+            Columns to load from STATS_COLUMNS (default: all columns).
+        genome_ids : iterable
+            Only load scaffolds assigned to these genomes (default: all genomes).
+        scaffold_ids : iterable
+            Only load these scaffolds (default: all scaffolds).
         """
 
+        columns = self._check_columns(columns)
+        if genome_ids is not None:
+            genome_ids = set(genome_ids)
+        if scaffold_ids is not None:
+            scaffold_ids = set(scaffold_ids)
+
+        if signature_file is None:
+            if self.read_binary(stats_file, columns, genome_ids, scaffold_ids):
+                return
+
+            signature_file = os.path.join(os.path.dirname(stats_file), 'tetra.npy')
+            if not os.path.exists(signature_file):
+                signature_file = None
+
+        signature_store = None
+        if signature_file and 'signature' in columns:
+            signature_store = Tetranucleotide().read_binary(signature_file)
+        validate_store = True
+
         try:
-            sig = {}
-            self.genome_ids = set()
+            self.skipped_scaffolds = set()
             with open(stats_file) as f:
                 header = f.readline().split('\t')
 
@@ -158,35 +484,422 @@ class ScaffoldStats(object):
                 self.signature_headers = [x.strip() for x in header[tetra_index:]]
                 self.coverage_headers = [x.strip() for x in header[4:tetra_index]]
 
-                self.scaffolds_in_genome = defaultdict(set)
-                self.stats = {}
+                # allocate arrays for all selected scaffolds in file
+                if genome_ids is None and scaffold_ids is None:
+                    max_scaffolds = sum(1 for _ in f)
+                else:
+                    max_scaffolds = 0
+                    for line in f:
+                        line_split = line.split('\t', 2)
+                        if self._is_selected(line_split[0], line_split[1], genome_ids, scaffold_ids):
+                            max_scaffolds += 1
+
+            self.scaffold_ids = []
+            self.genome_names = []
+            genome_name_index = {}
+            self.genome_index = np.zeros(max_scaffolds, dtype=np.int32)
+            self.gc_array = None
+            self.length_array = None
+            self.coverage_matrix = None
+            self.signature_matrix = None
+            if 'gc' in columns:
+                self.gc_array = np.zeros(max_scaffolds, dtype=np.float64)
+            if 'length' in columns:
+                self.length_array = np.zeros(max_scaffolds, dtype=np.int64)
+            if 'coverage' in columns:
+                self.coverage_matrix = np.zeros((max_scaffolds, len(self.coverage_headers)), dtype=np.float32)
+            if 'signature' in columns:
+                self.signature_matrix = np.zeros((max_scaffolds, len(self.signature_headers)), dtype=np.float32)
+
+            with open(stats_file) as f:
+                f.readline()
+
+                row = 0
                 for line in f:
-                    line_split = line.split('\t')
+                    # signature columns are left unsplit
+                    line_split = line.split('\t', tetra_index)
                     scaffold_id = line_split[0]
                     genome_id = line_split[1]
-                    gc = float(line_split[2])
-                    scaffold_len = int(line_split[3])
-
-                    coverage = []
-                    for cov in line_split[4:tetra_index]:
-                        coverage.append(float(cov))
-
-                    signature = []
-                    for freq in line_split[tetra_index:]:
-                        signature.append(float(freq))
 
-                    self.stats[scaffold_id] = self.ScaffoldStats(genome_id, gc, scaffold_len, coverage, signature)
-
-                    if genome_id != self.unbinned:
-                        self.scaffolds_in_genome[genome_id].add(scaffold_id)
-
-            return sig
+                    if not self._is_selected(scaffold_id, genome_id, genome_ids, scaffold_ids):
+                        continue
+
+                    skipped = (self.missing in [x.strip() for x in line_split[4:tetra_index]]
+                                or line_split[tetra_index].startswith(self.missing))
+                    if skipped:
+                        self.skipped_scaffolds.add(scaffold_id)
+
+                    if genome_id not in genome_name_index:
+                        genome_name_index[genome_id] = len(self.genome_names)
+                        self.genome_names.append(genome_id)
+
+                    self.scaffold_ids.append(scaffold_id)
+                    self.genome_index[row] = genome_name_index[genome_id]
+                    if self.gc_array is not None:
+                        self.gc_array[row] = float(line_split[2])
+                    if self.length_array is not None:
+                        self.length_array[row] = int(line_split[3])
+                    if self.coverage_matrix is not None:
+                        if skipped:
+                            self.coverage_matrix[row] = np.nan
+                        else:
+                            self.coverage_matrix[row] = line_split[4:tetra_index]
+
+                    if self.signature_matrix is None:
+                        pass
+                    elif skipped:
+                        self.signature_matrix[row] = np.nan
+                    elif signature_store is not None and scaffold_id in signature_store:
+                        self.signature_matrix[row] = signature_store[scaffold_id]
+
+                        if validate_store:
+                            # guard against a binary signature file from a different run
+                            text_signature = np.array(line_split[tetra_index].split('\t'), dtype=np.float64)
+                            if np.allclose(self.signature_matrix[row], text_signature, atol=1e-6):
+                                self.logger.info('Using binary tetranucleotide signatures: %s' % signature_file)
+                            else:
+                                self.logger.warning('Ignoring binary tetranucleotide signatures which differ from statistics file: %s' % signature_file)
+                                signature_store = None
+                                self.signature_matrix[row] = text_signature
+                            validate_store = False
+                    else:
+                        self.signature_matrix[row] = line_split[tetra_index].split('\t')
+
+                    row += 1
+
+            self.scaffold_ids = np.array(self.scaffold_ids, dtype=self._id_dtype(self.scaffold_ids))
+            self.genome_index = self.genome_index[0:row]
+            if self.gc_array is not None:
+                self.gc_array = self.gc_array[0:row]
+            if self.length_array is not None:
+                self.length_array = self.length_array[0:row]
+            if self.coverage_matrix is not None:
+                self.coverage_matrix = self.coverage_matrix[0:row]
+            if self.signature_matrix is not None:
+                self.signature_matrix = self.signature_matrix[0:row]
+
+            self._index_rows()
         except IOError:
             print '[Error] Failed to open scaffold statistics file: %s' % stats_file
             sys.exit()
         except ParsingError:
             sys.exit()
 
+    def _check_columns(self, columns):
+        """Validate columns requested from statistics file."""
+
+        if columns is None:
+            return set(self.STATS_COLUMNS)
+
+        columns = set(columns)
+        unknown_columns = columns - set(self.STATS_COLUMNS)
+        if unknown_columns:
+            self.logger.error('Unknown scaffold statistics columns: %s' % ', '.join(sorted(unknown_columns)))
+            sys.exit()
+
+        return columns
+
+    def _is_selected(self, scaffold_id, genome_id, genome_ids, scaffold_ids):
+        """Check if scaffold is in the requested genomes and scaffolds."""
+
+        if genome_ids is not None and genome_id not in genome_ids:
+            return False
+
+        if scaffold_ids is not None and scaffold_id not in scaffold_ids:
+            return False
+
+        return True
+
+    def _index_rows(self):
+        """Index rows of scaffolds by scaffold id and genome."""
+
+        sorted_rows = np.argsort(self.scaffold_ids, kind='mergesort')
+        self.row_index = ScaffoldIdIndex(self.scaffold_ids[sorted_rows], sorted_rows)
+
+        self.rows_by_genome = np.argsort(self.genome_index, kind='mergesort')
+        genome_counts = np.bincount(self.genome_index, minlength=len(self.genome_names))
+        self.genome_offsets = np.concatenate(([0], np.cumsum(genome_counts)))
+        self._set_genome_rows()
+
+        self.stats = ScaffoldStatsView(self)
+
+    def _set_genome_rows(self):
+        """Set rows of scaffolds in each genome from genome index."""
+
+        self.scaffolds_in_genome = {}
+        for index, genome_id in enumerate(self.genome_names):
+            start = self.genome_offsets[index]
+            end = self.genome_offsets[index + 1]
+            if genome_id != self.unbinned and end > start:
+                self.scaffolds_in_genome[genome_id] = self.rows_by_genome[start:end]
+
+    def _id_dtype(self, ids):
+        """Fixed-width string dtype able to hold all ids."""
+
+        return 'S%d' % max([len(x) for x in ids] + [1])
+
+    def _binary_file(self, stats_file):
+        """Binary companion of scaffold statistics file."""
+
+        return os.path.splitext(stats_file)[0] + '.bin'
+
+    def _remove_binary(self, stats_file):
+        """Remove binary companion of scaffold statistics file."""
+
+        binary_file = self._binary_file(stats_file)
+        if os.path.exists(binary_file):
+            os.remove(binary_file)
+
+    def write_binary(self, stats_file):
+        """Write statistics in binary format beside statistics file.
+
+        Parameters
+        ----------
+        stats_file : str
+            File with statistics for individual scaffolds.
+        """
+
+        sorted_ids = self.row_index.sorted_ids
+        skipped_ids = sorted(self.skipped_scaffolds)
+        columns = [('scaffold_ids', self.scaffold_ids),
+                   ('sorted_ids', sorted_ids),
+                   ('sorted_rows', self.row_index.sorted_rows.astype(np.int64)),
+                   ('rows_by_genome', self.rows_by_genome.astype(np.int64)),
+                   ('genome_offsets', self.genome_offsets.astype(np.int64)),
+                   ('gc', self.gc_array),
+                   ('length', self.length_array),
+                   ('genome_index', self.genome_index),
+                   ('coverage', self.coverage_matrix),
+                   ('signature', self.signature_matrix),
+                   ('skipped_ids', np.array(skipped_ids, dtype=self._id_dtype(skipped_ids)))]
+
+        header = {'stats_file_size': os.path.getsize(stats_file),
+                    'genome_names': self.genome_names,
+                    'coverage_headers': self.coverage_headers,
+                    'signature_headers': self.signature_headers,
+                    'columns': []}
+
+        offset = 0
+        for name, data in columns:
+            data = np.ascontiguousarray(data)
+            header['columns'].append([name, data.dtype.str, list(data.shape), offset])
+            offset += data.nbytes
+            offset += -offset % self.BINARY_ALIGNMENT
+
+        # columns follow the header and are aligned
+        # relative to the start of the file
+        header_str = json.dumps(header)
+        data_start = len(self.BINARY_MAGIC) + 8 + len(header_str)
+        data_start += -data_start % self.BINARY_ALIGNMENT
+        header_str = header_str.ljust(data_start - len(self.BINARY_MAGIC) - 8)
+
+        binary_file = self._binary_file(stats_file)
+        tmp_binary_file = binary_file + '.tmp'
+        fout = open(tmp_binary_file, 'wb')
+        fout.write(self.BINARY_MAGIC)
+        fout.write(struct.pack('<Q', len(header_str)))
+        fout.write(header_str)
+        for (name, data), (_name, _dtype, _shape, offset) in zip(columns, header['columns']):
+            fout.seek(data_start + offset)
+            np.ascontiguousarray(data).tofile(fout)
+        fout.close()
+        os.rename(tmp_binary_file, binary_file)
+
+    def read_binary(self, stats_file, columns=None, genome_ids=None, scaffold_ids=None):
+        """Memory-map statistics from binary companion of statistics file.
+
+        Without a selection of genomes or scaffolds, the requested
+        columns are memory-mapped. Otherwise, only the rows of the
+        selected scaffolds are copied from the mapped columns.
+
+        Parameters
+        ----------
+        stats_file : str
+            File with statistics for individual scaffolds.
+        columns : iterable
+            Columns to load from STATS_COLUMNS (default: all columns).
+        genome_ids : iterable
+            Only load scaffolds assigned to these genomes (default: all genomes).
+        scaffold_ids : iterable
+            Only load these scaffolds (default: all scaffolds).
+
+        Returns
+        -------
+        bool
+            True if statistics were read, False if there is no up-to-date binary file.
+        """
+
+        binary_file = self._binary_file(stats_file)
+        if (not os.path.exists(binary_file)
+                or not os.path.exists(stats_file)
+                or os.path.getmtime(binary_file) < os.path.getmtime(stats_file)):
+            return False
+
+        try:
+            with open(binary_file, 'rb') as f:
+                if f.read(len(self.BINARY_MAGIC)) != self.BINARY_MAGIC:
+                    return False
+
+                header_len = struct.unpack('<Q', f.read(8))[0]
+                header = json.loads(f.read(header_len))
+                data_start = f.tell()
+        except (IOError, ValueError, struct.error):
+            return False
+
+        if header['stats_file_size'] != os.path.getsize(stats_file):
+            return False
+
+        columns = self._check_columns(columns)
+
+        mapped_columns = {}
+        for name, dtype, shape, offset in header['columns']:
+            shape = tuple(shape)
+            if np.prod(shape) == 0:
+                mapped_columns[name] = np.zeros(shape, dtype=dtype)
+            else:
+                mapped_columns[name] = np.memmap(binary_file,
+                                                    dtype=dtype,
+                                                    mode='r',
+                                                    offset=data_start + offset,
+                                                    shape=shape)
+
+        self.genome_names = [genome_id.encode('utf-8') for genome_id in header['genome_names']]
+        self.coverage_headers = [h.encode('utf-8') for h in header['coverage_headers']]
+        self.signature_headers = [h.encode('utf-8') for h in header['signature_headers']]
+
+        self.skipped_scaffolds = set(mapped_columns['skipped_ids'])
+        if scaffold_ids is not None:
+            self.skipped_scaffolds &= set(scaffold_ids)
+
+        data_columns = [('gc_array', 'gc'),
+                        ('length_array', 'length'),
+                        ('coverage_matrix', 'coverage'),
+                        ('signature_matrix', 'signature')]
+
+        if genome_ids is None and scaffold_ids is None:
+            self.scaffold_ids = mapped_columns['scaffold_ids']
+            self.genome_index = mapped_columns['genome_index']
+            for attr, name in data_columns:
+                setattr(self, attr, mapped_columns[name] if name in columns else None)
+
+            self.row_index = ScaffoldIdIndex(mapped_columns['sorted_ids'], mapped_columns['sorted_rows'])
+            self.rows_by_genome = mapped_columns['rows_by_genome']
+            self.genome_offsets = mapped_columns['genome_offsets']
+            self._set_genome_rows()
+
+            self.stats = ScaffoldStatsView(self)
+        else:
+            rows = self._selected_rows(mapped_columns, genome_ids, scaffold_ids)
+
+            self.scaffold_ids = np.array(mapped_columns['scaffold_ids'][rows])
+            self.genome_index = np.array(mapped_columns['genome_index'][rows])
+            for attr, name in data_columns:
+                setattr(self, attr, np.array(mapped_columns[name][rows]) if name in columns else None)
+
+            self._index_rows()
+
+        self.logger.info('Using binary scaffold statistics: %s' % binary_file)
+
+        return True
+
+    def _selected_rows(self, mapped_columns, genome_ids, scaffold_ids):
+        """Rows of binary statistics file in the requested genomes and scaffolds.
+
+        Parameters
+        ----------
+        mapped_columns : d[column name] -> numpy.ndarray
+            Memory-mapped columns of binary statistics file.
+        genome_ids : set
+            Genomes of interest, or None for all genomes.
+        scaffold_ids : set
+            Scaffolds of interest, or None for all scaffolds.
+
+        Returns
+        -------
+        numpy.ndarray
+            Selected rows in file order.
+        """
+
+        rows = None
+        if genome_ids is not None:
+            genome_offsets = mapped_columns['genome_offsets']
+            genome_rows = [np.zeros(0, dtype=np.int64)]
+            for index, genome_id in enumerate(self.genome_names):
+                if genome_id in genome_ids:
+                    genome_rows.append(mapped_columns['rows_by_genome'][genome_offsets[index]:genome_offsets[index + 1]])
+            rows = np.concatenate(genome_rows)
+
+        if scaffold_ids is not None:
+            row_index = ScaffoldIdIndex(mapped_columns['sorted_ids'], mapped_columns['sorted_rows'])
+            scaffold_rows = [row_index.get(scaffold_id) for scaffold_id in scaffold_ids]
+            scaffold_rows = np.array([row for row in scaffold_rows if row is not None], dtype=np.int64)
+            if rows is None:
+                rows = scaffold_rows
+            else:
+                rows = np.intersect1d(rows, scaffold_rows)
+
+        return np.sort(rows)
+
+    def profiled_rows(self, rows):
+        """Rows of scaffolds with coverage profiles and tetranucleotide signatures.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Rows of scaffolds.
+
+        Returns
+        -------
+        numpy.ndarray
+            Rows of scaffolds without NaN coverage profiles or signatures.
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        for profiles in [self.coverage_matrix, self.signature_matrix]:
+            if profiles is not None and profiles.shape[1] > 0:
+                rows = rows[~np.isnan(profiles[rows]).any(axis=1)]
+
+        return rows
+
+    def has_profiles(self, scaffold_id):
+        """Check if scaffold has a coverage profile and tetranucleotide signature.
+
+        Parameters
+        ----------
+        scaffold_id : str
+            Scaffold of interest.
+
+        Returns
+        -------
+        bool
+            False if scaffold was skipped when calculating coverage profiles or signatures.
+        """
+
+        return len(self.profiled_rows([self.row_index[scaffold_id]])) == 1
+
+    def row_stats(self, row):
+        """Statistics of scaffold in a given row.
+
+        Parameters
+        ----------
+        row : int
+            Row of scaffold.
+
+        Returns
+        -------
+        namedtuple -> genome_id, gc, scaffold_len, coverage, signature
+            Statistics for scaffold, with None for columns which were not loaded.
+        """
+
+        def value(column):
+            return column[row] if column is not None else None
+
+        return self.ScaffoldStats(self.genome_names[self.genome_index[row]],
+                                    value(self.gc_array),
+                                    value(self.length_array),
+                                    value(self.coverage_matrix),
+                                    value(self.signature_matrix))
+
     def num_scaffolds(self):
         """Number of scaffolds.
 
@@ -196,7 +909,7 @@ class ScaffoldStats(object):
             Number of scaffolds.
         """
 
-        return len(self.stats)
+        return len(self.scaffold_ids)
 
     def num_genomes(self):
         """Number of genomes.
@@ -245,7 +958,7 @@ class ScaffoldStats(object):
             Statistics for scaffold.
         """
 
-        return self.stats[scaffold_id]
+        return self.row_stats(self.row_index[scaffold_id])
 
     def genome_id(self, scaffold_id):
         """Genome assignment of scaffold.
@@ -261,7 +974,7 @@ class ScaffoldStats(object):
             Genome assignment of scaffold.
         """
 
-        return self.stats[scaffold_id].genome_id
+        return self.genome_names[self.genome_index[self.row_index[scaffold_id]]]
 
     def gc(self, scaffold_id):
         """GC of scaffold.
@@ -277,7 +990,7 @@ class ScaffoldStats(object):
             GC of scaffold.
         """
 
-        return self.stats[scaffold_id].gc
+        return self.gc_array[self.row_index[scaffold_id]]
 
     def scaffold_length(self, scaffold_id):
         """Length of scaffold.
@@ -293,7 +1006,7 @@ class ScaffoldStats(object):
             Length of scaffold.
         """
 
-        return self.stats[scaffold_id].length
+        return self.length_array[self.row_index[scaffold_id]]
 
     def coverage(self, scaffold_id):
         """Coverage profile of scaffold.
@@ -305,11 +1018,11 @@ class ScaffoldStats(object):
 
         Returns
         -------
-        list
+        numpy.ndarray
             Coverage profile of scaffold.
         """
 
-        return self.stats[scaffold_id].coverage
+        return self.coverage_matrix[self.row_index[scaffold_id]]
 
     def signature(self, scaffold_id):
         """Tetranucleotide signature of scaffold.
@@ -321,11 +1034,11 @@ class ScaffoldStats(object):
 
         Returns
         -------
-        list
+        numpy.ndarray
            Tetranucleotide signature of scaffold.
         """
 
-        return self.stats[scaffold_id].signature
+        return self.signature_matrix[self.row_index[scaffold_id]]
 
     def print_coverage_header(self):
         """Print header line for coverage profile."""
@@ -351,7 +1064,7 @@ class ScaffoldStats(object):
             String indicating genome id, scaffold length, and scaffold GC
         """
 
-        stats = self.stats[scaffold_id]
+        stats = self.get(scaffold_id)
         return '%s\t%d\t%.2f' % (stats.genome_id, stats.length, stats.gc)
 
     def print_coverage(self, scaffold_id):
@@ -369,11 +1082,31 @@ class ScaffoldStats(object):
         """
 
         cov_strs = []
-        for cov in self.stats[scaffold_id].coverage:
+        for cov in self.coverage(scaffold_id):
             cov_strs.append('%.2f' % cov)
 
         return '\t'.join(cov_strs)
 
+    def print_mean_coverage(self, scaffold_id):
+        """Produce string indicating mean coverage of scaffold.
+
+        Parameters
+        ----------
+        scaffold_id : str
+            Scaffold of interest.
+
+        Returns
+        -------
+        str
+            Mean coverage of scaffold, or 'NA' if scaffold has no coverage profile.
+        """
+
+        coverage = self.coverage(scaffold_id)
+        if np.isnan(coverage).any():
+            return self.missing
+
+        return '%.2f' % np.mean(coverage)
+
     def print_signature(self, scaffold_id):
         """Produce string indicating tetranucleotide signature of scaffold.
 
@@ -389,7 +1122,7 @@ class ScaffoldStats(object):
         """
 
         tetra_strs = []
-        for tetra in self.stats[scaffold_id].signature:
+        for tetra in self.signature(scaffold_id):
             tetra_strs.append('%.2f' % tetra)
 
         return '\t'.join(tetra_strs)
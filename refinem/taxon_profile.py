@@ -387,7 +387,7 @@ class TaxonProfile(object):
         Returns
         -------
         d[scaffold_id] -> (length, GC, mean coverage, # genes, coding bases)
-            Common statistics for each scaffold.
+            Common statistics for each scaffold, with NaN mean coverage for scaffolds without coverage.
         """
         
         stats = {}
@@ -400,7 +400,7 @@ class TaxonProfile(object):
                 scaffold_id = line_split[0]
                 length = int(line_split[2])
                 gc = float(line_split[3])
-                mean_cov = float(line_split[4])
+                mean_cov = float(line_split[4]) if line_split[4] != 'NA' else float('nan')
                 genes = int(line_split[5])
                 coding_bases = int(line_split[6])
                 
@@ -441,11 +441,6 @@ class TaxonProfile(object):
             Directory to use for temporary files.
         """
 
-        # read statistics file
-        self.logger.info('Reading scaffold statistics.')
-        scaffold_stats = ScaffoldStats()
-        scaffold_stats.read(stat_file)
-
         # concatenate gene files
         self.logger.info('Appending genome identifiers to all gene identifiers.')
         diamond_output_dir = os.path.join(self.output_dir, 'diamond')
@@ -480,6 +475,17 @@ class TaxonProfile(object):
                 self.profiles[genome_id].genes_in_scaffold[scaffold_id] += 1
                 self.profiles[genome_id].coding_bases[scaffold_id] += len(seq) * 3  # length in nucleotide space
 
+        # read statistics of scaffolds with called genes
+        self.logger.info('Reading scaffold statistics.')
+        scaffold_ids = set()
+        for profile in self.profiles.values():
+            scaffold_ids.update(profile.genes_in_scaffold)
+
+        scaffold_stats = ScaffoldStats()
+        scaffold_stats.read(stat_file,
+                            columns=['gc', 'length', 'coverage'],
+                            scaffold_ids=scaffold_ids)
+
         # run diamond and create taxonomic profile for each genome
         self.logger.info('Running diamond blastp with %d processes (be patient!)' % self.cpus)
 
@@ -1114,9 +1120,9 @@ class Profile(object):
         fout.write('\n')
 
         for seq_id in seq_assignments:
-            fout.write('%s\t%s\t%.2f\t%d\t%d' % (seq_id,
+            fout.write('%s\t%s\t%s\t%d\t%d' % (seq_id,
                                        scaffold_stats.print_stats(seq_id),
-                                       mean(scaffold_stats.coverage(seq_id)),
+                                       scaffold_stats.print_mean_coverage(seq_id),
                                        self.genes_in_scaffold[seq_id],
                                        self.coding_bases[seq_id]))
 
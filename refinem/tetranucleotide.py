@@ -22,38 +22,142 @@ __license__ = 'GPL3'
 __maintainer__ = 'Donovan Parks'
 __email__ = 'donovan.parks@gmail.com'
 
+import os
 import sys
+import time
+import struct
+import hashlib
 import logging
+import traceback
+import Queue
+import multiprocessing as mp
 
 from biolib.genomic_signature import GenomicSignature
-from biolib.parallel import Parallel
+from biolib.common import make_sure_path_exists
+import biolib.seq_io as seq_io
 
 import numpy as np
 
 from refinem.errors import ParsingError
+from refinem.common import ScaffoldIdIndex
+from refinem.kmer_signature import KmerSignature
+from refinem.parallel_fasta import ParallelFasta
+
+# bytes reserved for the header of binary signature files written in blocks,
+# which is rewritten once the number of signatures is known
+NPY_HEADER_SIZE = 128
+
+# prefix of files in signature cache directory
+SIGNATURE_CACHE = 'tetra_cache'
+
+
+class SignatureStore(object):
+    """Tetranucleotide signatures held in a memory-mapped binary file.
+
+    Signatures are rows of a float32 matrix in canonical order. The
+    scaffold ids are held in separate memory-mapped files of sorted
+    fixed-width ids and the row of each sorted id, so scaffolds are
+    located with a binary search instead of building a dictionary.
+    The store can be used in place of a dictionary of signatures,
+    with scaffold ids iterated in sorted order.
+    """
+
+    def __init__(self, row_index, matrix):
+        """Initialization.
+
+        Parameters
+        ----------
+        row_index : ScaffoldIdIndex
+            Row of each sequence in the matrix.
+        matrix : numpy.ndarray
+            Tetranucleotide signature of each sequence.
+        """
+
+        self.row_index = row_index
+        self.matrix = matrix
+
+    def __contains__(self, seq_id):
+        return seq_id in self.row_index
+
+    def __getitem__(self, seq_id):
+        return self.matrix[self.row_index[seq_id]]
+
+    def __len__(self):
+        return len(self.row_index)
+
+    def __iter__(self):
+        return iter(self.row_index.sorted_ids)
+
+    def keys(self):
+        return self.row_index.sorted_ids.tolist()
+
+    def iteritems(self):
+        for seq_id, row in zip(self.row_index.sorted_ids, self.row_index.sorted_rows):
+            yield seq_id, self.matrix[row]
 
 
 class Tetranucleotide(object):
-    """Calculate tetranucleotide signature of sequences."""
+    """Calculate tetranucleotide signature of sequences.
+
+    Signatures are calculated with the vectorized k-mer engine
+    ('numpy') shared with other k-mer lengths. The original per-kmer
+    implementation from biolib ('biolib') gives identical signatures.
+    """
 
-    def __init__(self, cpus=1):
+    def __init__(self, cpus=1, engine='numpy', cache_dir=None):
         """Initialization.
 
         Parameters
         ----------
         cpus : int
             Number of cpus to use.
+        engine : str
+            Engine for calculating signatures ('numpy' or 'biolib').
+        cache_dir : str
+            Directory for caching signatures of sequences between runs (None to disable caching).
         """
         self.logger = logging.getLogger('timestamp')
 
         self.cpus = cpus
+        self.engine = engine
+
+        self.k = 4
+        self.signatures = GenomicSignature(self.k)
+
+        self.selected_ids = None
+        self.seq_consumer = None
 
-        self.signatures = GenomicSignature(4)
+        self.kmer_signature = KmerSignature(self.k)
+
+        self.cache_dir = cache_dir
+        self.cache_index = {}
+        self.cache_matrix = None
+        self.new_cache_entries = []
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def canonical_order(self):
         """Canonical order of tetranucleotides."""
         return self.signatures.canonical_order()
 
+    def seq_signature(self, seq):
+        """Count canonical tetranucleotides in a sequence.
+
+        Tetranucleotides containing an ambiguous base are ignored.
+
+        Parameters
+        ----------
+        seq : str
+            Sequence in nucleotide space.
+
+        Returns
+        -------
+        numpy.ndarray
+            Count of each tetranucleotide in the canonical order.
+        """
+
+        return self.kmer_signature.counts(seq)
+
     def _producer(self, seq_info):
         """Calculate tetranucleotide signature of a sequence.
 
@@ -70,17 +174,42 @@ class Tetranucleotide(object):
             Unique id of sequence.
         list
             Count of each kmer in the canonical order.
+        tuple
+            Hash, GC, and length of sequence to add to signature cache (None if already cached).
+        tuple
+            GC and length of sequence (None if no sequence consumer is set).
         """
 
         seq_id, seq = seq_info
 
-        sig = self.signatures.seq_signature(seq)
+        seq_stats = None
+        if self.seq_consumer:
+            seq_stats = (self.kmer_signature.gc(seq), len(seq))
+
+        if self.selected_ids is not None and seq_id not in self.selected_ids:
+            return (seq_id, None, None, seq_stats)
+
+        cache_entry = None
+        if self.cache_dir:
+            seq_hash = hashlib.md5(seq.upper()).hexdigest()
+            row = self.cache_index.get(seq_hash)
+            if row is not None and self.cache_matrix[row, -1] == len(seq):
+                return (seq_id, self.cache_matrix[row, 0:-2].tolist(), None, seq_stats)
+
+            gc = seq_stats[0] if seq_stats is not None else self.kmer_signature.gc(seq)
+            cache_entry = (seq_hash, gc, len(seq))
 
-        total_kmers = sum(sig)
-        for i in xrange(0, len(sig)):
-            sig[i] = float(sig[i]) / max(total_kmers, 1)
+        if self.engine == 'biolib':
+            sig = self.signatures.seq_signature(seq)
 
-        return (seq_id, sig)
+            total_kmers = sum(sig)
+            for i in xrange(0, len(sig)):
+                sig[i] = float(sig[i]) / max(total_kmers, 1)
+        else:
+            counts = self.seq_signature(seq)
+            sig = (counts / float(max(counts.sum(), 1))).tolist()
+
+        return (seq_id, sig, cache_entry, seq_stats)
 
     def _consumer(self, produced_data, consumer_data):
         """Consume results from producer processes.
@@ -102,8 +231,14 @@ class Tetranucleotide(object):
         if consumer_data == None:
             consumer_data = {}
 
-        seq_id, sig = produced_data
-        consumer_data[seq_id] = sig
+        seq_id, sig, cache_entry, seq_stats = produced_data
+        if sig is not None:
+            consumer_data[seq_id] = sig
+            self._update_cache_stats(sig, cache_entry)
+
+        if self.seq_consumer:
+            gc, seq_len = seq_stats
+            self.seq_consumer(seq_id, gc, seq_len, sig)
 
         return consumer_data
 
@@ -128,13 +263,22 @@ class Tetranucleotide(object):
         else:
             return '  Finished processing %d of %d (%.2f%%) sequences.' % (processed_items, total_items, float(processed_items) * 100 / total_items)
 
-    def run(self, seq_file):
+    def run(self, seq_file, selected_ids=None, seq_consumer=None):
         """Calculate tetranucleotide signatures of sequences.
 
+        A sequence consumer can be given to process the GC, length,
+        and signature of each sequence in the same pass over the
+        sequence file. It is called in file order for all sequences,
+        with a signature of None for sequences that are not selected.
+
         Parameters
         ----------
         seq_file : str
             Name of fasta/q file to read.
+        selected_ids : set
+            Identifiers of sequences to process (None to process all sequences).
+        seq_consumer : function
+            Function called with the id, GC, length, and signature of each sequence.
 
         Returns
         -------
@@ -144,14 +288,365 @@ class Tetranucleotide(object):
 
         self.logger.info('Calculating tetranucleotide signature for each sequence:')
 
-        parallel = Parallel(self.cpus)
-        seq_signatures = parallel.run_seqs_file(self._producer, self._consumer, seq_file, self._progress)
+        self.selected_ids = selected_ids
+        self.seq_consumer = seq_consumer
+        self._read_cache()
+
+        parallel = ParallelFasta(self.cpus)
+        seq_signatures = parallel.run_seqs_file(self._producer,
+                                                self._consumer,
+                                                seq_file,
+                                                self._progress,
+                                                ordered=seq_consumer is not None)
+        if seq_signatures is None:
+            seq_signatures = {}
+
+        self.seq_consumer = None
+        self._write_cache()
 
         return seq_signatures
 
+    def _cache_files(self):
+        """Names of signature cache files."""
+        return (os.path.join(self.cache_dir, SIGNATURE_CACHE + '.npy'),
+                os.path.join(self.cache_dir, SIGNATURE_CACHE + '.keys.npy'))
+
+    def _read_cache(self):
+        """Read signature cache.
+
+        The cache is a memory-mapped matrix with the signature, GC,
+        and length of each cached sequence in a row, along with the
+        MD5 hash of each uppercase sequence identifying its row.
+        """
+
+        self.cache_index = {}
+        self.cache_matrix = None
+        self.new_cache_entries = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if not self.cache_dir:
+            return
+
+        make_sure_path_exists(self.cache_dir)
+        cache_file, keys_file = self._cache_files()
+        if not os.path.exists(cache_file) or not os.path.exists(keys_file):
+            return
+
+        try:
+            cache_matrix = np.load(cache_file, mmap_mode='r')
+            keys = np.load(keys_file)
+        except:
+            self.logger.warning('Ignoring unreadable signature cache: %s' % cache_file)
+            return
+
+        if cache_matrix.shape != (len(keys), len(self.canonical_order()) + 2):
+            self.logger.warning('Ignoring inconsistent signature cache: %s' % cache_file)
+            return
+
+        self.cache_matrix = cache_matrix
+        self.cache_index = dict([(key, row) for row, key in enumerate(keys.tolist())])
+
+    def _update_cache_stats(self, sig, cache_entry):
+        """Record use of signature cache for a processed sequence.
+
+        Parameters
+        ----------
+        sig : list
+            Tetranucleotide signature of sequence.
+        cache_entry : tuple
+            Hash, GC, and length of sequence to add to cache (None if already cached).
+        """
+
+        if not self.cache_dir:
+            return
+
+        if cache_entry is None:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            seq_hash, gc, seq_len = cache_entry
+            if seq_hash not in self.cache_index:
+                self.cache_index[seq_hash] = None
+                self.new_cache_entries.append((seq_hash, sig + [gc, seq_len]))
+
+    def _write_cache(self):
+        """Add signatures of new sequences to signature cache."""
+
+        if not self.cache_dir:
+            return
+
+        num_seqs = self.cache_hits + self.cache_misses
+        self.logger.info('Signature cache: %d of %d sequences (%.1f%%) served from cache, %d new sequences cached.' % (self.cache_hits,
+                                                                                                                      num_seqs,
+                                                                                                                      self.cache_hits * 100.0 / max(num_seqs, 1),
+                                                                                                                      len(self.new_cache_entries)))
+        if not self.new_cache_entries:
+            return
+
+        num_cached = 0
+        if self.cache_matrix is not None:
+            num_cached = len(self.cache_matrix)
+
+        # write to temporary files first so an interrupted
+        # run never leaves a partial cache behind
+        cache_file, keys_file = self._cache_files()
+        tmp_cache_file = cache_file + '.tmp.npy'
+        tmp_keys_file = keys_file + '.tmp.npy'
+
+        cache_matrix = np.lib.format.open_memmap(tmp_cache_file,
+                                                    mode='w+',
+                                                    dtype=np.float64,
+                                                    shape=(num_cached + len(self.new_cache_entries), len(self.canonical_order()) + 2))
+        keys = [None] * num_cached
+        if num_cached:
+            cache_matrix[0:num_cached] = self.cache_matrix
+            for key, row in self.cache_index.iteritems():
+                if row is not None:
+                    keys[row] = key
+
+        for i, (key, row) in enumerate(self.new_cache_entries):
+            cache_matrix[num_cached + i] = row
+            keys.append(key)
+        cache_matrix.flush()
+        del cache_matrix
+
+        np.save(tmp_keys_file, np.array(keys, dtype='S32'))
+
+        os.rename(tmp_cache_file, cache_file)
+        os.rename(tmp_keys_file, keys_file)
+
+    def _npy_header(self, num_seqs):
+        """Header of binary signature file padded to a fixed size.
+
+        Parameters
+        ----------
+        num_seqs : int
+            Number of signatures in file.
+
+        Returns
+        -------
+        str
+            Header of .npy file (version 1.0).
+        """
+
+        header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (num_seqs, len(self.canonical_order()))
+        header_len = NPY_HEADER_SIZE - len(np.lib.format.magic(1, 0)) - 2
+        header = header.ljust(header_len - 1) + '\n'
+
+        return np.lib.format.magic(1, 0) + struct.pack('<H', header_len) + header
+
+    def _block_reader(self, seq_file, block_size, queue_in):
+        """Read sequences in blocks.
+
+        Parameters
+        ----------
+        seq_file : str
+            Name of fasta/q file to read.
+        block_size : int
+            Number of sequences in each block.
+        queue_in : queue
+            Queue of blocks to process.
+        """
+
+        block_index = 0
+        block = []
+        for seq_id, seq in seq_io.read_seq(seq_file):
+            if self.selected_ids is not None and seq_id not in self.selected_ids:
+                continue
+
+            block.append((seq_id, seq))
+            if len(block) == block_size:
+                queue_in.put((block_index, block))
+                block_index += 1
+                block = []
+
+        if block:
+            queue_in.put((block_index, block))
+
+        for _ in range(self.cpus):
+            queue_in.put((None, None))
+
+    def _block_worker(self, queue_in, queue_out):
+        """Calculate tetranucleotide signatures of sequence blocks.
+
+        Parameters
+        ----------
+        queue_in : queue
+            Queue of blocks to process.
+        queue_out : queue
+            Queue of signatures for each block.
+        """
+
+        while True:
+            block_index, block = queue_in.get(block=True, timeout=None)
+            if block_index == None:
+                break
+
+            queue_out.put((block_index, [self._producer(seq_info) for seq_info in block]))
+
+        queue_out.put((None, None))
+
+    def run_streaming(self, seq_file, output_file, selected_ids=None, block_size=1000, tsv_file=None):
+        """Calculate tetranucleotide signatures with bounded memory.
+
+        Sequences are read in blocks which are processed by worker
+        processes. Signatures of each block are appended to the binary
+        signature file, and optionally a TSV file, in input order so
+        signatures are never all held in memory.
+
+        Parameters
+        ----------
+        seq_file : str
+            Name of fasta/q file to read.
+        output_file : str
+            Name of binary signature file (.npy).
+        selected_ids : set
+            Identifiers of sequences to process (None to process all sequences).
+        block_size : int
+            Number of sequences in each block.
+        tsv_file : str
+            Name of TSV file to also write signatures to (None to skip).
+        """
+
+        self.logger.info('Calculating tetranucleotide signature for each sequence in blocks of %d sequences:' % block_size)
+
+        self.selected_ids = selected_ids
+        self._read_cache()
+
+        # limit number of blocks read ahead of workers
+        queue_in = mp.Queue(2 * self.cpus)
+        queue_out = mp.Queue()
+
+        fout_npy = open(output_file, 'wb')
+        fout_npy.write(self._npy_header(0))
+        seq_ids = []
+
+        fout_tsv = None
+        if tsv_file:
+            fout_tsv = open(tsv_file, 'w')
+            fout_tsv.write('Scaffold id')
+            for kmer in self.canonical_order():
+                fout_tsv.write('\t' + kmer)
+            fout_tsv.write('\n')
+
+        num_seqs = 0
+        try:
+            read_proc = mp.Process(target=self._block_reader, args=(seq_file, block_size, queue_in))
+            worker_proc = [mp.Process(target=self._block_worker, args=(queue_in, queue_out)) for _ in range(self.cpus)]
+
+            read_proc.start()
+            for p in worker_proc:
+                p.start()
+
+            # write blocks in input order as they are completed
+            pending_blocks = {}
+            next_block = 0
+            finished_workers = 0
+            while finished_workers < self.cpus:
+                try:
+                    block_index, block_sigs = queue_out.get(block=True, timeout=1)
+                except Queue.Empty:
+                    # a block is lost if the reader or a worker fails
+                    if (read_proc.exitcode not in (None, 0)
+                            or any(p.exitcode not in (None, 0) for p in worker_proc)
+                            or not any(p.is_alive() for p in worker_proc)):
+                        raise RuntimeError('Reader or worker processes exited before all sequences were processed.')
+                    continue
+
+                if block_index == None:
+                    finished_workers += 1
+                    continue
+
+                pending_blocks[block_index] = block_sigs
+                while next_block in pending_blocks:
+                    block_sigs = pending_blocks.pop(next_block)
+                    next_block += 1
+
+                    matrix = np.array([sig for _seq_id, sig, _cache_entry, _seq_stats in block_sigs], dtype=np.float32)
+                    fout_npy.write(matrix.tostring())
+                    for seq_id, sig, cache_entry, _seq_stats in block_sigs:
+                        self._update_cache_stats(sig, cache_entry)
+                        seq_ids.append(seq_id)
+                        if fout_tsv:
+                            fout_tsv.write(seq_id + '\t')
+                            fout_tsv.write('\t'.join(map(str, sig)))
+                            fout_tsv.write('\n')
+
+                    num_seqs += len(block_sigs)
+                    if not self.logger.is_silent:
+                        sys.stderr.write('  Finished processing %d sequences.\r' % num_seqs)
+                        sys.stderr.flush()
+
+            read_proc.join()
+            for p in worker_proc:
+                p.join()
+        except:
+            print traceback.format_exc()
+            read_proc.terminate()
+            for p in worker_proc:
+                p.terminate()
+            sys.exit()
+
+        if not self.logger.is_silent:
+            sys.stderr.write('\n')
+
+        # set number of signatures in header
+        fout_npy.seek(0)
+        fout_npy.write(self._npy_header(num_seqs))
+        fout_npy.close()
+        self._write_id_index(seq_ids, output_file)
+        if fout_tsv:
+            fout_tsv.close()
+
+        self._write_cache()
+
+    def benchmark(self, seq_file):
+        """Compare runtime of signature engines on a set of sequences.
+
+        Signatures from both engines are also checked to be identical.
+
+        Parameters
+        ----------
+        seq_file : str
+            Name of fasta/q file to read.
+
+        Returns
+        -------
+        dict : d[engine] -> runtime in seconds
+            Runtime of each engine.
+        """
+
+        seqs = [seq_info for seq_info in seq_io.read_seq(seq_file)]
+        num_bases = sum([len(seq) for _seq_id, seq in seqs])
+
+        cur_engine = self.engine
+        runtime = {}
+        engine_sigs = {}
+        for engine in ['biolib', 'numpy']:
+            self.engine = engine
+            start = time.time()
+            engine_sigs[engine] = [self._producer(seq_info) for seq_info in seqs]
+            runtime[engine] = time.time() - start
+
+            self.logger.info('Engine %s: %.2f s (%.2f Mbp/s)' % (engine,
+                                                                    runtime[engine],
+                                                                    num_bases / max(runtime[engine], 1e-9) / 1e6))
+        self.engine = cur_engine
+
+        if engine_sigs['biolib'] != engine_sigs['numpy']:
+            self.logger.error('Signatures from biolib and numpy engines differ.')
+        else:
+            self.logger.info('Signatures from both engines are identical (%.1fx speedup).' % (runtime['biolib'] / max(runtime['numpy'], 1e-9)))
+
+        return runtime
+
     def read(self, signature_file):
         """Read tetranucleotide signatures.
 
+        Signatures in the binary format (.npy) are memory-mapped
+        rather than parsed.
+
         Parameters
         ----------
         signature_file : str
@@ -163,6 +658,9 @@ class Tetranucleotide(object):
             Count of each kmer.
         """
 
+        if signature_file.endswith('.npy'):
+            return self.read_binary(signature_file)
+
         try:
             sig = {}
             with open(signature_file) as f:
@@ -212,3 +710,89 @@ class Tetranucleotide(object):
             fout.write('\n')
 
         fout.close()
+
+    def _id_files(self, signature_file):
+        """Names of sorted scaffold id and row files for binary signature file."""
+        prefix = os.path.splitext(signature_file)[0]
+        return prefix + '.ids.npy', prefix + '.rows.npy'
+
+    def _write_id_index(self, seq_ids, signature_file):
+        """Write index of scaffold ids for binary signature file.
+
+        Parameters
+        ----------
+        seq_ids : list
+            Unique id of sequence in each row of the signature matrix.
+        signature_file : str
+            Name of binary signature file (.npy).
+        """
+
+        seq_ids = np.array(seq_ids, dtype='S%d' % max([len(seq_id) for seq_id in seq_ids] + [1]))
+        sorted_rows = np.argsort(seq_ids, kind='mergesort')
+
+        id_file, row_file = self._id_files(signature_file)
+        np.save(id_file, seq_ids[sorted_rows])
+        np.save(row_file, sorted_rows.astype(np.int64))
+
+    def write_binary(self, signatures, output_file):
+        """Write tetranucleotide signatures in binary format.
+
+        Signatures are written as a float32 matrix in canonical
+        order to a .npy file. Scaffold ids are written in sorted
+        order to a .ids.npy file with the same prefix, along with
+        the row of each sorted id to a .rows.npy file.
+
+        Parameters
+        ----------
+        signatures : d[seq_id] -> tetranucleotide signature in canonical order
+            Count of each kmer.
+        output_file : str
+            Name of output file (.npy).
+        """
+
+        seq_ids = signatures.keys()
+        matrix = np.lib.format.open_memmap(output_file,
+                                            mode='w+',
+                                            dtype=np.float32,
+                                            shape=(len(seq_ids), len(self.canonical_order())))
+        for i, seq_id in enumerate(seq_ids):
+            matrix[i] = signatures[seq_id]
+        matrix.flush()
+        del matrix
+
+        self._write_id_index(seq_ids, output_file)
+
+    def read_binary(self, signature_file):
+        """Read tetranucleotide signatures in binary format.
+
+        The signatures and index of scaffold ids are memory-mapped.
+
+        Parameters
+        ----------
+        signature_file : str
+            Name of file to read (.npy).
+
+        Returns
+        -------
+        SignatureStore : d[seq_id] -> tetranucleotide signature in canonical order
+            Memory-mapped signatures.
+        """
+
+        id_file, row_file = self._id_files(signature_file)
+        try:
+            matrix = np.load(signature_file, mmap_mode='r')
+            sorted_ids = np.load(id_file, mmap_mode='r')
+            sorted_rows = np.load(row_file, mmap_mode='r')
+        except (IOError, ValueError):
+            self.logger.error('Failed to open signature file: %s' % signature_file)
+            sys.exit()
+
+        if matrix.ndim != 2 or matrix.shape[1] != len(self.canonical_order()):
+            self.logger.error('Binary signature file must contain exactly %d tetranucleotide columns: %s' % (len(self.canonical_order()), signature_file))
+            sys.exit()
+
+        if matrix.shape[0] != len(sorted_ids) or len(sorted_ids) != len(sorted_rows):
+            self.logger.error('Number of signatures does not match number of scaffold ids in: %s' % id_file)
+            sys.exit()
+
+        return SignatureStore(ScaffoldIdIndex(sorted_ids, sorted_rows), matrix)